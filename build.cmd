@@ -2,8 +2,13 @@
 
 call ./.venv/Scripts/activate
 
-pyinstaller --onefile --noconsole --path ./ --exclude-module pyqt5-tools --name qt_test_app ./src/main.py
+rem build.cmd onedir - сборка в каталог: запускается быстрее, так как не распаковывается при каждом запуске
+if "%1"=="onedir" (
+    pyinstaller --onedir --noconsole --noupx --noconfirm --path ./ --exclude-module pyqt5-tools --exclude-module tkinter --name qt_test_app ./src/main.py
+) else (
+    pyinstaller --onefile --noconsole --path ./ --exclude-module pyqt5-tools --name qt_test_app ./src/main.py
+)
 
 call ./.venv/Scripts/deactivate
 
-pause
\ No newline at end of file
+pause
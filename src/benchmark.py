@@ -0,0 +1,407 @@
+'''
+Набор замеров производительности модели, ввода-вывода и графика без отображения окна.
+
+Запуск: python -m src.benchmark --sizes 1000 10000 100000 1000000 --output results.json
+Результаты выводятся в формате JSON (время каждого повтора и пиковая память),
+для сравнения запусков на разных коммитах.
+'''
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable
+
+# Замеры выполняются без отображения окна, в том числе на системах без дисплея
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtCore, QtWidgets
+import h5py
+import numpy
+
+from src.cli import parse_fanout
+from src.models import TreeViewModel
+from src.tools import gen_random_flat_tree, hdf5_read_recursive, hdf5_write_recursive, read_tree, write_tree
+from src.tree_store import flat_to_nested
+from src.views import MainView
+from src.workers import LoadTask, SaveTask, StoreSaveTask
+
+
+# Размеры дерева по умолчанию
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+# Количество редактируемых "Лепестков" в замерах распространения изменений
+EDIT_COUNT = 1000
+
+# Доля удаляемых элементов в замере массового удаления
+DELETE_FRACTION = 0.1
+
+# Прежний рекурсивный формат hdf5 замеряется только на небольших деревьях
+LEGACY_MAX_SIZE = 10_000
+
+
+class Bench:
+    '''Окружение замеров для одного набора параметров дерева'''
+
+    def __init__(self, view: MainView, shape: dict, seed: int, work_dir: str):
+        self.view = view
+        self.model = view.model
+
+        # Параметры генерации дерева: size, seed, max_depth, fanout_min, fanout_max
+        self.shape = shape
+        self.flat = gen_random_flat_tree(**shape)
+
+        self.random = numpy.random.default_rng(seed)
+        self.work_dir = work_dir
+
+
+    def path(self, name: str) -> str:
+        '''Путь к временному файлу замера'''
+
+        return os.path.join(self.work_dir, name)
+
+
+    def leaves(self, count: int) -> numpy.ndarray:
+        '''Случайные "Лепестки" загруженного дерева'''
+
+        store = self.model.store
+        ids = numpy.arange(1, store.size)
+        ids = ids[(store.parent[1:store.size] != -1) & (store.child_count[1:store.size] == 0)]
+
+        return self.random.choice(ids, min(count, len(ids)), replace=False)
+
+
+# Замер: функция подготовки, получающая окружение и возвращающая замеряемую функцию.
+# Подготовка выполняется перед каждым повтором и в замер не входит.
+Case = Callable[[Bench], Callable[[], object]]
+
+
+def case_generate(bench: Bench):
+
+    return lambda: gen_random_flat_tree(**bench.shape)
+
+
+def case_load_flat(bench: Bench):
+
+    return lambda: bench.model.load_flat(bench.flat)
+
+
+def case_load_nested(bench: Bench):
+
+    data = flat_to_nested(bench.flat)
+    return lambda: bench.model.load_data(data)
+
+
+def case_get_data(bench: Bench):
+
+    bench.model.load_flat(bench.flat)
+    return bench.model.get_data
+
+
+def edits(bench: Bench) -> list[tuple[QtCore.QModelIndex, str]]:
+    '''Подготовить изменения значений случайных "Лепестков" на загруженном дереве'''
+
+    bench.model.load_flat(bench.flat)
+    store = bench.model.store
+
+    return [
+        (bench.model.index_from_node(int(node)), str(int(store.value[node]) + 1))
+        for node in bench.leaves(EDIT_COUNT)
+    ]
+
+
+def case_edit(bench: Bench):
+    '''Изменения по одному, каждое со своим обновлением предков и графика'''
+
+    changes = edits(bench)
+
+    def run():
+        for index, value in changes:
+            bench.model.setData(index, value)
+
+    return run
+
+
+def case_edit_batch(bench: Bench):
+    '''Те же изменения одним пакетом'''
+
+    changes = edits(bench)
+
+    def run():
+        with bench.model.batch():
+            for index, value in changes:
+                bench.model.setData(index, value)
+
+    return run
+
+
+def case_legacy_recompute(bench: Bench):
+    '''Пересчет сумм предков через update_item_parents_data'''
+
+    changes = edits(bench)
+    return lambda: [bench.model.update_item_parents_data(index) for index, _ in changes]
+
+
+def case_bulk_delete(bench: Bench):
+
+    bench.model.load_flat(bench.flat)
+    store = bench.model.store
+
+    count = max(1, int(len(store) * DELETE_FRACTION))
+    nodes = bench.random.choice(numpy.arange(1, store.size), count, replace=False)
+    indexes = [bench.model.index_from_node(int(node)) for node in nodes]
+
+    return lambda: bench.model.delete_items(indexes)
+
+
+def file_roundtrip(bench: Bench, file_type: str):
+    '''Запись и чтение файла теми же задачами, что и в приложении, но в текущем потоке'''
+
+    path = bench.path('tree' + file_type[1:])
+
+    def run():
+        SaveTask(path, file_type, bench.flat).work()
+        return LoadTask(path, file_type).work()
+
+    return run
+
+
+def case_json_roundtrip(bench: Bench):
+
+    return file_roundtrip(bench, '*.json')
+
+
+def case_hdf5_roundtrip(bench: Bench):
+
+    return file_roundtrip(bench, '*.hdf5')
+
+
+def file_load(bench: Bench, file_type: str, jobs: int | None):
+    '''Чтение файла в текущем процессе (jobs=1) или, для больших файлов, по частям в пуле процессов'''
+
+    path = bench.path('load' + file_type[1:])
+    write_tree(path, file_type, bench.flat)
+
+    return lambda: read_tree(path, file_type, jobs=jobs)
+
+
+def case_json_load(bench: Bench):
+
+    return file_load(bench, '*.json', 1)
+
+
+def case_json_parallel_load(bench: Bench):
+
+    return file_load(bench, '*.json', None)
+
+
+def case_hdf5_legacy_roundtrip(bench: Bench):
+
+    data = flat_to_nested(bench.flat)
+    path = bench.path('legacy.hdf5')
+
+    def run():
+        with h5py.File(path, 'w') as file:
+            hdf5_write_recursive(file, data)
+        with h5py.File(path, 'r') as file:
+            return hdf5_read_recursive(file)
+
+    return run
+
+
+def case_hdf5_store_save(bench: Bench):
+    '''Полная запись хранилища в файл hdf5 в формате хранилища'''
+
+    bench.model.load_flat(bench.flat)
+    path = bench.path('store.hdf5')
+
+    return lambda: StoreSaveTask(path, *bench.model.store_patch(path)).work()
+
+
+def case_hdf5_incremental_save(bench: Bench):
+    '''Изменение одного "Лепестка" и повторная запись в тот же файл hdf5 в формате хранилища'''
+
+    bench.model.load_flat(bench.flat)
+    path = bench.path('store.hdf5')
+    bench.model.end_save(path, StoreSaveTask(path, *bench.model.store_patch(path)).work())
+
+    node = int(bench.leaves(1)[0])
+
+    def run():
+        bench.model.setData(bench.model.index_from_node(node), str(int(bench.model.store.value[node]) + 1))
+        bench.model.end_save(path, StoreSaveTask(path, *bench.model.store_patch(path)).work())
+
+    return run
+
+
+def case_graph_refresh(bench: Bench):
+
+    bench.model.load_flat(bench.flat)
+    return bench.view.update_graph
+
+
+CASES: dict[str, Case] = {
+    'generate': case_generate,
+    'load_flat': case_load_flat,
+    'load_nested': case_load_nested,
+    'get_data': case_get_data,
+    'edit': case_edit,
+    'edit_batch': case_edit_batch,
+    'legacy_recompute': case_legacy_recompute,
+    'bulk_delete': case_bulk_delete,
+    'json_roundtrip': case_json_roundtrip,
+    'hdf5_roundtrip': case_hdf5_roundtrip,
+    'json_load': case_json_load,
+    'json_parallel_load': case_json_parallel_load,
+    'hdf5_legacy_roundtrip': case_hdf5_legacy_roundtrip,
+    'hdf5_store_save': case_hdf5_store_save,
+    'hdf5_incremental_save': case_hdf5_incremental_save,
+    'graph_refresh': case_graph_refresh,
+}
+
+
+def measure(bench: Bench, case: Case, repeat: int, memory: bool) -> dict:
+    '''Замерить время повторов и пиковую память одного выполнения'''
+
+    times = []
+
+    for _ in range(repeat):
+        run = case(bench)
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+
+    result = {
+        'times': times,
+        'best': min(times),
+        'median': statistics.median(times),
+    }
+
+    # Память замеряется отдельным выполнением: трассировка заметно замедляет код на Python
+    if memory:
+        run = case(bench)
+        tracemalloc.start()
+        run()
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def max_rss() -> int | None:
+    '''Пиковый размер резидентной памяти процесса в байтах, если доступен'''
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # В Linux ru_maxrss в килобайтах, в macOS - в байтах
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def git_commit() -> str | None:
+    '''Текущий коммит репозитория, если замеры запущены из рабочей копии'''
+
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+
+    parser = argparse.ArgumentParser(description='Замеры производительности модели, ввода-вывода и графика')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='количество элементов дерева')
+    parser.add_argument('--fanouts', type=parse_fanout, nargs='+', default=[(3, 10)], help='количество потомков "Узла", например 3-10')
+    parser.add_argument('--depths', type=int, nargs='+', default=[4], help='максимальная глубина дерева')
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES), help='выполняемые замеры')
+    parser.add_argument('--repeat', type=int, default=3, help='количество повторов каждого замера')
+    parser.add_argument('--seed', type=int, default=0, help='seed генерации деревьев')
+    parser.add_argument('--legacy-max-size', type=int, default=LEGACY_MAX_SIZE, help='наибольший размер для прежнего формата hdf5')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='не замерять пиковую память')
+    parser.add_argument('--output', help='файл результатов JSON (по умолчанию - стандартный вывод)')
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+
+    args = parse_args(argv)
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+
+    # Модель без ленивого заполнения: замеры редактирования обращаются к произвольным элементам
+    view = MainView(TreeViewModel())
+
+    # Окно не отображается, поэтому график строится сразу, а не после первой отрисовки
+    view.setup_graph()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for depth in args.depths:
+            for fanout_min, fanout_max in args.fanouts:
+                for size in args.sizes:
+
+                    shape = dict(size=size, seed=args.seed, max_depth=depth, fanout_min=fanout_min, fanout_max=fanout_max)
+                    bench = Bench(view, shape, args.seed, work_dir)
+
+                    for name in args.cases:
+                        if name == 'hdf5_legacy_roundtrip' and size > args.legacy_max_size:
+                            continue
+
+                        result = {
+                            'case': name,
+                            'size': size,
+                            'fanout': [fanout_min, fanout_max],
+                            'depth': depth,
+                            **measure(bench, CASES[name], args.repeat, args.memory),
+                        }
+                        results.append(result)
+
+                        print(f'{name:>22} size={size:<9} fanout={fanout_min}-{fanout_max} depth={depth} '
+                              f'best={result["best"]:.4f}s', file=sys.stderr)
+
+                        # Обработка отложенных событий, чтобы они не попали в следующий замер
+                        app.processEvents()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'qt': QtCore.QT_VERSION_STR,
+            'h5py': h5py.__version__,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+            'max_rss': max_rss(),
+        },
+        'results': results,
+    }
+
+    text = json.dumps(report, indent=4)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,273 @@
+'''
+Командная строка для пакетной обработки файлов дерева без GUI и без импорта Qt.
+
+    python -m src.cli convert data/ -o out/ --to hdf5 --jobs 4
+    python -m src.cli stats data/example.json --json
+    python -m src.cli generate big.tree --size 1000000 --seed 1
+    python -m src.cli diff old.json new.hdf5
+
+NumPy и h5py импортируются только при выполнении команды, поэтому --help и ошибки аргументов
+обрабатываются без задержки на загрузку модулей.
+'''
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+
+# Расширения файлов по типу файла, для имен результатов конвертации
+EXTENSIONS = {'json': '.json', 'hdf5': '.hdf5', 'tree': '.tree'}
+
+
+def collect_files(paths: list[str]) -> list[str]:
+    '''Файлы для обработки: указанные файлы и файлы известных типов из указанных каталогов'''
+
+    from src.tools import FILE_TYPES
+
+    files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if os.path.splitext(name)[1].lower() in FILE_TYPES and os.path.isfile(os.path.join(path, name))
+            )
+        else:
+            files.append(path)
+
+    return files
+
+
+def run_jobs(function: Callable, jobs: list[tuple], workers: int) -> list:
+    '''Выполнить задания в пуле процессов (одно задание или один процесс - в текущем процессе)'''
+
+    if workers == 1 or len(jobs) <= 1:
+        return [function(*job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers or None) as executor:
+        return list(executor.map(function, *zip(*jobs)))
+
+
+def read_jobs(files: list[str], jobs: int) -> int:
+    '''Процессы разбора одного файла: один файл разбирается по частям пулом, несколько - каждый в своем процессе'''
+
+    return jobs if len(files) == 1 else 1
+
+
+def convert_file(source: str, target: str, compact: bool, jobs: int = 1) -> dict:
+    '''Конвертировать один файл, тип определяется по расширениям, jobs - процессы разбора большого файла'''
+
+    from src.tools import file_type_of, read_tree, write_tree
+
+    try:
+        store = read_tree(source, file_type_of(source), jobs=jobs)
+
+        # Конвертация файла дерева в себя же: отображение исходного файла освобождается до его замены
+        store.detach(target)
+        write_tree(target, file_type_of(target), store.to_flat(), compact)
+    except Exception as error:
+        return {'file': source, 'error': str(error)}
+
+    return {'file': source, 'target': target, 'nodes': len(store)}
+
+
+def file_stats(path: str, jobs: int = 1) -> dict:
+    '''Статистика одного файла: количество элементов, сумма дерева и средние значения по уровням'''
+
+    from src.tools import file_type_of, read_tree
+
+    try:
+        store = read_tree(path, file_type_of(path), jobs=jobs)
+    except Exception as error:
+        return {'file': path, 'error': str(error)}
+
+    levels, averages = store.level_averages()
+
+    return {
+        'file': path,
+        'nodes': len(store),
+        'leaves': int((store.child_count[1:store.size][store.parent[1:store.size] != -1] == 0).sum()),
+        'sum': int(store.sum[0]),
+        'levels': levels.tolist(),
+        'level_averages': averages.tolist(),
+    }
+
+
+def generate_file(path: str, size: int, seed: int | None, depth: int, fanout: tuple[int, int], compact: bool) -> dict:
+    '''Сгенерировать файл с рандомным деревом'''
+
+    from src.tools import file_type_of, gen_random_flat_tree, write_tree
+
+    try:
+        flat = gen_random_flat_tree(size, seed, depth, *fanout)
+        write_tree(path, file_type_of(path), flat, compact)
+    except Exception as error:
+        return {'file': path, 'error': str(error)}
+
+    return {'file': path, 'nodes': len(flat.levels), 'seed': seed}
+
+
+def diff_files(first: str, second: str) -> dict:
+    '''Различия двух файлов: добавленные, удаленные и измененные элементы с путями от корня'''
+
+    from src.diff import DIFF_STATUSES, diff_trees
+    from src.tools import file_type_of, read_tree
+
+    try:
+        diff = diff_trees(read_tree(first, file_type_of(first)), read_tree(second, file_type_of(second)))
+    except Exception as error:
+        return {'file': first, 'error': str(error)}
+
+    changes = []
+    path: list[int] = []
+
+    for level, status, row, first_sum, second_sum in zip(*(column.tolist() for column in (diff.levels, diff.status, diff.rows, diff.first_sum, diff.second_sum))):
+        path[level:] = [row]
+        changes.append({
+            'status': DIFF_STATUSES[status],
+            'path': list(path),
+            'first_sum': first_sum,
+            'second_sum': second_sum,
+            'delta': second_sum - first_sum,
+        })
+
+    return {'file': first, 'second': second, 'changes': changes}
+
+
+def report(results: list[dict], as_json: bool, describe: Callable[[dict], str]) -> int:
+    '''Вывести результаты и вернуть код завершения: 1, если хотя бы одно задание завершилось ошибкой'''
+
+    if as_json:
+        print(json.dumps(results, indent=4, ensure_ascii=False))
+
+    for result in results:
+        if 'error' in result:
+            print(f'{result["file"]}: ошибка: {result["error"]}', file=sys.stderr)
+        elif not as_json:
+            print(describe(result))
+
+    return int(any('error' in result for result in results))
+
+
+def command_convert(args: argparse.Namespace) -> int:
+
+    files = collect_files(args.sources)
+    extension = EXTENSIONS[args.to] if args.to else None
+
+    # Один исходный файл и путь результата с расширением - результат записывается в этот файл,
+    # иначе результаты записываются в каталог с именами исходных файлов
+    if len(files) == 1 and not os.path.isdir(args.output) and os.path.splitext(args.output)[1]:
+        targets = [args.output]
+    else:
+        if extension is None:
+            raise SystemExit('Для записи в каталог укажите тип результата: --to')
+
+        os.makedirs(args.output, exist_ok=True)
+        targets = [
+            os.path.join(args.output, os.path.splitext(os.path.basename(file))[0] + extension)
+            for file in files
+        ]
+
+    results = run_jobs(convert_file, [(file, target, args.compact, read_jobs(files, args.jobs)) for file, target in zip(files, targets)], args.jobs)
+
+    return report(results, args.json, lambda result: f'{result["file"]} -> {result["target"]}: {result["nodes"]} элементов')
+
+
+def command_stats(args: argparse.Namespace) -> int:
+
+    files = collect_files(args.sources)
+    results = run_jobs(file_stats, [(file, read_jobs(files, args.jobs)) for file in files], args.jobs)
+
+    def describe(result: dict) -> str:
+        averages = ', '.join(f'{level}: {average:.3f}' for level, average in zip(result['levels'], result['level_averages']))
+        return f'{result["file"]}: {result["nodes"]} элементов, {result["leaves"]} лепестков, сумма {result["sum"]}, средние по уровням {{{averages}}}'
+
+    return report(results, args.json, describe)
+
+
+def command_generate(args: argparse.Namespace) -> int:
+
+    # Для нескольких файлов seed увеличивается на единицу для каждого следующего файла
+    jobs = [
+        (path, args.size, None if args.seed is None else args.seed + n, args.depth, args.fanout, args.compact)
+        for n, path in enumerate(args.outputs)
+    ]
+    results = run_jobs(generate_file, jobs, args.jobs)
+
+    return report(results, args.json, lambda result: f'{result["file"]}: {result["nodes"]} элементов')
+
+
+def command_diff(args: argparse.Namespace) -> int:
+
+    result = diff_files(args.first, args.second)
+
+    def describe(result: dict) -> str:
+        if not result['changes']:
+            return f'{result["file"]} и {result["second"]}: деревья совпадают'
+
+        return '\n'.join(
+            f'{change["status"]:8} /{"/".join(map(str, change["path"]))}: {change["first_sum"]} -> {change["second_sum"]} ({change["delta"]:+d})'
+            for change in result['changes']
+        )
+
+    return report([result], args.json, describe)
+
+
+def parse_fanout(text: str) -> tuple[int, int]:
+    '''Диапазон количества потомков "Узла" вида "3-10" или "5"'''
+
+    low, _, high = text.partition('-')
+    return int(low), int(high or low)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+
+    # Общие параметры команд
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--jobs', '-j', type=int, default=0, help='количество процессов (по умолчанию - по числу ядер)')
+    common.add_argument('--json', action='store_true', help='вывод результатов в формате JSON')
+
+    parser = argparse.ArgumentParser(prog='python -m src.cli', description='Пакетная обработка файлов дерева без GUI')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    convert = commands.add_parser('convert', parents=[common], help='конвертировать файлы между форматами json, hdf5 и tree')
+    convert.add_argument('sources', nargs='+', help='исходные файлы или каталоги')
+    convert.add_argument('--output', '-o', required=True, help='файл или каталог результата')
+    convert.add_argument('--to', choices=EXTENSIONS, help='тип результата при записи в каталог')
+    convert.add_argument('--compact', action='store_true', help='JSON без отступов')
+    convert.set_defaults(handler=command_convert)
+
+    stats = commands.add_parser('stats', parents=[common], help='количество элементов, сумма дерева и средние значения по уровням')
+    stats.add_argument('sources', nargs='+', help='файлы или каталоги')
+    stats.set_defaults(handler=command_stats)
+
+    generate = commands.add_parser('generate', parents=[common], help='сгенерировать файлы с рандомными деревьями')
+    generate.add_argument('outputs', nargs='+', help='файлы результата, тип - по расширению')
+    generate.add_argument('--size', type=int, default=1000, help='количество элементов дерева')
+    generate.add_argument('--seed', type=int, help='seed генерации')
+    generate.add_argument('--depth', type=int, default=4, help='максимальная глубина дерева')
+    generate.add_argument('--fanout', type=parse_fanout, default=(3, 10), help='количество потомков "Узла", например 3-10')
+    generate.add_argument('--compact', action='store_true', help='JSON без отступов')
+    generate.set_defaults(handler=command_generate)
+
+    diff = commands.add_parser('diff', help='различия двух файлов: добавленные, удаленные и измененные элементы')
+    diff.add_argument('first', help='первый файл')
+    diff.add_argument('second', help='второй файл')
+    diff.add_argument('--json', action='store_true', help='вывод результатов в формате JSON')
+    diff.set_defaults(handler=command_diff)
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+
+    args = parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import difflib
+from typing import NamedTuple
+
+import numpy
+
+from src.tree_store import TreeStore
+
+
+# Состояния элементов в различиях деревьев
+DIFF_CHANGED = 0
+DIFF_ADDED = 1
+DIFF_REMOVED = 2
+DIFF_STATUSES = ('changed', 'added', 'removed')
+
+# Наибольшее произведение длин списков потомков, для которого потомки сопоставляются поиском
+# общей подпоследовательности; для больших списков - по номерам строк
+DIFF_MATCH_LIMIT = 1 << 22
+
+# Константы хеширования: "Лепесток", "Узел" и множитель номера строки потомка
+HASH_LEAF = numpy.uint64(0x9E3779B97F4A7C15)
+HASH_NODE = numpy.uint64(0xC2B2AE3D27D4EB4F)
+HASH_ROW = numpy.uint64(0x165667B19E3779F9)
+
+
+class TreeDiff(NamedTuple):
+    '''
+    Различия двух деревьев в плоском виде, записи в порядке прямого обхода.
+    levels - уровень вложенности записи, status - DIFF_CHANGED, DIFF_ADDED или DIFF_REMOVED,
+    rows - номер строки элемента во втором дереве (удаленного - в первом),
+    first, second - идентификаторы элемента в хранилищах деревьев (-1 - элемента нет),
+    first_sum, second_sum - суммы элемента в деревьях (0 - элемента нет)
+    '''
+
+    levels: numpy.ndarray
+    status: numpy.ndarray
+    rows: numpy.ndarray
+    first: numpy.ndarray
+    second: numpy.ndarray
+    first_sum: numpy.ndarray
+    second_sum: numpy.ndarray
+
+
+def mix64(values: numpy.ndarray) -> numpy.ndarray:
+    '''Перемешивание 64-битных значений (финализатор splitmix64), переполнение - по модулю 2**64'''
+
+    values = values ^ (values >> numpy.uint64(30))
+    values = values * numpy.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> numpy.uint64(27))
+    values = values * numpy.uint64(0x94D049BB133111EB)
+
+    return values ^ (values >> numpy.uint64(31))
+
+
+def subtree_hashes(store: TreeStore) -> numpy.ndarray:
+    '''
+    Хеши поддеревьев (дерево Меркла), индексируемые идентификатором элемента (0 - все дерево).
+    Хеш "Лепестка" зависит от значения, хеш "Узла" - от хешей потомков и их порядка,
+    поэтому одинаковые поддеревья имеют одинаковые хеши независимо от идентификаторов и формата файла.
+    '''
+
+    hashes = numpy.zeros(store.size, dtype=numpy.uint64)
+
+    def combine(nodes: numpy.ndarray):
+        children = store.gather_children(nodes)
+        counts = store.child_count[nodes]
+
+        # Сумма перемешанных хешей потомков с учетом номера строки: порядок потомков влияет на хеш
+        terms = mix64(hashes[children] + store.row[children].astype(numpy.uint64) * HASH_ROW)
+        totals = numpy.add.reduceat(terms, numpy.cumsum(counts) - counts) if len(terms) else numpy.zeros(len(nodes), dtype=numpy.uint64)
+        hashes[nodes] = mix64(totals + counts.astype(numpy.uint64) * HASH_NODE)
+
+    # Снизу вверх, по одному проходу на уровень
+    for nodes in reversed(store.level_order()):
+        leaf = store.child_count[nodes] == 0
+        leaves = nodes[leaf]
+        hashes[leaves] = mix64(store.value[leaves].view(numpy.uint64) ^ HASH_LEAF)
+
+        if not leaf.all():
+            combine(nodes[~leaf])
+
+    combine(numpy.zeros(1, dtype=numpy.int64))
+
+    return hashes
+
+
+def match_children(first: numpy.ndarray, second: numpy.ndarray) -> list[tuple[int, int]]:
+    '''
+    Сопоставить потомков по хешам поддеревьев: пары (строка в первом, строка во втором) в порядке строк,
+    -1 - элемента нет в одном из деревьев. Совпадающие поддеревья в результат не входят.
+    '''
+
+    # Общие начало и конец списков сравниваются целиком, без поиска
+    length = min(len(first), len(second))
+    same = first[:length] == second[:length]
+    prefix = length if same.all() else int(numpy.argmin(same))
+
+    length -= prefix
+    same = first[len(first) - length:][::-1] == second[len(second) - length:][::-1]
+    suffix = length if same.all() else int(numpy.argmin(same))
+
+    first = first[prefix:len(first) - suffix]
+    second = second[prefix:len(second) - suffix]
+
+    if len(first) * len(second) <= DIFF_MATCH_LIMIT:
+        opcodes = difflib.SequenceMatcher(None, first.tolist(), second.tolist(), autojunk=False).get_opcodes()
+    else:
+        opcodes = [('replace', 0, len(first), 0, len(second))]
+
+    pairs = []
+
+    for tag, first_start, first_end, second_start, second_end in opcodes:
+        if tag == 'equal':
+            continue
+
+        # Замененные строки сопоставляются по порядку, лишние считаются удаленными или добавленными
+        count = min(first_end - first_start, second_end - second_start)
+        pairs.extend((prefix + first_start + n, prefix + second_start + n) for n in range(count))
+        pairs.extend((prefix + row, -1) for row in range(first_start + count, first_end))
+        pairs.extend((-1, prefix + row) for row in range(second_start + count, second_end))
+
+    return pairs
+
+
+def diff_trees(first: TreeStore, second: TreeStore) -> TreeDiff:
+    '''
+    Различия двух деревьев: добавленные, удаленные и измененные элементы со своими суммами.
+    Поддеревья с совпадающими хешами пропускаются без обхода, добавленные и удаленные поддеревья
+    представлены только своими верхними элементами, поэтому время сравнения после расчета хешей
+    пропорционально размеру измененных частей.
+    '''
+
+    first_hashes = subtree_hashes(first)
+    second_hashes = subtree_hashes(second)
+
+    entries: list[tuple[int, int, int, int, int]] = []
+
+    # Обход в прямом порядке: (уровень, элемент первого дерева, элемент второго дерева)
+    stack = [(-1, 0, 0)] if first_hashes[0] != second_hashes[0] else []
+
+    while stack:
+        level, first_node, second_node = stack.pop()
+
+        if level >= 0:
+            if first_node == -1:
+                entries.append((level, DIFF_ADDED, int(second.row[second_node]), -1, second_node))
+                continue
+            if second_node == -1:
+                entries.append((level, DIFF_REMOVED, int(first.row[first_node]), first_node, -1))
+                continue
+
+            entries.append((level, DIFF_CHANGED, int(second.row[second_node]), first_node, second_node))
+
+        first_children = first.children_of(first_node)
+        second_children = second.children_of(second_node)
+
+        pairs = match_children(first_hashes[first_children], second_hashes[second_children])
+
+        # Потомки кладутся в стек в обратном порядке, чтобы обходиться в порядке строк
+        for first_row, second_row in reversed(pairs):
+            stack.append((
+                level + 1,
+                int(first_children[first_row]) if first_row != -1 else -1,
+                int(second_children[second_row]) if second_row != -1 else -1,
+            ))
+
+    columns = list(zip(*entries)) if entries else [()] * 5
+    levels, status, rows, first_ids, second_ids = (numpy.array(column, dtype=numpy.int64) for column in columns)
+
+    return TreeDiff(
+        levels.astype(numpy.int32),
+        status.astype(numpy.uint8),
+        rows,
+        first_ids,
+        second_ids,
+        numpy.where(first_ids >= 0, first.sum[numpy.maximum(first_ids, 0)], 0),
+        numpy.where(second_ids >= 0, second.sum[numpy.maximum(second_ids, 0)], 0),
+    )
+
+
+def diff_summary(diff: TreeDiff) -> dict[str, int]:
+    '''Количество записей различий по состояниям'''
+
+    counts = numpy.bincount(diff.status, minlength=len(DIFF_STATUSES))
+    return dict(zip(DIFF_STATUSES, counts.tolist()))
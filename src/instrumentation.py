@@ -0,0 +1,204 @@
+import contextlib
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+
+
+# Переменные окружения: включение замеров, каталог сохранения профилей
+# и имя операции, следующий вызов которой записывается через cProfile
+PROFILE_ENV = 'TREE_APP_PROFILE'
+PROFILE_DIR_ENV = 'TREE_APP_PROFILE_DIR'
+PROFILE_CAPTURE_ENV = 'TREE_APP_PROFILE_CAPTURE'
+
+
+class OperationStats:
+    '''Счетчики одной операции: количество вызовов, суммарное и наибольшее время, затронутые элементы'''
+
+    __slots__ = ('calls', 'total', 'max', 'nodes')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.nodes = 0
+
+
+    def add(self, elapsed: float, nodes: int):
+
+        self.calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        self.nodes += nodes
+
+
+    def as_dict(self) -> dict:
+
+        return {'calls': self.calls, 'total': self.total, 'max': self.max, 'nodes': self.nodes}
+
+
+class Profiler:
+    '''
+    Сбор времени выполнения и счетчиков операций приложения.
+    По умолчанию выключен, в выключенном состоянии замеряемые операции вызываются без накладных расходов.
+    Операции выполняются и в фоновых потоках, поэтому счетчики обновляются под блокировкой.
+    '''
+
+    def __init__(self, enabled: bool = False, profile_dir: str = 'profile', capture: str | None = None):
+
+        self.enabled = enabled
+
+        # Каталог, в который сохраняются профили
+        self.profile_dir = profile_dir
+
+        # Имя операции, следующий вызов которой будет выполнен под cProfile
+        self.capture = capture
+
+        self.stats: dict[str, OperationStats] = {}
+        self.lock = threading.Lock()
+
+
+    def configure(self, enabled: bool | None = None, profile_dir: str | None = None, capture: str | None = None):
+        '''Изменить настройки замеров, параметры None не меняются'''
+
+        if enabled is not None:
+            self.enabled = enabled
+        if profile_dir is not None:
+            self.profile_dir = profile_dir
+        if capture is not None:
+            self.capture = capture
+
+
+    def record(self, name: str, elapsed: float, nodes: int = 0):
+        '''Учесть один вызов операции'''
+
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = OperationStats()
+            stats.add(elapsed, nodes)
+
+
+    def take_capture(self, name: str) -> bool:
+        '''Проверить, нужно ли записать этот вызов операции через cProfile (записывается только один вызов)'''
+
+        with self.lock:
+            if self.capture != name:
+                return False
+
+            self.capture = None
+            return True
+
+
+    @contextlib.contextmanager
+    def timed(self, name: str, nodes: int = 0):
+        '''Замерить время выполнения блока как вызов операции name'''
+
+        if not self.enabled:
+            yield
+            return
+
+        profile = cProfile.Profile() if self.take_capture(name) else None
+        start = time.perf_counter()
+
+        if profile is not None:
+            profile.enable()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            if profile is not None:
+                profile.disable()
+                self.save_capture(name, profile)
+
+            self.record(name, elapsed, nodes)
+
+
+    def snapshot(self) -> dict[str, dict]:
+        '''Копия счетчиков всех операций'''
+
+        with self.lock:
+            return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+
+    def reset(self):
+        '''Сбросить счетчики'''
+
+        with self.lock:
+            self.stats.clear()
+
+
+    def summary(self, limit: int = 10) -> str:
+        '''Текстовая сводка по самым затратным операциям: вызовы, суммарное и наибольшее время в мс'''
+
+        stats = sorted(self.snapshot().items(), key=lambda item: item[1]['total'], reverse=True)[:limit]
+
+        return '\n'.join(
+            f'{name}: {item["calls"]} / {item["total"] * 1000:.1f} / {item["max"] * 1000:.1f}'
+            for name, item in stats
+        )
+
+
+    def profile_path(self, name: str, extension: str) -> str:
+        '''Путь к новому файлу профиля в каталоге профилей'''
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        timestamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+
+        return os.path.join(self.profile_dir, f'{name}-{timestamp}.{extension}')
+
+
+    def save_capture(self, name: str, profile: cProfile.Profile) -> str:
+        '''Сохранить запись cProfile одного вызова операции (открывается через pstats или snakeviz)'''
+
+        path = self.profile_path(name, 'prof')
+        profile.dump_stats(path)
+
+        return path
+
+
+    def dump(self, path: str | None = None) -> str:
+        '''Сохранить счетчики операций в файл JSON, по умолчанию - новый файл в каталоге профилей'''
+
+        path = path or self.profile_path('profile', 'json')
+
+        with open(path, 'w') as file:
+            json.dump({'timestamp': datetime.now().isoformat(), 'operations': self.snapshot()}, file, indent=4)
+
+        return path
+
+
+# Общий сборщик замеров приложения, включается переменной окружения или флагом командной строки
+PROFILER = Profiler(
+    enabled=os.environ.get(PROFILE_ENV, '') not in ('', '0'),
+    profile_dir=os.environ.get(PROFILE_DIR_ENV, 'profile'),
+    capture=os.environ.get(PROFILE_CAPTURE_ENV) or None,
+)
+
+
+def instrumented(name: str, nodes: Callable[..., int] | None = None):
+    '''
+    Декоратор замеряемой операции.
+    nodes - функция от аргументов вызова, возвращающая количество затрагиваемых операцией элементов.
+    '''
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if not PROFILER.enabled:
+                return func(*args, **kwargs)
+
+            with PROFILER.timed(name, nodes(*args, **kwargs) if nodes else 0):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
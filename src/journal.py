@@ -0,0 +1,370 @@
+import contextlib
+import json
+import os
+import struct
+import zlib
+from typing import NamedTuple
+
+import numpy
+
+from src.tree_store import FlatTree
+
+
+# Файл журнала автосохранения: заголовок (сигнатура, версия, длина описания файла дерева),
+# описание файла дерева в JSON и записи изменений. Запись - длина и контрольная сумма тела,
+# тело - поля изменения и массивы: путь, строки и поддеревья в плоском виде (little-endian)
+JOURNAL_MAGIC = b'QTJRNL\r\n'
+JOURNAL_VERSION = 1
+JOURNAL_HEADER = struct.Struct('<8sII')
+JOURNAL_RECORD = struct.Struct('<II')
+JOURNAL_EDIT = struct.Struct('<BqqIQQ')
+
+# Файл журнала располагается рядом с файлом дерева: <файл дерева><суффикс>
+JOURNAL_SUFFIX = '.journal'
+
+# Суффикс журнала, изменения которого не удалось восстановить: он откладывается, чтобы не пропали ни
+# его изменения, ни изменения нового сеанса
+JOURNAL_FAILED_SUFFIX = '.failed'
+
+# Количество действий, которые можно отменить
+JOURNAL_LIMIT = 1000
+
+# Типы изменений, код типа в файле журнала - номер в кортеже
+EDIT_KINDS = ('set', 'insert', 'remove')
+
+
+class Edit(NamedTuple):
+    '''
+    Одно изменение дерева.
+    kind - 'set' (значение "Лепестка"), 'insert' или 'remove' (строки потомков элемента),
+    path - номера строк от корня до "Лепестка" ('set') или до родителя строк ('insert', 'remove'),
+    value - новое значение ('set') или значение родителя, когда у него нет этих строк (он - "Лепесток"),
+    old - прежнее значение ('set'),
+    rows - вставленные или удаленные строки по возрастанию,
+    flat - поддеревья этих строк в плоском виде (уровень 0 - сами строки)
+    '''
+
+    kind: str
+    path: tuple[int, ...]
+    value: int = 0
+    old: int = 0
+    rows: numpy.ndarray | None = None
+    flat: FlatTree | None = None
+
+
+    def inverse(self) -> 'Edit':
+        '''Изменение, отменяющее это изменение'''
+
+        if self.kind == 'set':
+            return self._replace(value=self.old, old=self.value)
+
+        return self._replace(kind='remove' if self.kind == 'insert' else 'insert')
+
+
+def encode_edit(edit: Edit) -> bytes:
+    '''Запись изменения для файла журнала'''
+
+    # Удаленные поддеревья не записываются: при повторе они берутся из дерева
+    flat = edit.flat if edit.kind == 'insert' else None
+    rows = edit.rows if edit.rows is not None else ()
+
+    body = b''.join((
+        JOURNAL_EDIT.pack(EDIT_KINDS.index(edit.kind), edit.value, edit.old, len(edit.path), len(rows), len(flat.levels) if flat else 0),
+        numpy.asarray(edit.path, dtype='<i8').tobytes(),
+        numpy.asarray(rows, dtype='<i8').tobytes(),
+        flat.levels.astype('<i4').tobytes() if flat else b'',
+        flat.values.astype('<i8').tobytes() if flat else b'',
+        flat.nodes.astype(numpy.uint8).tobytes() if flat else b'',
+    ))
+
+    return JOURNAL_RECORD.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_edit(body: bytes) -> Edit:
+    '''Изменение из тела записи файла журнала'''
+
+    kind, value, old, path_length, rows_count, flat_count = JOURNAL_EDIT.unpack_from(body)
+    offset = JOURNAL_EDIT.size
+
+    def take(dtype: str, count: int) -> numpy.ndarray:
+        nonlocal offset
+        array = numpy.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += array.nbytes
+        return array
+
+    path = tuple(take('<i8', path_length).tolist())
+    rows = take('<i8', rows_count).astype(numpy.int64)
+    flat = None
+
+    if flat_count:
+        flat = FlatTree(
+            take('<i4', flat_count).astype(numpy.int32),
+            take('<i8', flat_count).astype(numpy.int64),
+            take('u1', flat_count).astype(numpy.bool_),
+        )
+
+    kind = EDIT_KINDS[kind]
+    return Edit(kind, path, value, old, None if kind == 'set' else rows, flat)
+
+
+class Autosave:
+    '''
+    Журнал автосохранения: изменения дерева после последнего чтения или сохранения файла дерева,
+    дописываемые в файл рядом с ним. После сбоя изменения повторяются поверх того же файла дерева.
+    '''
+
+    def __init__(self):
+
+        # Файл дерева, открытый файл журнала и количество записанных в него изменений
+        self.base_path: str | None = None
+        self.file = None
+        self.count = 0
+
+        # Записи изменений, сделанных после снимка данных для сохранения (None - сохранение не идет)
+        self.pending: list[bytes] | None = None
+
+
+    @staticmethod
+    def journal_path(base_path: str) -> str:
+        '''Путь к файлу журнала файла дерева'''
+
+        return base_path + JOURNAL_SUFFIX
+
+
+    @staticmethod
+    def describe(base_path: str) -> bytes:
+        '''Описание файла дерева, по которому журнал сопоставляется с файлом: размер и время изменения'''
+
+        stat = os.stat(base_path)
+        return json.dumps({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}).encode()
+
+
+    def start(self, base_path: str, records: list[bytes] = ()):
+        '''Начать журнал файла дерева (существующий журнал этого файла заменяется), records - уже сделанные изменения'''
+
+        previous = self.base_path
+        self.close()
+
+        if previous is not None and previous != base_path and os.path.exists(self.journal_path(previous)):
+            os.remove(self.journal_path(previous))
+
+        description = self.describe(base_path)
+        path = self.journal_path(base_path)
+
+        # Новый журнал записывается во временный файл и заменяет прежний целиком
+        with open(path + '.part', 'wb') as file:
+            file.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, JOURNAL_VERSION, len(description)))
+            file.write(description)
+            file.write(b''.join(records))
+        os.replace(path + '.part', path)
+
+        self.base_path = base_path
+        self.file = open(path, 'ab')
+        self.count = len(records)
+
+
+    def write(self, edit: Edit):
+        '''Дописать изменение в журнал'''
+
+        if self.file is None and self.pending is None:
+            return
+
+        record = encode_edit(edit)
+
+        if self.file is not None:
+            self.file.write(record)
+            self.file.flush()
+            self.count += 1
+
+        if self.pending is not None:
+            self.pending.append(record)
+
+
+    def mark(self):
+        '''Отметить снимок данных для сохранения: следующие изменения перейдут в журнал сохраненного файла'''
+
+        self.pending = []
+
+
+    def unmark(self):
+        '''Снимок данных не сохранен (ошибка или отмена записи): изменения пишутся только в журнал открытого файла'''
+
+        self.pending = None
+
+
+    def rebase(self, base_path: str):
+        '''Файл дерева сохранен по снимку: начать его журнал с изменений, сделанных после снимка'''
+
+        records = self.pending or []
+        self.pending = None
+
+        self.start(base_path, records)
+
+
+    def close(self):
+        '''Закрыть журнал. Журнал без изменений удаляется, с изменениями - остается для восстановления'''
+
+        if self.file is None:
+            return
+
+        self.file.close()
+        self.file = None
+
+        if not self.count:
+            os.remove(self.journal_path(self.base_path))
+
+        self.base_path = None
+        self.count = 0
+
+
+    @classmethod
+    def set_aside(cls, base_path: str) -> str:
+        '''Отложить журнал файла дерева под другим именем (прежний отложенный журнал заменяется), вернуть новое имя'''
+
+        path = cls.journal_path(base_path)
+        os.replace(path, path + JOURNAL_FAILED_SUFFIX)
+
+        return path + JOURNAL_FAILED_SUFFIX
+
+
+    @classmethod
+    def recover(cls, base_path: str) -> list[Edit]:
+        '''
+        Прочитать изменения из журнала файла дерева, если журнал относится к текущему состоянию файла.
+        Читаются записи до первой неполной или поврежденной (оборванной сбоем).
+        '''
+
+        path = cls.journal_path(base_path)
+
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            description = cls.describe(base_path)
+        except OSError:
+            return []
+
+        if len(data) < JOURNAL_HEADER.size:
+            return []
+
+        magic, version, length = JOURNAL_HEADER.unpack_from(data)
+        offset = JOURNAL_HEADER.size + length
+
+        if magic != JOURNAL_MAGIC or version > JOURNAL_VERSION or data[JOURNAL_HEADER.size:offset] != description:
+            return []
+
+        edits = []
+
+        while offset + JOURNAL_RECORD.size <= len(data):
+            size, checksum = JOURNAL_RECORD.unpack_from(data, offset)
+            body = data[offset + JOURNAL_RECORD.size:offset + JOURNAL_RECORD.size + size]
+
+            if len(body) < size or zlib.crc32(body) != checksum:
+                break
+
+            edits.append(decode_edit(body))
+            offset += JOURNAL_RECORD.size + size
+
+        return edits
+
+
+class EditJournal:
+    '''
+    Журнал изменений дерева для отмены и повтора: каждое действие пользователя хранится как
+    группа изменений без снимков дерева. Все выполненные изменения, в том числе отмены и повторы,
+    дописываются в журнал автосохранения.
+    '''
+
+    def __init__(self, limit: int = JOURNAL_LIMIT):
+        self.limit = limit
+        self.autosave = Autosave()
+        self.clear()
+
+
+    def clear(self):
+        '''Очистить историю изменений'''
+
+        # Группы изменений действий и количество выполненных (не отмененных) из них
+        self.entries: list[list[Edit]] = []
+        self.position = 0
+
+        # Уровень вложенности группировки и признак уже начатой группы
+        self.group_depth = 0
+        self.group_started = False
+
+        # Выполняются отмена или повтор: изменения не попадают в историю
+        self.replaying = False
+
+
+    def record(self, edit: Edit):
+        '''Учесть выполненное изменение'''
+
+        self.autosave.write(edit)
+
+        if self.replaying:
+            return
+
+        if self.group_depth and self.group_started:
+            self.entries[-1].append(edit)
+            return
+
+        # Новое действие отменяет возможность повтора отмененных
+        del self.entries[self.position:]
+        self.entries.append([edit])
+        del self.entries[:-self.limit]
+        self.position = len(self.entries)
+        self.group_started = self.group_depth > 0
+
+
+    @contextlib.contextmanager
+    def group(self):
+        '''Изменения внутри блока отменяются и повторяются как одно действие'''
+
+        self.group_depth += 1
+        if self.group_depth == 1:
+            self.group_started = False
+
+        try:
+            yield self
+        finally:
+            self.group_depth -= 1
+
+
+    @contextlib.contextmanager
+    def replay(self):
+        '''Выполнение отмены или повтора: изменения пишутся только в журнал автосохранения'''
+
+        self.replaying = True
+        try:
+            yield self
+        finally:
+            self.replaying = False
+
+
+    def can_undo(self) -> bool:
+
+        return self.position > 0
+
+
+    def can_redo(self) -> bool:
+
+        return self.position < len(self.entries)
+
+
+    def undo(self) -> list[Edit]:
+        '''Изменения, отменяющие последнее действие, в порядке выполнения'''
+
+        if not self.can_undo():
+            return []
+
+        self.position -= 1
+        return [edit.inverse() for edit in reversed(self.entries[self.position])]
+
+
+    def redo(self) -> list[Edit]:
+        '''Изменения последнего отмененного действия'''
+
+        if not self.can_redo():
+            return []
+
+        self.position += 1
+        return list(self.entries[self.position - 1])
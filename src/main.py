@@ -1,24 +1,64 @@
+import time
+
+# Начало загрузки модулей приложения, точка отсчета отчета о времени запуска
+START_TIME = time.perf_counter()
+
+import argparse
+import json
+import multiprocessing
 import sys
 
-from PyQt5 import QtWidgets
+from PyQt5 import QtCore, QtWidgets
 
+from src.instrumentation import PROFILER
 from src.models import TreeViewModel
 from src.views import MainView
 
 
 def main():
 
-    app = QtWidgets.QApplication(sys.argv)
+    # Флаги замеров операций и отчета о запуске, остальные аргументы передаются Qt
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--profile', action='store_true', help='включить замеры операций')
+    parser.add_argument('--profile-dir', help='каталог сохранения замеров и профилей')
+    parser.add_argument('--profile-capture', help='операция, следующий вызов которой записывается через cProfile')
+    parser.add_argument('--startup-report', action='store_true', help='вывести время этапов запуска в JSON и завершить работу')
+    args, qt_args = parser.parse_known_args(sys.argv[1:])
+
+    PROFILER.configure(args.profile or None, args.profile_dir, args.profile_capture)
 
-    model = TreeViewModel()
+    # Время этапов запуска в секундах от начала загрузки модулей
+    milestones = {'imports': time.perf_counter() - START_TIME}
+
+    app = QtWidgets.QApplication(sys.argv[:1] + qt_args)
+    milestones['application'] = time.perf_counter() - START_TIME
+
+    # Ленивый режим: элементы дерева создаются при раскрытии узлов
+    model = TreeViewModel(lazy=True)
 
     window = MainView(model)
     window.setWindowTitle('PyQt Test App')
+    milestones['window'] = time.perf_counter() - START_TIME
+
     window.show()
+    milestones['shown'] = time.perf_counter() - START_TIME
+
+    if args.startup_report:
+
+        # График строится после первой отрисовки окна - это последний этап запуска
+        def report():
+            milestones['graph'] = time.perf_counter() - START_TIME
+            print(json.dumps({'startup': milestones}))
+            QtCore.QTimer.singleShot(0, app.quit)
+
+        window.graphReady.connect(report)
 
     sys.exit(app.exec())
 
 
 if __name__ == '__main__':
-    
-    main()
\ No newline at end of file
+
+    # Процессы разбора больших файлов в собранном приложении запускаются тем же исполняемым файлом
+    multiprocessing.freeze_support()
+
+    main()
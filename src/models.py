@@ -1,135 +1,963 @@
-from PyQt5 import QtCore, QtGui, QtWidgets
+import contextlib
 
+from PyQt5 import QtCore, QtGui
 
-class TreeViewModel(QtGui.QStandardItemModel):
+import numpy
+
+from src.diff import DIFF_ADDED, DIFF_REMOVED, TreeDiff, diff_summary
+from src.instrumentation import instrumented
+from src.journal import Edit, EditJournal
+from src.search import SearchIndex
+from src.tools import StorePatch, SyncedFile, store_needs_compaction, store_patch
+from src.tree_store import FlatTree, TreeStore, flat_parents, nested_to_flat
+
+
+class TreeViewModel(QtCore.QAbstractItemModel):
 
     dataUpdated = QtCore.pyqtSignal()
 
-    def __init__(self):
+    # Идентификаторы элементов, поддеревья которых изменились (0 - все дерево), выдается вместе с dataUpdated
+    subtreesUpdated = QtCore.pyqtSignal(object)
+
+    # Роль данных с закешированной суммой элемента в виде int
+    SumRole = QtCore.Qt.UserRole + 1
+
+    # Цвета фона "Узлов" второго уровня с неотрицательной и отрицательной суммой
+    POSITIVE_BACKGROUND = QtGui.QColor('#9CCC65')
+    NEGATIVE_BACKGROUND = QtGui.QColor('#EF5350')
+
+    # Уровень вложенности подсвечиваемых "Узлов" (0 - первый уровень)
+    HIGHLIGHT_DEPTH = 1
+
+    # Количество диапазонов строк, начиная с которого удаление выполняется одним изменением структуры
+    BULK_DELETE_RANGES = 64
+
+    def __init__(self, lazy: bool = False, fetch_batch_size: int = 1000, update_delay: int = 0):
         super().__init__()
 
-        # Установка заголовка
-        self.setHorizontalHeaderLabels(['Дерево'])
+        # Хранилище данных дерева, идентификатор элемента хранится в internalId индекса
+        self.store = TreeStore()
+
+        # Индекс поиска элементов по значению и сумме, обновляется при изменениях модели
+        self.search_index = SearchIndex(self.store)
+
+        # Файл hdf5, совпадающий с данными модели на момент последнего чтения или записи
+        self.synced_file: SyncedFile | None = None
+
+        # Журнал изменений для отмены, повтора и автосохранения
+        self.journal = EditJournal()
+
+        # Ленивый режим: строки передаются представлению порциями, при раскрытии элемента
+        self.lazy = lazy
+        self.fetch_batch_size = fetch_batch_size
+
+        # Пакет изменений: уровень вложенности пакетов, накопленные изменения сумм
+        # ({элемент: изменение суммы элемента и его предков}) и измененные поддеревья
+        self.batch_depth = 0
+        self.pending_deltas: dict[int, int] = {}
+        self.changed_nodes: set[int] = set()
+
+        # Элементы, цвет фона которых изменился во время изменения структуры: сигналы о них
+        # выдаются после завершения пакета, когда индексы представлений уже обновлены
+        self.background_nodes: set[int] = set()
+
+        # Задержка (мс) объединенного сигнала dataUpdated после завершения пакета, 0 - без задержки
+        self.update_delay = update_delay
+        self.update_timer = QtCore.QTimer(self)
+        self.update_timer.setSingleShot(True)
+        self.update_timer.timeout.connect(self.emit_updated)
+
+
+    def node_from_index(self, index: QtCore.QModelIndex) -> int:
+        '''Получить идентификатор элемента хранилища по индексу (0 - корень)'''
+
+        if index is not None and index.isValid():
+            return index.internalId()
+
+        return 0
+
+
+    def index_from_node(self, node: int) -> QtCore.QModelIndex:
+        '''Получить индекс модели по идентификатору элемента хранилища'''
+
+        if node == 0:
+            return QtCore.QModelIndex()
+
+        return self.createIndex(int(self.store.row[node]), 0, int(node))
+
+
+    # QAbstractItemModel
+    def index(self, row: int, column: int, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+
+        node = self.store.child(self.node_from_index(parent), row)
+        return self.createIndex(row, column, node)
+
+
+    def parent(self, index: QtCore.QModelIndex = None):
+
+        # Перегрузка QObject.parent() без аргументов
+        if index is None:
+            return super().parent()
+
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        return self.index_from_node(int(self.store.parent[index.internalId()]))
+
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return 0
+
+        node = self.node_from_index(parent)
+
+        # В ленивом режиме видны только уже полученные представлением строки
+        if self.lazy:
+            return int(self.store.fetched[node])
+
+        return int(self.store.child_count[node])
+
+
+    def columnCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+
+        return 1
+
+
+    def hasChildren(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return False
+
+        return bool(self.store.child_count[self.node_from_index(parent)] > 0)
+
+
+    def canFetchMore(self, parent: QtCore.QModelIndex):
+
+        if not self.lazy or parent.column() > 0:
+            return False
+
+        node = self.node_from_index(parent)
+        return bool(self.store.fetched[node] < self.store.child_count[node])
+
+
+    @instrumented('model.fetchMore')
+    def fetchMore(self, parent: QtCore.QModelIndex):
+
+        if not self.canFetchMore(parent):
+            return
+
+        node = self.node_from_index(parent)
+        fetched = int(self.store.fetched[node])
+        count = min(self.fetch_batch_size, int(self.store.child_count[node]) - fetched)
+
+        if count <= 0:
+            return
+
+        # Передача представлению очередной порции строк, суммы уже рассчитаны в хранилище
+        self.beginInsertRows(parent, fetched, fetched + count - 1)
+        self.store.fetched[node] = fetched + count
+        self.endInsertRows()
+
+
+    def reveal(self, node: int) -> QtCore.QModelIndex:
+        '''
+        Получить индекс элемента для перехода к нему в представлении.
+        В ленивом режиме представлению передаются строки до элемента и до каждого его предка.
+        '''
+
+        if self.lazy:
+            for child in reversed([node] + self.store.ancestors(node)):
+                parent = int(self.store.parent[child])
+                row = int(self.store.row[child])
+                fetched = int(self.store.fetched[parent])
+
+                if row >= fetched:
+                    self.beginInsertRows(self.index_from_node(parent), fetched, row)
+                    self.store.fetched[parent] = row + 1
+                    self.endInsertRows()
+
+        return self.index_from_node(node)
+
+
+    def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int = QtCore.Qt.DisplayRole):
+
+        # Заголовок дерева
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole and section == 0:
+            return 'Дерево'
+
+        return None
+
+
+    def flags(self, index: QtCore.QModelIndex):
+
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+
+        flags = QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+        # Редактировать можно только "Лепестки", значение "Узла" - сумма его потомков
+        if self.store.is_leaf(index.internalId()):
+            flags |= QtCore.Qt.ItemIsEditable
+
+        return flags
+
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+
+        node = index.internalId()
+
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole):
+            return str(self.store.sum[node])
+
+        if role == self.SumRole:
+            return int(self.store.sum[node])
+
+        if role == QtCore.Qt.BackgroundRole:
+            return self.background(node)
 
+        return None
 
-    def update_item_parents_data(self, item: QtGui.QStandardItem):
-        '''Обновить, рекурсивно, значения родителей элемента'''
 
-        parent = item.parent()
+    def background(self, node: int) -> QtGui.QColor | None:
+        '''Цвет фона элемента: "Узлы" второго уровня подсвечиваются по знаку суммы'''
 
-        if parent:
+        if self.store.depth[node] != self.HIGHLIGHT_DEPTH or self.store.is_leaf(node):
+            return None
 
-            # Обновление значения родителя
-            self.update_node_data(parent)
-            self.update_item_parents_data(parent)
+        if self.store.sum[node] >= 0:
+            return self.POSITIVE_BACKGROUND
 
+        return self.NEGATIVE_BACKGROUND
 
-    def update_node_data(self, item: QtGui.QStandardItem):
-        '''Обновить данные элемента и его потомков'''
 
-        # Обновляем значение элемента
-        children_sum = sum([int(item.child(i).text()) for i in range(item.rowCount())])
-        item.setText(str(children_sum))
+    def emit_background_changed(self, node: int):
+        '''Сообщить об изменении цвета фона элемента, если элемент может быть подсвечен'''
 
+        if node != 0 and self.store.depth[node] == self.HIGHLIGHT_DEPTH:
+            index = self.index_from_node(node)
+            self.dataChanged.emit(index, index, [QtCore.Qt.BackgroundRole])
 
+
+    @instrumented('model.setData', lambda self, index, *args, **kwargs: 1)
+    def setData(self, index: QtCore.QModelIndex, value, role: int = QtCore.Qt.EditRole):
+
+        if not index.isValid():
+            return False
+
+        node = index.internalId()
+
+        if role == QtCore.Qt.EditRole:
+
+            # Значение можно установить только "Лепестку"
+            if not self.store.is_leaf(node):
+                return False
+
+            try: value = int(value)
+            except (TypeError, ValueError): return False
+
+            self.set_leaf_value(node, value)
+            return True
+
+        return False
+
+
+    def set_leaf_value(self, node: int, value: int):
+        '''Установить значение "Лепестка"'''
+
+        old = int(self.store.value[node])
+
+        # Изменение суммы элемента и его предков на разницу значений
+        with self.batch():
+            self.add_delta(node, value - old)
+            self.store.set_value(node, value)
+            self.changed_nodes.add(node)
+
+        if value != old:
+            self.journal.record(Edit('set', self.node_path(node), value, old))
+
+
+    def begin_batch(self):
+        '''
+        Начать пакет изменений. До завершения пакета изменения сумм накапливаются,
+        а сигнал dataUpdated не выдается. Пакеты могут быть вложенными.
+        '''
+
+        self.batch_depth += 1
+
+
+    @instrumented('model.end_batch', lambda self: len(self.pending_deltas))
+    def end_batch(self):
+        '''Завершить пакет изменений: обновить суммы предков один раз и выдать объединенный сигнал'''
+
+        self.batch_depth -= 1
+        if self.batch_depth > 0:
+            return
+
+        # Применение накопленных изменений сумм, каждый затронутый элемент обновляется один раз
+        deltas, self.pending_deltas = self.pending_deltas, {}
+        applied = self.store.propagate_many(deltas)
+        self.search_index.invalidate(applied)
+        self.emit_sums_changed(applied)
+
+        backgrounds, self.background_nodes = self.background_nodes, set()
+        for node in backgrounds:
+            if self.store.is_alive(node):
+                self.emit_background_changed(node)
+
+        if self.changed_nodes:
+            if self.update_delay > 0:
+                self.update_timer.start(self.update_delay)
+            else:
+                self.emit_updated()
+
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''Пакет изменений в виде менеджера контекста'''
+
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.end_batch()
+
+
+    def add_delta(self, node: int, delta: int):
+        '''Накопить изменение суммы элемента и его предков до завершения пакета'''
+
+        if delta != 0:
+            self.pending_deltas[node] = self.pending_deltas.get(node, 0) + delta
+
+
+    @instrumented('model.emit_updated', lambda self: len(self.changed_nodes))
+    def emit_updated(self):
+        '''Выдать объединенный сигнал об изменении данных модели'''
+
+        self.update_timer.stop()
+
+        nodes = {node for node in self.changed_nodes if self.store.is_alive(node)}
+        self.changed_nodes = set()
+
+        self.dataUpdated.emit()
+        self.subtreesUpdated.emit(nodes)
+
+
+    def emit_sums_changed(self, deltas: dict[int, int]):
+        '''
+        Сообщить представлениям об изменении сумм элементов ({элемент: изменение суммы}).
+        Об изменении цвета фона сообщается только для элементов, у которых сменился знак суммы.
+        '''
+
+        roles = [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole, self.SumRole]
+        background_roles = roles + [QtCore.Qt.BackgroundRole]
+
+        for node, delta in deltas.items():
+            index = self.index_from_node(node)
+
+            new_sum = int(self.store.sum[node])
+            flipped = (new_sum >= 0) != (new_sum - delta >= 0)
+
+            if flipped and self.store.depth[node] == self.HIGHLIGHT_DEPTH:
+                self.dataChanged.emit(index, index, background_roles)
+            else:
+                self.dataChanged.emit(index, index, roles)
+
+
+    @instrumented('model.update_item_parents_data')
+    def update_item_parents_data(self, index: QtCore.QModelIndex):
+        '''Пересчитать, по суммам потомков, значения родителей элемента'''
+
+        for node in self.store.ancestors(self.node_from_index(index)):
+            self.update_node_data(self.index_from_node(node))
+
+
+    def update_node_data(self, index: QtCore.QModelIndex):
+        '''Обновить данные элемента по суммам его потомков'''
+
+        self.store.update_sum(self.node_from_index(index))
+        self.search_index.invalidate([self.node_from_index(index)])
+        self.dataChanged.emit(index, index, [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole, self.SumRole, QtCore.Qt.BackgroundRole])
+
+
+    @instrumented('model.add_item', lambda self, *args, **kwargs: 1)
     def add_item(self, value: str, index: QtCore.QModelIndex = None):
         '''Добавить элемент в модель относительно указанного индекса'''
 
         # Если не указан индекс родительского элемента, выбрать корневой элемент модели
-        if index:
-            parent = self.itemFromIndex(index)
-        else:
-            parent = self.invisibleRootItem()
+        parent = self.node_from_index(index)
+
+        values = [int(value)]
 
         # Если элемент не является "Узлом", превращаем в "Узел" и переносим в него имеющееся значение
-        if index and parent.rowCount() == 0:
+        if parent != 0 and self.store.is_leaf(parent):
 
             # Перенос текущего значения элемента в виде "Лепестка"
-            parent.appendRow(QtGui.QStandardItem(parent.text()))
+            values.insert(0, int(self.store.value[parent]))
 
-        # Добавление нового "Лепестка"
-        new_item = QtGui.QStandardItem(value)
-        parent.appendRow(new_item)
+        # Добавление новых "Лепестков" в конец блока потомков
+        row = int(self.store.child_count[parent])
+        flat = FlatTree(numpy.zeros(len(values), dtype=numpy.int32), numpy.array(values, dtype=numpy.int64), numpy.zeros(len(values), dtype=numpy.bool_))
 
-        # Обновление данных родителя
-        self.update_item_parents_data(new_item)
+        self.insert_subtrees(parent, numpy.arange(row, row + len(values)), flat)
 
-        # Сигнал об обновлении данных модели
-        self.dataUpdated.emit()
+
+    @instrumented('model.insert_subtrees', lambda self, node, rows, flat: len(flat.levels))
+    def insert_subtrees(self, node: int, rows: numpy.ndarray, flat: FlatTree):
+        '''
+        Вставить поддеревья flat (уровень 0 - новые потомки) потомками элемента node на строки rows (по возрастанию).
+        "Лепесток" при этом становится "Узлом", его значение отбрасывается.
+        '''
+
+        converted = node != 0 and self.store.is_leaf(node)
+        leaf_value = int(self.store.value[node]) if converted else 0
+
+        # Поддеревья строк в flat и непрерывные диапазоны строк
+        tops = numpy.flatnonzero(flat.levels == 0)
+        ends = numpy.append(tops[1:], len(flat.levels))
+        breaks = numpy.flatnonzero(numpy.diff(rows) != 1) + 1
+
+        parent_index = self.index_from_node(node)
+
+        with self.batch():
+
+            # Диапазоны вставляются по возрастанию строк, каждый сразу на свое место
+            for start, end in zip(numpy.concatenate(([0], breaks)).tolist(), numpy.concatenate((breaks, [len(rows)])).tolist()):
+                row = int(rows[start])
+                fetched = int(self.store.fetched[node])
+
+                # В ленивом режиме строки показываются сразу, только если они среди полученных представлением
+                visible = not self.lazy or row < fetched or fetched == self.store.child_count[node]
+
+                if visible:
+                    self.beginInsertRows(parent_index, row, row + end - start - 1)
+
+                part = slice(int(tops[start]), int(ends[end - 1]))
+                self.search_index.invalidate(self.store.insert_flat(node, row, FlatTree(*(array[part] for array in flat))))
+
+                if visible:
+                    self.store.fetched[node] = fetched + end - start
+                    self.endInsertRows()
+
+            # "Лепесток" стал "Узлом" и может получить цвет фона
+            if converted:
+                self.emit_background_changed(node)
+
+            # Обновление сумм родителя и его предков на значение новых элементов
+            self.add_delta(node, int(flat.values.sum()) - leaf_value)
+            self.changed_nodes.add(node)
+
+        self.journal.record(Edit('insert', self.node_path(node), leaf_value, 0, numpy.array(rows, dtype=numpy.int64), flat))
 
 
     def delete_item(self, index: QtCore.QModelIndex):
         '''Удалить по индексу элемент из модели'''
 
-        # Получение элемента родителя
-        parent = self.itemFromIndex(index.parent())
+        node = self.node_from_index(index)
 
-        # Удаление элемента
-        self.removeRow(index.row(), index.parent())
+        # Элемент уже удален вместе с одним из предков
+        if node == 0 or not self.store.is_alive(node):
+            return
 
-        # Обновление значения родителя
-        if parent:
-            self.update_node_data(parent)
+        # Удаление элемента из блока потомков родителя
+        parent = int(self.store.parent[node])
+        self.removeRows(int(self.store.row[node]), 1, self.index_from_node(parent))
 
-            # Обновление родителей родителя
-            self.update_item_parents_data(parent)
 
-        # Сигнал о изменении данных модели
-        self.dataUpdated.emit()
+    @instrumented('model.delete_items', lambda self, indexes: len(indexes))
+    def delete_items(self, indexes: list[QtCore.QModelIndex]):
+        '''
+        Удалить элементы по списку индексов одним пакетом изменений.
+        Выделенные потомки уже выделенных элементов удаляются вместе с ними,
+        соседние строки одного родителя удаляются одним диапазоном.
+        '''
 
+        # Идентификаторы элементов хранилища не меняются при удалении других строк
+        nodes = numpy.unique(numpy.array([self.node_from_index(index) for index in indexes], dtype=numpy.int64))
+        nodes = nodes[(nodes > 0) & (nodes < self.store.size)]
+        nodes = nodes[self.store.parent[nodes] != -1]
 
-    def load_data(self, data: list):
+        if len(nodes) == 0:
+            return
+
+        # Оставляем только верхние элементы: отбрасываются элементы, у которых выделен один из предков
+        selected = numpy.zeros(self.store.size, dtype=numpy.bool_)
+        selected[nodes] = True
+
+        covered = numpy.zeros(len(nodes), dtype=numpy.bool_)
+        ancestors = self.store.parent[nodes]
+
+        while True:
+            alive = ancestors > 0
+            if not alive.any():
+                break
+
+            covered[alive] |= selected[ancestors[alive]]
+            ancestors = numpy.where(alive, self.store.parent[numpy.maximum(ancestors, 0)], -1)
+
+        nodes = nodes[~covered]
+
+        # Порядок удаления: по родителю, внутри родителя - строки от большей к меньшей,
+        # чтобы удаление строки не сдвигало еще не удаленные строки
+        parents = self.store.parent[nodes]
+        rows = self.store.row[nodes]
+        order = numpy.lexsort((-rows, parents))
+        parents, rows = parents[order], rows[order]
+
+        # Границы диапазонов: смена родителя или разрыв в номерах строк
+        parent_breaks = parents[1:] != parents[:-1]
+        breaks = numpy.flatnonzero(parent_breaks | (rows[:-1] - rows[1:] != 1)) + 1
+        starts = numpy.concatenate(([0], breaks))
+        ends = numpy.concatenate((breaks, [len(rows)]))
+
+        # Много разрозненных диапазонов удаляются как одно изменение структуры,
+        # по одному проходу на родителя и без сигнала на каждый диапазон
+        bulk = len(starts) > self.BULK_DELETE_RANGES
+
+        # Удаление всех элементов отменяется одним действием
+        with self.journal.group(), self.batch():
+
+            if bulk:
+                self.layoutAboutToBeChanged.emit()
+
+                breaks = numpy.flatnonzero(parent_breaks) + 1
+                for start, end in zip(numpy.concatenate(([0], breaks)).tolist(), numpy.concatenate((breaks, [len(rows)])).tolist()):
+                    self.remove_child_rows(int(parents[start]), rows[start:end][::-1], notify=False)
+
+                self.update_persistent_indexes()
+                self.layoutChanged.emit()
 
-        # Очистка текущих данных Модели
-        self.clear()
-        self.setHorizontalHeaderLabels(['Дерево'])
-
-        # Получение корневого элемента модели
-        root_item = self.invisibleRootItem()
-
-        def update_item_data(item: QtGui.QStandardItem, data_for_item: int | list):
-            '''
-            Функция заполняет данными и преобразует полученный элемент в соответствии с типом данных.
-            Если int - то устанавливает это значение в текстовое поле элемента.
-            Если list - проходит по списку, создавая потомков элемента, добавляет в них данные
-            '''
-
-            if isinstance(data_for_item, list):
-                for item_data in data_for_item:
-                    child_item = QtGui.QStandardItem('0')
-                    update_item_data(child_item, item_data)
-                    self.update_node_data(item)
-                    item.appendRow(child_item)
             else:
-                item.setText(str(data_for_item))
+                for start, end in zip(starts.tolist(), ends.tolist()):
+                    self.remove_child_rows(int(parents[start]), rows[start:end][::-1])
 
-        # Создание элементов первого уровня, их наполнение
-        # и добавление в корневой элемент модели.
-        for data_for_item in data:
-            item = QtGui.QStandardItem('0')
-            update_item_data(item, data_for_item)
-            root_item.appendRow(item)
 
-        self.dataUpdated.emit()
+    def update_persistent_indexes(self):
+        '''Обновить постоянные индексы после изменения структуры: новые номера строк или недействительный индекс'''
+
+        old_indexes = self.persistentIndexList()
+        new_indexes = []
+
+        for index in old_indexes:
+            node = index.internalId()
+
+            if self.store.is_alive(node):
+                new_indexes.append(self.createIndex(int(self.store.row[node]), index.column(), node))
+            else:
+                new_indexes.append(QtCore.QModelIndex())
+
+        self.changePersistentIndexList(old_indexes, new_indexes)
+
+
+    def removeRows(self, row: int, count: int, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+        '''Удалить непрерывный диапазон строк с их поддеревьями одной операцией'''
+
+        if count <= 0 or row < 0 or row + count > self.rowCount(parent):
+            return False
+
+        self.remove_child_rows(self.node_from_index(parent), numpy.arange(row, row + count))
+        return True
+
+
+    def remove_child_rows(self, node: int, rows: numpy.ndarray, notify: bool = True, leaf_value: int = 0):
+        '''
+        Удалить строки rows (по возрастанию) элемента node с их поддеревьями.
+        При notify строки должны идти подряд, выдаются сигналы об удалении диапазона строк,
+        иначе сигналы не выдаются, их заменяет общий сигнал об изменении структуры.
+        "Узел" без потомков становится "Лепестком" со значением leaf_value.
+        '''
+
+        rows = numpy.array(rows, dtype=numpy.int64)
+
+        # Удаляемые поддеревья сохраняются в журнале в плоском виде для отмены удаления
+        flat = self.store.to_flat(self.store.children_of(node)[rows])
+
+        with self.batch():
+
+            # Суммы удаляемых поддеревьев (без еще не примененных изменений, они отбрасываются вместе с элементами)
+            removed_sum = int(self.store.sum[self.store.children_of(node)[rows]].sum())
+
+            if notify:
+                self.beginRemoveRows(self.index_from_node(node), int(rows[0]), int(rows[-1]))
+
+            removed = self.store.remove_rows(node, rows)
+            self.store.fetched[node] -= numpy.count_nonzero(rows < self.store.fetched[node])
+
+            if notify:
+                self.endRemoveRows()
+
+            self.forget_nodes(removed)
+            self.search_index.invalidate(removed)
+
+            # "Узел" без потомков становится "Лепестком"
+            if node != 0 and self.store.is_leaf(node):
+                self.store.set_value(node, leaf_value)
+
+                # Без notify идет изменение структуры, индексы представлений до его завершения недействительны
+                if notify:
+                    self.emit_background_changed(node)
+                else:
+                    self.background_nodes.add(node)
+                removed_sum -= leaf_value
+
+            # Обновление сумм родителя и его предков на значение удаленных поддеревьев
+            self.add_delta(node, -removed_sum)
+            self.changed_nodes.add(node)
+
+        self.journal.record(Edit('remove', self.node_path(node), leaf_value, 0, rows, flat))
+
+
+    def forget_nodes(self, nodes: numpy.ndarray):
+        '''Убрать накопленные изменения и отметки об изменении удаленных элементов'''
+
+        for data in (self.pending_deltas, self.changed_nodes):
+            if not data:
+                continue
+
+            # Перебор меньшего из наборов: удаленных элементов или записей
+            if len(nodes) <= len(data):
+                removed = [node for node in nodes.tolist() if node in data]
+            else:
+                removed = numpy.intersect1d(nodes, list(data)).tolist()
+
+            for node in removed:
+                if isinstance(data, set):
+                    data.discard(node)
+                else:
+                    del data[node]
+
+
+    def node_path(self, node: int) -> tuple[int, ...]:
+        '''Номера строк от корня до элемента: положение элемента, не зависящее от идентификаторов хранилища'''
+
+        path = []
+
+        while node > 0:
+            path.append(int(self.store.row[node]))
+            node = int(self.store.parent[node])
+
+        return tuple(reversed(path))
+
+
+    def node_from_path(self, path: tuple[int, ...]) -> int:
+        '''Идентификатор элемента по номерам строк от корня'''
+
+        node = 0
+
+        for row in path:
+            node = self.store.child(node, row)
+
+        return node
+
+
+    def apply_edit(self, edit: Edit):
+        '''Выполнить изменение из журнала'''
+
+        node = self.node_from_path(edit.path)
+
+        if edit.kind == 'set':
+            self.set_leaf_value(node, edit.value)
+
+        elif edit.kind == 'insert':
+            self.insert_subtrees(node, edit.rows, edit.flat)
+
+        else:
+            rows = edit.rows
+
+            # Диапазон строк, уже полученных представлением, удаляется с сигналами об удалении строк,
+            # иначе - одним изменением структуры
+            if rows[-1] - rows[0] + 1 == len(rows) and (not self.lazy or rows[-1] < self.store.fetched[node]):
+                self.remove_child_rows(node, rows, leaf_value=edit.value)
+            else:
+                self.layoutAboutToBeChanged.emit()
+                self.remove_child_rows(node, rows, notify=False, leaf_value=edit.value)
+                self.update_persistent_indexes()
+                self.layoutChanged.emit()
+
+
+    def apply_edits(self, edits: list[Edit]):
+        '''Выполнить изменения одним пакетом'''
+
+        with self.batch():
+            for edit in edits:
+                self.apply_edit(edit)
+
+
+    @instrumented('model.undo')
+    def undo(self) -> bool:
+        '''Отменить последнее действие'''
+
+        edits = self.journal.undo()
+
+        with self.journal.replay():
+            self.apply_edits(edits)
+
+        return bool(edits)
+
+
+    @instrumented('model.redo')
+    def redo(self) -> bool:
+        '''Повторить последнее отмененное действие'''
+
+        edits = self.journal.redo()
+
+        with self.journal.replay():
+            self.apply_edits(edits)
+
+        return bool(edits)
+
+
+    @instrumented('model.recover', lambda self, edits: len(edits))
+    def recover(self, edits: list[Edit]):
+        '''Повторить изменения из журнала автосохранения, восстановленные изменения отменяются одним действием'''
+
+        with self.journal.group():
+            self.apply_edits(edits)
+
+
+    def begin_save(self):
+        '''Снимок данных для сохранения сделан: последующие изменения войдут в журнал сохраненного файла'''
+
+        self.journal.autosave.mark()
+
+
+    def cancel_save(self):
+        '''Файл не сохранен по снимку данных (ошибка или отмена записи)'''
+
+        self.journal.autosave.unmark()
 
 
+    def end_save(self, path: str, synced_file: SyncedFile | None = None):
+        '''
+        Файл path сохранен по снимку данных. synced_file - записанный файл hdf5 в формате хранилища,
+        следующие записи в него будут частичными.
+        '''
+
+        self.synced_file = synced_file
+        self.journal.autosave.rebase(path)
+
+
+    def load_data(self, data: list):
+        '''Загрузить в модель данные в виде вложенных списков'''
+
+        self.load_flat(nested_to_flat(data))
+
+
+    @instrumented('model.load_flat', lambda self, flat: len(flat.levels))
+    def load_flat(self, flat: FlatTree):
+        '''Загрузить в модель данные дерева в плоском виде'''
+
+        store = TreeStore()
+        store.load_flat(flat)
+        self.set_store(store)
+
+
+    @instrumented('model.set_store', lambda self, store, *args: len(store))
+    def set_store(self, store: TreeStore, synced_file: SyncedFile | None = None):
+        '''
+        Заменить хранилище модели, например, подготовленное в фоновом потоке.
+        synced_file - файл hdf5, из которого прочитано хранилище: изменения отслеживаются относительно него.
+        '''
+
+        # Замена текущих данных Модели
+        self.beginResetModel()
+        self.store = store
+        self.search_index.reset(store)
+        self.pending_deltas.clear()
+        self.background_nodes.clear()
+
+        self.synced_file = synced_file
+        if synced_file is not None:
+            store.reset_changes()
+
+        # История изменений относится к прежним данным
+        self.journal.clear()
+        self.journal.autosave.close()
+
+        # В ленивом режиме сразу доступна только первая порция элементов первого уровня
+        if self.lazy:
+            self.store.fetched[0] = min(self.fetch_batch_size, int(self.store.child_count[0]))
+
+        self.endResetModel()
+
+        # Изменилось все дерево
+        self.changed_nodes = {0}
+        self.emit_updated()
+
+
+    @instrumented('model.get_data', lambda self: len(self.store))
     def get_data(self):
         '''Получить данные содержащиеся в модели'''
 
-        def get_item_data(item: QtGui.QStandardItem):
-            '''Получить значения элемента и его потомков'''
+        return self.store.to_nested()
 
-            item_data = []
 
-            for i in range(item.rowCount()):
-                child_item = item.child(i)
+    def level_averages(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        '''Получить уровни вложенности и средние значения элементов на них'''
 
-                if child_item.rowCount() != 0:
-                    item_data.append(get_item_data(child_item))
-                else:
-                    item_data.append(int(child_item.text()))
+        return self.store.level_averages()
+
+
+    @instrumented('model.get_flat', lambda self: len(self.store))
+    def get_flat(self) -> FlatTree:
+        '''Получить данные модели в плоском виде'''
+
+        return self.store.to_flat()
+
+
+    @instrumented('model.store_patch')
+    def store_patch(self, path: str) -> tuple[StorePatch, SyncedFile | None]:
+        '''
+        Снимок хранилища для записи в файл hdf5 path и файл, поверх которого записываются изменения.
+        Если path - последний прочитанный или записанный файл в формате хранилища и он не изменялся,
+        снимок содержит только изменения после чтения или записи, иначе - все хранилище (файл None).
+        '''
+
+        changes = self.store.take_changes()
+
+        # До завершения записи файл не считается совпадающим с данными: при ошибке следующая запись будет полной
+        synced_file, self.synced_file = self.synced_file, None
+
+        if changes is not None and synced_file is not None and synced_file.matches(path):
+            if not store_needs_compaction(self.store, synced_file):
+                return store_patch(self.store, changes), synced_file
+
+        return store_patch(self.store, None), None
+
+
+
+class DiffTreeModel(QtCore.QAbstractItemModel):
+    '''
+    Модель только для чтения: различия двух деревьев. Содержит только добавленные, удаленные и
+    измененные элементы, у каждого - сумма во втором дереве и изменение суммы относительно первого.
+    '''
+
+    # Цвета фона добавленных, удаленных и измененных элементов
+    ADDED_BACKGROUND = QtGui.QColor('#C5E1A5')
+    REMOVED_BACKGROUND = QtGui.QColor('#EF9A9A')
+    CHANGED_BACKGROUND = QtGui.QColor('#FFE082')
+
+    def __init__(self, diff: TreeDiff):
+        super().__init__()
+
+        self.diff = diff
+
+        # Номер записи различий хранится в internalId индекса, родитель записи -1 - корень.
+        # Потомки записей - блоки в порядке записей, отсортированных по родителю: блок записи i
+        # начинается с позиции child_start[i + 1] (позиция 0 - записи первого уровня)
+        self.parents = flat_parents(diff.levels)
+        self.children = numpy.argsort(self.parents, kind='stable')
+        self.child_count = numpy.bincount(self.parents + 1, minlength=len(diff.levels) + 1)
+        self.child_start = numpy.cumsum(self.child_count) - self.child_count
+
+        self.rows = numpy.empty(len(diff.levels), dtype=numpy.int64)
+        self.rows[self.children] = numpy.arange(len(diff.levels)) - self.child_start[self.parents[self.children] + 1]
+
+        self.summary = diff_summary(diff)
+
+
+    def entry_from_index(self, index: QtCore.QModelIndex) -> int:
+        '''Получить номер записи различий по индексу (-1 - корень)'''
+
+        if index.isValid():
+            return index.internalId()
+
+        return -1
+
+
+    # QAbstractItemModel
+    def index(self, row: int, column: int, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+
+        entry = self.children[self.child_start[self.entry_from_index(parent) + 1] + row]
+        return self.createIndex(row, column, int(entry))
+
+
+    def parent(self, index: QtCore.QModelIndex = None):
+
+        # Перегрузка QObject.parent() без аргументов
+        if index is None:
+            return super().parent()
+
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        parent = int(self.parents[index.internalId()])
+
+        if parent == -1:
+            return QtCore.QModelIndex()
+
+        return self.createIndex(int(self.rows[parent]), 0, parent)
+
+
+    def rowCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+
+        if parent.column() > 0:
+            return 0
+
+        return int(self.child_count[self.entry_from_index(parent) + 1])
+
+
+    def columnCount(self, parent: QtCore.QModelIndex = QtCore.QModelIndex()):
+
+        return 1
+
+
+    def headerData(self, section: int, orientation: QtCore.Qt.Orientation, role: int = QtCore.Qt.DisplayRole):
+
+        # Заголовок - количество различий по состояниям
+        if orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole and section == 0:
+            summary = self.summary
+            return f'Различия: изменено {summary["changed"]}, добавлено {summary["added"]}, удалено {summary["removed"]}'
+
+        return None
+
+
+    def flags(self, index: QtCore.QModelIndex):
+
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.DisplayRole):
+
+        if not index.isValid():
+            return None
+
+        entry = index.internalId()
+        status = self.diff.status[entry]
+        first_sum = int(self.diff.first_sum[entry])
+        second_sum = int(self.diff.second_sum[entry])
+
+        if role == QtCore.Qt.DisplayRole:
+            row = int(self.diff.rows[entry])
+
+            if status == DIFF_ADDED:
+                return f'[{row}] + {second_sum}'
+            if status == DIFF_REMOVED:
+                return f'[{row}] - {first_sum}'
+
+            return f'[{row}] {first_sum} → {second_sum} ({second_sum - first_sum:+d})'
+
+        if role == QtCore.Qt.ToolTipRole:
+            return {DIFF_ADDED: 'Добавлен', DIFF_REMOVED: 'Удален'}.get(status, 'Изменен')
 
-            return item_data
+        if role == QtCore.Qt.BackgroundRole:
+            if status == DIFF_ADDED:
+                return self.ADDED_BACKGROUND
+            if status == DIFF_REMOVED:
+                return self.REMOVED_BACKGROUND
 
-        return get_item_data(self.invisibleRootItem())
+            return self.CHANGED_BACKGROUND
 
+        return None
@@ -0,0 +1,343 @@
+'''
+Параллельное чтение больших файлов дерева. Файл делится на части из поддеревьев первого уровня
+(отрезки внешнего списка JSON, группы верхнего уровня hdf5, отрезки плоских наборов данных hdf5),
+части разбираются в пуле процессов вместе с расчетом сумм и накопителей уровней (хранилище части),
+массивы хранилищ частей возвращаются через разделяемую память и объединяются в одно хранилище.
+'''
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Callable, NamedTuple
+
+import numpy
+
+from src.tools import (
+    HDF5_FLAT_DATASETS, HDF5_FORMAT_VERSION, JSON_IO_BLOCK, NATIVE_ALIGNMENT, JsonTreeReader, Progress,
+    hdf5_is_flat, hdf5_is_store, hdf5_read_recursive,
+)
+from src.tree_store import FlatTree, TreeStore, nested_to_flat
+
+
+# Наименьший размер файла, читаемого параллельно: для небольших файлов запуск процессов дороже разбора
+PARALLEL_MIN_SIZE = 32 << 20
+
+# Количество частей на процесс: части разного размера распределяются между процессами равномернее
+PARALLEL_PARTS_PER_JOB = 4
+
+# Блок поиска границ частей
+SPLIT_BLOCK = 1 << 16
+
+OPEN_BRACKET, CLOSE_BRACKET, COMMA = b'[],'
+WHITESPACE = b' \t\r\n'
+
+
+class SharedArrays(NamedTuple):
+    '''Массивы в блоке разделяемой памяти: имя блока и расположение массивов (имя, тип, смещение, длина)'''
+
+    name: str
+    layout: list[tuple[str, str, int, int]]
+
+
+def share_arrays(arrays: dict[str, numpy.ndarray]) -> SharedArrays | dict[str, numpy.ndarray]:
+    '''
+    Скопировать массивы в новый блок разделяемой памяти, блок освобождает получатель (receive_arrays).
+    Если блок создать не удалось (например, мал размер /dev/shm), массивы передаются как есть.
+    '''
+
+    layout = []
+    size = 0
+
+    for name, array in arrays.items():
+        layout.append((name, array.dtype.str, size, len(array)))
+        size += -(-array.nbytes // NATIVE_ALIGNMENT) * NATIVE_ALIGNMENT
+
+    try:
+        block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    except OSError:
+        return arrays
+
+    try:
+        for (name, dtype, offset, length), array in zip(layout, arrays.values()):
+            numpy.ndarray(length, dtype, block.buf, offset)[:] = array
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+
+    block.close()
+
+    return SharedArrays(block.name, layout)
+
+
+def receive_arrays(result: SharedArrays | dict[str, numpy.ndarray], blocks: list) -> dict[str, numpy.ndarray]:
+    '''
+    Получить массивы, переданные share_arrays, без копирования. Имя блока сразу удаляется,
+    отображение блока остается до закрытия: открытый блок добавляется в blocks.
+    '''
+
+    if not isinstance(result, SharedArrays):
+        return result
+
+    block = shared_memory.SharedMemory(result.name)
+    block.unlink()
+    blocks.append(block)
+
+    return {name: numpy.ndarray(length, dtype, block.buf, offset) for name, dtype, offset, length in result.layout}
+
+
+def discard_arrays(result: SharedArrays | dict[str, numpy.ndarray] | None):
+    '''Освободить блок разделяемой памяти неполученных массивов'''
+
+    if not isinstance(result, SharedArrays):
+        return
+
+    try:
+        block = shared_memory.SharedMemory(result.name)
+    except FileNotFoundError:
+        return
+
+    block.close()
+    block.unlink()
+
+
+def build_part(flat: FlatTree) -> SharedArrays | dict[str, numpy.ndarray]:
+    '''Построить хранилище части дерева (суммы и накопители уровней) и передать его массивы'''
+
+    store = TreeStore()
+    store.load_flat(flat)
+
+    return share_arrays(store.to_arrays())
+
+
+def json_read_part(path: str, start: int, end: int) -> SharedArrays | dict[str, numpy.ndarray]:
+    '''Разобрать отрезок внешнего списка файла JSON как отдельный список (выполняется в процессе пула)'''
+
+    reader = JsonTreeReader()
+    reader.feed(b'[')
+
+    with open(path, 'rb') as file:
+        file.seek(start)
+
+        while start < end and (block := file.read(min(JSON_IO_BLOCK, end - start))):
+            reader.feed(block)
+            start += len(block)
+
+    reader.feed(b']', final=True)
+    flat = reader.result()
+
+    # Отрезок между запятыми внешнего списка не может быть пустым (лишняя или висячая запятая)
+    if len(flat.levels) == 0:
+        raise ValueError('Некорректный JSON: пропущенная или лишняя запятая')
+
+    return build_part(flat)
+
+
+def hdf5_read_groups(path: str, keys: list[str]) -> SharedArrays | dict[str, numpy.ndarray]:
+    '''Прочитать элементы первого уровня устаревшего формата hdf5 (выполняется в процессе пула)'''
+
+    import h5py
+
+    with h5py.File(path, 'r') as file:
+        data = []
+        for key in keys:
+            item = file[key]
+            data.append(hdf5_read_recursive(item) if isinstance(item, h5py.Group) else item[()])
+
+    return build_part(nested_to_flat(data))
+
+
+def hdf5_top_level_from(dataset, position: int) -> int:
+    '''Позиция первого элемента первого уровня в наборе данных levels, начиная с position (длина - если нет)'''
+
+    while position < len(dataset):
+        block = dataset[position:position + SPLIT_BLOCK]
+        found = numpy.flatnonzero(block == 0)
+
+        if len(found):
+            return position + int(found[0])
+
+        position += len(block)
+
+    return len(dataset)
+
+
+def hdf5_read_range(path: str, start: int, end: int) -> SharedArrays | dict[str, numpy.ndarray]:
+    '''
+    Прочитать отрезок поколоночного формата hdf5 (выполняется в процессе пула). Границы отрезка
+    сдвигаются вперед до элементов первого уровня: соседние отрезки сдвигают общую границу одинаково.
+    '''
+
+    import h5py
+
+    with h5py.File(path, 'r') as file:
+        levels = file['levels']
+        start = hdf5_top_level_from(levels, start) if start else 0
+        end = hdf5_top_level_from(levels, end)
+
+        arrays = [file[name][start:end].astype(dtype) if start < end else numpy.zeros(0, dtype=dtype) for name, dtype in HDF5_FLAT_DATASETS]
+
+    levels, values, nodes = arrays
+    return build_part(FlatTree(levels, values, nodes.astype(numpy.bool_)))
+
+
+def json_split(path: str, count: int) -> list[tuple[int, int]]:
+    '''
+    Разделить внешний список файла JSON на отрезки (начало, конец) примерно одинакового размера
+    по запятым верхнего уровня. Уровень вложенности на границе - разность количества скобок до нее.
+    '''
+
+    data = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+
+    # Внешний список: первый и последний непробельные символы файла
+    start, end = 0, len(data)
+    while start < end and int(data[start]) in WHITESPACE:
+        start += 1
+    while end > start and int(data[end - 1]) in WHITESPACE:
+        end -= 1
+
+    if end - start < 2 or data[start] != OPEN_BRACKET or data[end - 1] != CLOSE_BRACKET:
+        raise ValueError('Файл JSON должен содержать один внешний список')
+
+    start, end = start + 1, end - 1
+
+    def balance(first: int, last: int) -> int:
+        result = 0
+        for position in range(first, last, JSON_IO_BLOCK):
+            chunk = data[position:min(position + JSON_IO_BLOCK, last)]
+            result += int(numpy.count_nonzero(chunk == OPEN_BRACKET)) - int(numpy.count_nonzero(chunk == CLOSE_BRACKET))
+        return result
+
+    bounds = [start]
+    position, depth = start, 0
+
+    for cut in range(1, count):
+        cut = start + (end - start) * cut // count
+        if cut <= position:
+            continue
+
+        depth += balance(position, cut)
+        position = cut
+
+        # Ближайшая запятая между элементами внешнего списка
+        while position < end:
+            chunk = data[position:min(position + SPLIT_BLOCK, end)]
+            steps = (chunk == OPEN_BRACKET).astype(numpy.int64) - (chunk == CLOSE_BRACKET)
+            found = numpy.flatnonzero((chunk == COMMA) & (numpy.cumsum(steps) + depth == 0))
+
+            if len(found):
+                position, depth = position + int(found[0]) + 1, 0
+                bounds.append(position)
+                break
+
+            depth += int(steps.sum())
+            position += len(chunk)
+
+    del data
+
+    # Запятая перед началом отрезка в отрезок не входит
+    return [(first, last - 1) for first, last in zip(bounds, bounds[1:])] + [(bounds[-1], end)]
+
+
+def hdf5_split(path: str, count: int) -> tuple[Callable, list[tuple]] | None:
+    '''Задания чтения частей файла hdf5 или None, если формат не требует разбора'''
+
+    import h5py
+
+    with h5py.File(path, 'r') as file:
+
+        # Формат хранилища читается без разбора и пересчета
+        if hdf5_is_store(file):
+            return None
+
+        if hdf5_is_flat(file):
+            if int(file.attrs['format_version']) > HDF5_FORMAT_VERSION:
+                return None
+
+            length = len(file['levels'])
+            cuts = sorted({length * n // count for n in range(count + 1)})
+            return hdf5_read_range, [(path, first, last) for first, last in zip(cuts, cuts[1:])]
+
+        keys = sorted(file.keys(), key=int)
+
+    cuts = sorted({len(keys) * n // count for n in range(count + 1)})
+    return hdf5_read_groups, [(path, keys[first:last]) for first, last in zip(cuts, cuts[1:])]
+
+
+def merge_parts(results: list[SharedArrays | dict[str, numpy.ndarray]]) -> TreeStore:
+    '''Объединить хранилища частей, прочитанные из разделяемой памяти, в одно хранилище'''
+
+    blocks = []
+    store = TreeStore()
+
+    try:
+        store.load_stores([TreeStore.from_arrays(receive_arrays(result, blocks)) for result in results])
+    finally:
+        for block in blocks:
+
+            # При ошибке массивы частей могут еще удерживаться трассировкой, отображение закроется вместе с ними
+            try:
+                block.close()
+            except BufferError:
+                pass
+
+    return store
+
+
+def read_tree_parallel(path: str, file_type: str, jobs: int | None = None, progress: Progress | None = None) -> TreeStore | None:
+    '''
+    Прочитать файл дерева в пуле процессов, jobs - количество процессов (None - по числу ядер).
+    None - файл нужно читать обычным способом: он небольшой, доступен один процесс,
+    формат не требует разбора или файл не делится на части.
+    '''
+
+    jobs = jobs or os.cpu_count() or 1
+
+    if jobs < 2 or file_type not in ('*.json', '*.hdf5') or os.path.getsize(path) < PARALLEL_MIN_SIZE:
+        return None
+
+    count = jobs * PARALLEL_PARTS_PER_JOB
+
+    if file_type == '*.json':
+        function, tasks = json_read_part, [(path, start, end) for start, end in json_split(path, count)]
+    else:
+        split = hdf5_split(path, count)
+        if split is None:
+            return None
+        function, tasks = split
+
+    if len(tasks) < 2:
+        return None
+
+    return run_parts(function, tasks, jobs, progress)
+
+
+def run_parts(function: Callable, tasks: list[tuple], jobs: int, progress: Progress | None = None) -> TreeStore:
+    '''Выполнить задания частей в пуле процессов и объединить хранилища частей в порядке заданий'''
+
+    results: list = [None] * len(tasks)
+
+    # Процессы запускаются заново (spawn), а не копией текущего: в нем работают потоки Qt и пула задач
+    executor = ProcessPoolExecutor(max_workers=min(jobs, len(tasks)), mp_context=multiprocessing.get_context('spawn'))
+    futures = {}
+
+    try:
+        futures = {executor.submit(function, *task): n for n, task in enumerate(tasks)}
+
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if progress: progress(done, len(tasks))
+
+        return merge_parts(results)
+
+    finally:
+        # При ошибке или отмене оставшиеся части отменяются, разделяемая память завершенных освобождается
+        executor.shutdown(wait=True, cancel_futures=True)
+
+        for future, n in futures.items():
+            if results[n] is None and future.done() and not future.cancelled() and future.exception() is None:
+                results[n] = future.result()
+
+        for result in results:
+            discard_arrays(result)
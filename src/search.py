@@ -0,0 +1,226 @@
+import re
+from typing import Callable, Iterable
+
+import numpy
+
+from src.tree_store import TreeStore
+
+
+class SearchIndex:
+    '''
+    Индекс элементов дерева по сумме (сумма "Лепестка" равна его значению): отсортированные
+    массивы сумм и идентификаторов элементов. Запросы - двоичным поиском по отсортированным суммам.
+    Изменения отмечаются через invalidate и применяются к индексу при следующем запросе: записи
+    измененных элементов в основных массивах отмечаются устаревшими, а их актуальные записи
+    собираются в небольшой отсортированный накопитель, который просматривается вместе с основными массивами.
+    '''
+
+    # Доля измененных элементов, начиная с которой индекс перестраивается целиком
+    REBUILD_FRACTION = 0.1
+
+    # Размер накопителя, начиная с которого он сливается с основными массивами за один проход
+    OVERLAY_LIMIT = 4096
+
+    def __init__(self, store: TreeStore):
+        self.reset(store)
+
+
+    def reset(self, store: TreeStore):
+        '''Сменить хранилище, индекс будет построен при первом запросе'''
+
+        self.store = store
+
+        # Отсортированные суммы и соответствующие им элементы, None - индекс не построен
+        self.keys: numpy.ndarray | None = None
+        self.nodes: numpy.ndarray | None = None
+
+        # Элементы, сумма или существование которых изменились после последнего запроса
+        self.dirty: list[numpy.ndarray] = []
+
+        self.reset_overlay()
+
+
+    def reset_overlay(self):
+        '''Очистить накопитель: основные массивы содержат актуальные записи всех элементов'''
+
+        # Элементы, измененные после построения основных массивов, и признак устаревшей записи по идентификатору
+        self.changed = numpy.zeros(0, dtype=numpy.int64)
+        self.stale = numpy.zeros(self.store.size, dtype=numpy.bool_)
+
+        # Актуальные записи измененных элементов, отсортированные по сумме
+        self.overlay_keys = numpy.zeros(0, dtype=numpy.int64)
+        self.overlay_nodes = numpy.zeros(0, dtype=numpy.int64)
+
+
+    def invalidate(self, nodes: Iterable[int]):
+        '''Отметить элементы с изменившейся суммой, новые и удаленные элементы'''
+
+        if self.keys is None:
+            return
+
+        nodes = numpy.fromiter(nodes, dtype=numpy.int64) if not isinstance(nodes, numpy.ndarray) else nodes
+        self.dirty.append(nodes)
+
+
+    def refresh(self):
+        '''Применить накопленные изменения или построить индекс'''
+
+        if self.keys is None:
+            self.rebuild()
+
+        elif self.dirty:
+            changed = numpy.union1d(self.changed, numpy.concatenate(self.dirty))
+
+            if len(changed) > len(self.keys) * self.REBUILD_FRACTION:
+                self.rebuild()
+            else:
+                self.update(changed)
+                if len(self.overlay_nodes) > self.OVERLAY_LIMIT:
+                    self.merge()
+
+        self.dirty = []
+
+
+    def rebuild(self):
+        '''Построить индекс по всем элементам хранилища'''
+
+        nodes = numpy.flatnonzero(self.store.parent[1:self.store.size] != -1) + 1
+        keys = self.store.sum[nodes]
+        order = numpy.argsort(keys, kind='stable')
+
+        self.keys, self.nodes = keys[order], nodes[order]
+        self.reset_overlay()
+
+
+    def update(self, changed: numpy.ndarray):
+        '''Отметить устаревшими записи измененных элементов и собрать их актуальные записи в накопитель'''
+
+        self.changed = changed
+
+        # Новые элементы (идентификаторы за пределами основных массивов) устаревших записей не имеют
+        self.stale[changed[changed < len(self.stale)]] = True
+
+        # Удаленные элементы в накопитель не попадают
+        alive = changed[(changed > 0) & (changed < self.store.size)]
+        alive = alive[self.store.parent[alive] != -1]
+
+        keys = self.store.sum[alive]
+        order = numpy.argsort(keys, kind='stable')
+        self.overlay_keys, self.overlay_nodes = keys[order], alive[order]
+
+
+    def merge(self):
+        '''Слить накопитель с основными массивами: убрать устаревшие записи и вставить актуальные по месту'''
+
+        keep = ~self.stale[self.nodes]
+        keys, nodes = self.keys[keep], self.nodes[keep]
+
+        positions = numpy.searchsorted(keys, self.overlay_keys, side='right')
+        self.keys = numpy.insert(keys, positions, self.overlay_keys)
+        self.nodes = numpy.insert(nodes, positions, self.overlay_nodes)
+
+        self.reset_overlay()
+
+
+    def combine(self, keys: numpy.ndarray, nodes: numpy.ndarray, overlay_keys: numpy.ndarray, overlay_nodes: numpy.ndarray) -> numpy.ndarray:
+        '''Элементы части основных массивов без устаревших записей и части накопителя, по возрастанию суммы'''
+
+        keep = ~self.stale[nodes]
+        keys, nodes = keys[keep], nodes[keep]
+
+        if len(overlay_nodes) == 0:
+            return nodes
+
+        return numpy.insert(nodes, numpy.searchsorted(keys, overlay_keys, side='right'), overlay_nodes)
+
+
+    def filter_kind(self, nodes: numpy.ndarray, kind: str) -> numpy.ndarray:
+        '''Оставить элементы указанного типа: все, только "Лепестки" или только "Узлы"'''
+
+        if kind == 'leaves':
+            return nodes[self.store.child_count[nodes] == 0]
+        if kind == 'nodes':
+            return nodes[self.store.child_count[nodes] > 0]
+
+        return nodes
+
+
+    def range(self, low: int | None = None, high: int | None = None, kind: str = 'all') -> numpy.ndarray:
+        '''Элементы с суммой от low до high включительно (None - без ограничения), по возрастанию суммы'''
+
+        self.refresh()
+
+        def bounds(keys: numpy.ndarray) -> slice:
+            start = 0 if low is None else numpy.searchsorted(keys, low, side='left')
+            stop = len(keys) if high is None else numpy.searchsorted(keys, high, side='right')
+            return slice(start, stop)
+
+        main, overlay = bounds(self.keys), bounds(self.overlay_keys)
+        nodes = self.combine(self.keys[main], self.nodes[main], self.overlay_keys[overlay], self.overlay_nodes[overlay])
+
+        return self.filter_kind(nodes, kind)
+
+
+    def exact(self, value: int, kind: str = 'all') -> numpy.ndarray:
+        '''Элементы с суммой, равной value'''
+
+        return self.range(value, value, kind)
+
+
+    def extreme(self, size: int, largest: bool) -> numpy.ndarray:
+        '''Первые size элементов (меньше - если элементов меньше) от наибольшей или наименьшей суммы'''
+
+        # Среди первых записей основных массивов могут быть устаревшие: берется запас на их количество
+        main = slice(max(len(self.keys) - size - len(self.changed), 0), None) if largest else slice(0, size + len(self.changed))
+        overlay = slice(max(len(self.overlay_keys) - size, 0), None) if largest else slice(0, size)
+
+        nodes = self.combine(self.keys[main], self.nodes[main], self.overlay_keys[overlay], self.overlay_nodes[overlay])
+
+        return nodes[::-1][:size] if largest else nodes[:size]
+
+
+    def top(self, count: int, largest: bool = True, kind: str = 'all') -> numpy.ndarray:
+        '''count элементов с наибольшими (или наименьшими) суммами, от крайнего значения'''
+
+        self.refresh()
+
+        # Без фильтра по типу - крайние записи, с фильтром - просмотр порциями растущего размера
+        if kind == 'all':
+            return self.extreme(count, largest).copy()
+
+        size = max(count * 2, 64)
+
+        while True:
+            nodes = self.extreme(size, largest)
+            found = self.filter_kind(nodes, kind)
+            if len(found) >= count or len(nodes) < size:
+                return found[:count]
+            size *= 4
+
+
+# Запрос поиска: число, диапазон "a..b" (границы необязательны), сравнение (>, >=, <, <=), "top N" или "bottom N"
+QUERY_NUMBER = r'-?\d+'
+QUERY_PATTERNS = (
+    (re.compile(rf'^({QUERY_NUMBER})$'), lambda index, kind, value: index.exact(int(value), kind)),
+    (re.compile(rf'^({QUERY_NUMBER})?\s*\.\.\s*({QUERY_NUMBER})?$'),
+        lambda index, kind, low, high: index.range(None if low is None else int(low), None if high is None else int(high), kind)),
+    (re.compile(rf'^>=\s*({QUERY_NUMBER})$'), lambda index, kind, value: index.range(int(value), None, kind)),
+    (re.compile(rf'^>\s*({QUERY_NUMBER})$'), lambda index, kind, value: index.range(int(value) + 1, None, kind)),
+    (re.compile(rf'^<=\s*({QUERY_NUMBER})$'), lambda index, kind, value: index.range(None, int(value), kind)),
+    (re.compile(rf'^<\s*({QUERY_NUMBER})$'), lambda index, kind, value: index.range(None, int(value) - 1, kind)),
+    (re.compile(r'^top\s+(\d+)$', re.IGNORECASE), lambda index, kind, count: index.top(int(count), True, kind)),
+    (re.compile(r'^bottom\s+(\d+)$', re.IGNORECASE), lambda index, kind, count: index.top(int(count), False, kind)),
+)
+
+
+def parse_query(text: str) -> Callable[[SearchIndex, str], numpy.ndarray]:
+    '''Разобрать текст запроса поиска, вернуть функцию (индекс, тип элементов) -> найденные элементы'''
+
+    text = text.strip()
+
+    for pattern, query in QUERY_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            return lambda index, kind: query(index, kind, *match.groups())
+
+    raise ValueError(f'Некорректный запрос поиска: {text}')
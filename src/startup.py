@@ -0,0 +1,81 @@
+'''
+Отчет о времени запуска приложения: этапы запуска и время импорта модулей по пакетам.
+
+Запуск: python -m src.startup --runs 5
+Приложение запускается в отдельном процессе с -X importtime и флагом --startup-report,
+по умолчанию без отображения окна (платформа Qt offscreen).
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+
+def run_once(args: list[str]) -> tuple[dict, dict[str, float]]:
+    '''Один запуск приложения: этапы запуска и собственное время импорта по пакетам верхнего уровня, в секундах'''
+
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'src.main', '--startup-report', *args],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+
+    milestones = None
+    for line in process.stdout.splitlines():
+        if line.startswith('{'):
+            milestones = json.loads(line)['startup']
+
+    if milestones is None:
+        raise RuntimeError(f'Приложение не вывело отчет о запуске:\n{process.stderr[-2000:]}')
+
+    # Строки -X importtime: "import time: собственное [мкс] | суммарное [мкс] | модуль"
+    packages: dict[str, float] = defaultdict(float)
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+
+        own, _, module = line[len('import time:'):].split('|')
+        packages[module.strip().split('.')[0]] += int(own) / 1e6
+
+    return milestones, packages
+
+
+def main(argv: list[str] | None = None):
+
+    parser = argparse.ArgumentParser(description='Отчет о времени запуска приложения')
+    parser.add_argument('--runs', type=int, default=3, help='количество запусков, берется медиана')
+    parser.add_argument('--top', type=int, default=15, help='количество пакетов в отчете')
+    parser.add_argument('--json', action='store_true', help='вывод отчета в формате JSON')
+    parser.add_argument('app_args', nargs='*', help='аргументы приложения')
+    args = parser.parse_args(argv)
+
+    runs = [run_once(args.app_args) for _ in range(args.runs)]
+
+    milestones = {name: statistics.median(run[0][name] for run in runs) for name in runs[0][0]}
+    names = {name for _, packages in runs for name in packages}
+    packages = {name: statistics.median(run[1].get(name, 0.0) for run in runs) for name in names}
+    packages = dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top])
+
+    if args.json:
+        print(json.dumps({'runs': args.runs, 'milestones': milestones, 'imports': packages}, indent=4))
+        return
+
+    print(f'Этапы запуска (медиана {args.runs} запусков), с от начала загрузки модулей приложения:')
+    for name, seconds in milestones.items():
+        print(f'  {name:<12} {seconds:8.3f}')
+
+    print('Время импорта по пакетам, с (без учета вложенных пакетов):')
+    for name, seconds in packages.items():
+        print(f'  {name:<24} {seconds:8.3f}')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -1,5 +1,105 @@
+import os
 import random
-import h5py
+import struct
+import uuid
+from typing import Callable, NamedTuple
+
+import numpy
+
+from src.tree_store import FlatTree, StoreChanges, TreeStore, empty_flat_tree, nested_to_flat, preorder_positions
+
+
+# Версия поколоночного формата hdf5, хранится в атрибуте format_version файла
+HDF5_FORMAT_VERSION = 2
+
+# Наборы данных поколоночного формата, в порядке полей FlatTree
+HDF5_FLAT_DATASETS = (('levels', numpy.int32), ('values', numpy.int64), ('nodes', numpy.uint8))
+
+# Количество элементов, читаемых или записываемых за одно обращение к набору данных
+HDF5_IO_BLOCK = 1 << 20
+
+# Формат hdf5 с массивами хранилища дерева, который можно перезаписывать частично: в нем сохраняются файлы hdf5
+# из приложения. Поколоночный формат читается и записывается при конвертации (write_tree)
+HDF5_STORE_VERSION = 3
+
+# Наборы данных формата хранилища: массивы TreeStore без емкости блоков потомков и стека освободившихся
+# идентификаторов. При чтении емкость блока равна количеству потомков, свободные идентификаторы - без родителя
+HDF5_STORE_DATASETS = (
+    ('parent', numpy.int64), ('row', numpy.int64), ('depth', numpy.int32), ('value', numpy.int64),
+    ('sum', numpy.int64), ('child_start', numpy.int64), ('child_count', numpy.int64),
+    ('children', numpy.int64), ('level_sum', numpy.int64), ('level_count', numpy.int64),
+)
+
+# Размер блока (chunk) сжатых наборов данных хранилища: частичная запись переписывает только блоки
+# с измененными элементами. Переписанный сжатый блок может не поместиться на прежнее место и занять новое
+HDF5_STORE_CHUNK = 1 << 12
+
+# Полная перезапись файла вместо частичной: доля неиспользуемых ячеек блоков потомков
+# и рост размера файла относительно размера после последней полной записи
+HDF5_COMPACT_GARBAGE = 0.25
+HDF5_COMPACT_GROWTH = 2.0
+
+# Собственный двоичный формат: заголовок (сигнатура, версия, количество массивов), таблица массивов
+# (имя, тип данных, смещение от начала файла, количество элементов) и сами массивы хранилища дерева
+# в порядке байтов little-endian, каждый с выравниванием NATIVE_ALIGNMENT байт
+NATIVE_MAGIC = b'QTTREE\r\n'
+NATIVE_FORMAT_VERSION = 1
+NATIVE_HEADER = struct.Struct('<8sII')
+NATIVE_ENTRY = struct.Struct('<16s8sQQ')
+NATIVE_ALIGNMENT = 64
+
+# Размер блока при потоковом чтении JSON и количество элементов в одной записываемой части
+JSON_IO_BLOCK = 1 << 20
+JSON_WRITE_BLOCK = 1 << 17
+
+# Отступ вложенных списков при записи JSON, как в json.dump(..., indent='    ')
+JSON_INDENT = '    '
+
+# Типы файлов по расширению, в виде фильтров диалоговых окон
+FILE_TYPES = {'.json': '*.json', '.hdf5': '*.hdf5', '.h5': '*.hdf5', '.tree': '*.tree'}
+
+# Функция уведомления о ходе выполнения: (выполнено, всего)
+Progress = Callable[[int, int], None]
+
+
+class StorePatch(NamedTuple):
+    '''
+    Снимок хранилища дерева для записи в файл hdf5: attrs - скалярные поля хранилища, lengths - длины массивов,
+    slices - части массивов (имя, начало, копия данных). Полный снимок содержит массивы целиком,
+    частичный - только блоки с изменениями.
+    '''
+
+    attrs: dict[str, int]
+    lengths: dict[str, int]
+    slices: list[tuple[str, int, numpy.ndarray]]
+
+
+class SyncedFile(NamedTuple):
+    '''
+    Файл hdf5, совпадающий с данными модели на момент последнего чтения или записи:
+    путь, метка записи, (размер, время изменения) файла и размер файла после последней полной записи
+    '''
+
+    path: str
+    revision: str
+    stat: tuple[int, int]
+    compact_size: int
+
+
+    def matches(self, path: str) -> bool:
+        '''Проверить, что файл path - этот же файл и он не изменялся после последней записи'''
+
+        try:
+            return os.path.abspath(path) == os.path.abspath(self.path) and file_stat(path) == self.stat
+        except OSError:
+            return False
+
+
+def file_stat(path: str) -> tuple[int, int]:
+    '''Размер и время изменения файла'''
+
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
 
 
 def gen_random_tree(elements_min: int, elements_max: int, value_min: int, value_max: int, max_sublevel: int = 0):
@@ -19,12 +119,356 @@ def gen_random_tree(elements_min: int, elements_max: int, value_min: int, value_
     return arr
 
 
+def gen_random_flat_tree(
+        size: int,
+        seed: int | None = None,
+        max_depth: int = 4,
+        fanout_min: int = 3,
+        fanout_max: int = 10,
+        node_probability: float = 0.25,
+        value_min: int = -33,
+        value_max: int = 33,
+    ) -> FlatTree:
+    '''
+    Сгенерировать дерево ровно из size элементов с рандомными данными сразу в плоском виде.
+    Дерево строится по уровням векторными операциями NumPy: элемент становится "Узлом" с
+    вероятностью node_probability (если не достигнута глубина max_depth), количество потомков
+    "Узла" - от fanout_min до fanout_max, значения "Лепестков" - от value_min до value_max.
+    Результат воспроизводим при одинаковом seed, вложенные списки - через flat_to_nested.
+    '''
+
+    if size <= 0:
+        return empty_flat_tree()
+
+    rng = numpy.random.default_rng(seed)
+
+    # Ожидаемый размер поддерева элемента первого уровня, для оценки числа таких элементов
+    subtree_size = 1.0
+    for _ in range(max_depth):
+        subtree_size = 1 + node_probability * (fanout_min + fanout_max) / 2 * subtree_size
+
+    parts: list[FlatTree] = []
+    total = 0
+
+    # Порции поддеревьев первого уровня генерируются, пока не наберется size элементов
+    while total < size:
+        counts = []
+        nodes = [numpy.zeros(max(1, int((size - total) / subtree_size) + 1), dtype=numpy.bool_)]
+
+        for level in range(max_depth + 1):
+            if level < max_depth:
+                nodes[level] = rng.random(len(nodes[level])) < node_probability
+
+            level_counts = numpy.where(nodes[level], rng.integers(fanout_min, fanout_max + 1, len(nodes[level])), 0)
+            counts.append(level_counts)
+
+            if level < max_depth:
+                nodes.append(numpy.zeros(int(level_counts.sum()), dtype=numpy.bool_))
+
+        positions = preorder_positions(counts)
+        count = sum(len(level_nodes) for level_nodes in nodes)
+
+        levels = numpy.empty(count, dtype=numpy.int32)
+        is_node = numpy.empty(count, dtype=numpy.bool_)
+
+        for level, (level_nodes, position) in enumerate(zip(nodes, positions)):
+            levels[position] = level
+            is_node[position] = level_nodes
+
+        values = numpy.where(is_node, 0, rng.integers(value_min, value_max + 1, count))
+
+        parts.append(FlatTree(levels, values, is_node))
+        total += count
+
+    levels, values, is_node = (numpy.concatenate(arrays)[:size] for arrays in zip(*parts))
+
+    # "Узлы", потомки которых не вошли в size элементов, становятся "Лепестками"
+    empty = is_node & (numpy.append(levels[1:], -1) <= levels)
+    is_node[empty] = False
+    values[empty] = rng.integers(value_min, value_max + 1, int(empty.sum()))
+
+    return FlatTree(levels, values, is_node)
+
+
+class JsonTreeReader:
+    '''
+    Потоковый разбор JSON с деревом из вложенных списков целых чисел сразу в плоский вид.
+    Текст подается блоками через feed, каждый блок разбирается векторными операциями NumPy,
+    в памяти хранятся только плоские массивы и незавершенное число на границе блоков.
+    '''
+
+    # Допустимые символы: пробельные, скобки списков, запятые, цифры и знак минус
+    ALLOWED = numpy.zeros(256, dtype=numpy.bool_)
+    ALLOWED[list(b' \t\r\n[],-0123456789')] = True
+
+    # Наибольшее количество цифр числа int64, значение дополнительно проверяется на диапазон int64.
+    # Числа собираются в uint64: 19 цифр не переполняют 64 бита
+    MAX_DIGITS = 19
+    POWERS = 10 ** numpy.arange(MAX_DIGITS + 1, dtype=numpy.uint64)
+    INT64_LIMIT = numpy.uint64(1 << 63)
+
+    # Значимые символы: открывающая и закрывающая скобки, начало числа, запятая; начало файла
+    TOKEN_OPEN, TOKEN_CLOSE, TOKEN_NUMBER, TOKEN_COMMA, TOKEN_START = range(5)
+
+    # Допустимые пары соседних значимых символов [предыдущий, следующий]: запятая стоит только
+    # между значениями, значения одного списка разделены запятыми
+    TOKEN_PAIRS = numpy.zeros((5, 4), dtype=numpy.bool_)
+    TOKEN_PAIRS[TOKEN_OPEN, [TOKEN_OPEN, TOKEN_CLOSE, TOKEN_NUMBER]] = True
+    TOKEN_PAIRS[TOKEN_CLOSE, [TOKEN_CLOSE, TOKEN_COMMA]] = True
+    TOKEN_PAIRS[TOKEN_NUMBER, [TOKEN_CLOSE, TOKEN_COMMA]] = True
+    TOKEN_PAIRS[TOKEN_COMMA, [TOKEN_OPEN, TOKEN_NUMBER]] = True
+    TOKEN_PAIRS[TOKEN_START, [TOKEN_OPEN, TOKEN_CLOSE, TOKEN_NUMBER]] = True
+
+    def __init__(self):
+
+        # Количество открытых списков, включая внешний
+        self.depth = 0
+        self.root_seen = False
+
+        # Последний значимый символ разобранных блоков
+        self.last_token = self.TOKEN_START
+
+        # Незавершенное число в конце предыдущего блока
+        self.tail = b''
+
+        self.parts: list[FlatTree] = []
+
+
+    def feed(self, block: bytes, final: bool = False):
+        '''Разобрать очередной блок текста, final - последний блок'''
+
+        data = self.tail + block
+
+        # Число на конце блока может продолжиться в следующем блоке
+        if not final:
+            cut = len(data)
+            while cut > 0 and data[cut - 1] in b'-0123456789':
+                cut -= 1
+            data, self.tail = data[:cut], data[cut:]
+        else:
+            self.tail = b''
+
+        chars = numpy.frombuffer(data, dtype=numpy.uint8)
+        if numpy.bincount(chars, minlength=256)[~self.ALLOWED].any():
+            raise ValueError('Файл JSON должен содержать только вложенные списки целых чисел')
+
+        is_open = chars == ord('[')
+        is_close = chars == ord(']')
+        is_number = ((chars - ord('0')) < 10) | (chars == ord('-'))
+        number_start = is_number & ~numpy.concatenate(([False], is_number[:-1]))
+
+        # Дальше разбираются только значимые позиции: скобки и начала чисел
+        marks = numpy.flatnonzero(is_open | is_close | number_start)
+        steps = is_open[marks].astype(numpy.int64) - is_close[marks]
+
+        # Количество открытых списков перед каждой значимой позицией
+        depth = numpy.cumsum(steps) - steps + self.depth
+
+        if len(marks):
+            if (depth + steps).min() < 0:
+                raise ValueError('Некорректный JSON: лишняя закрывающая скобка')
+            self.depth = int(depth[-1] + steps[-1])
+
+        # События в порядке обхода: открытие списка ("Узел") и начало числа ("Лепесток")
+        opening = steps >= 0
+        events, event_depth = marks[opening], depth[opening]
+
+        # Внешний список - корень дерева, он не попадает в плоские данные
+        roots = event_depth == 0
+        if roots.any():
+            if self.root_seen or roots.sum() > 1 or not is_open[events[roots]].all():
+                raise ValueError('Файл JSON должен содержать один внешний список')
+            self.root_seen = True
+
+        self.check_separators(is_open, is_close, number_start, chars == ord(','))
+
+        events, event_depth = events[~roots], event_depth[~roots]
+        nodes = is_open[events]
+
+        values = numpy.zeros(len(events), dtype=numpy.int64)
+        values[~nodes] = self.parse_numbers(chars, is_number, number_start)
+
+        self.parts.append(FlatTree((event_depth - 1).astype(numpy.int32), values, nodes))
+
+
+    def check_separators(self, is_open: numpy.ndarray, is_close: numpy.ndarray, number_start: numpy.ndarray, is_comma: numpy.ndarray):
+        '''Проверить запятые: только между значениями списка, без пропущенных, лишних и висячих запятых'''
+
+        tokens = numpy.flatnonzero(is_open | is_close | number_start | is_comma)
+        if len(tokens) == 0:
+            return
+
+        kinds = numpy.full(len(tokens), self.TOKEN_NUMBER, dtype=numpy.int64)
+        kinds[is_open[tokens]] = self.TOKEN_OPEN
+        kinds[is_close[tokens]] = self.TOKEN_CLOSE
+        kinds[is_comma[tokens]] = self.TOKEN_COMMA
+
+        previous = numpy.concatenate(([self.last_token], kinds[:-1]))
+        if not self.TOKEN_PAIRS[previous, kinds].all():
+            raise ValueError('Некорректный JSON: пропущенная или лишняя запятая')
+
+        self.last_token = int(kinds[-1])
+
+
+    def parse_numbers(self, chars: numpy.ndarray, is_number: numpy.ndarray, number_start: numpy.ndarray) -> numpy.ndarray:
+        '''Значения всех чисел блока'''
+
+        positions = numpy.flatnonzero(is_number)
+        if len(positions) == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        starts_mask = number_start[positions]
+        number = numpy.cumsum(starts_mask) - 1
+        starts = numpy.flatnonzero(starts_mask)
+        lengths = numpy.diff(numpy.append(starts, len(positions)))
+
+        minus = chars[positions] == ord('-')
+        negative = minus[starts]
+
+        # Минус допустим только первым символом числа и не может быть числом сам по себе
+        if (minus.sum() != negative.sum()) or (lengths[negative] == 1).any():
+            raise ValueError('Некорректное число в файле JSON')
+
+        # Число из нескольких цифр не может начинаться с нуля
+        first_digits = chars[positions[starts + negative]]
+        if ((first_digits == ord('0')) & (lengths - negative > 1)).any():
+            raise ValueError('Некорректное число в файле JSON: ведущий ноль')
+        if (lengths - negative > self.MAX_DIGITS).any():
+            raise ValueError('Слишком большое число в файле JSON')
+
+        # Вклад каждой цифры: цифра, умноженная на степень десяти по ее позиции с конца числа
+        exponents = (starts + lengths)[number] - 1 - numpy.arange(len(positions))
+        digits = numpy.where(minus, 0, chars[positions].astype(numpy.int64) - ord('0')).astype(numpy.uint64)
+        values = numpy.add.reduceat(digits * self.POWERS[exponents], starts)
+
+        # Диапазон int64: до 2**63 - 1, отрицательные - до -2**63
+        if (values > numpy.where(negative, self.INT64_LIMIT, self.INT64_LIMIT - numpy.uint64(1))).any():
+            raise ValueError('Слишком большое число в файле JSON')
+
+        # Отрицание по модулю 2**64 дает то же представление, что и int64 (в том числе для -2**63)
+        return numpy.where(negative, numpy.uint64(0) - values, values).view(numpy.int64)
+
+
+    def result(self) -> FlatTree:
+        '''Плоские данные разобранного дерева'''
+
+        if not self.root_seen or self.depth != 0 or self.tail:
+            raise ValueError('Некорректный JSON: файл неполон или не содержит список')
+
+        # После внешнего списка не может быть запятой
+        if self.last_token != self.TOKEN_CLOSE:
+            raise ValueError('Некорректный JSON: пропущенная или лишняя запятая')
+
+        if not self.parts:
+            return empty_flat_tree()
+
+        return FlatTree(*(numpy.concatenate(arrays) for arrays in zip(*self.parts)))
+
+
+def json_read_flat(file, size: int | None = None, progress: Progress | None = None) -> FlatTree:
+    '''Потоково прочитать дерево в плоском виде из открытого в двоичном режиме файла JSON'''
+
+    reader = JsonTreeReader()
+    done = 0
+
+    while block := file.read(JSON_IO_BLOCK):
+        reader.feed(block)
+
+        done += len(block)
+        if progress and size: progress(done, size)
+
+    reader.feed(b'', final=True)
+
+    return reader.result()
+
+
+def json_flat_chunks(flat: FlatTree, indent: str | None = JSON_INDENT, block: int = JSON_WRITE_BLOCK):
+    '''
+    Сформировать текст JSON дерева в плоском виде по частям, по block элементов в части.
+    Текст совпадает с json.dumps вложенных списков: с отступом indent или, при indent=None,
+    компактный - как json.dumps(..., separators=(',', ':')), без пробелов после запятых.
+    '''
+
+    count = len(flat.levels)
+
+    if count == 0:
+        yield '[]'
+        return
+
+    levels = flat.levels.astype(numpy.int64)
+    next_levels = numpy.append(levels[1:], -1)
+
+    # "Узел" с потомками открывает список, за ним сразу следует первый потомок без запятой
+    opened = flat.nodes & (next_levels == levels + 1)
+    empty = flat.nodes & ~opened
+
+    # Количество списков, закрываемых после элемента (после последнего - и внешний список)
+    closings = levels + opened - next_levels
+
+    def line(depth: int) -> str:
+        return '\n' + indent * depth if indent is not None else ''
+
+    closing_cache: dict[tuple[int, int], str] = {}
+
+    def close(open_count: int, closing: int) -> str:
+        key = (open_count, closing)
+        if key not in closing_cache:
+            closing_cache[key] = ''.join(line(depth - 1) + ']' for depth in range(open_count, open_count - closing, -1))
+        return closing_cache[key]
+
+    prefixes = [line(depth + 1) for depth in range(int(levels.max()) + 1)]
+
+    yield '['
+
+    for start in range(0, count, block):
+        stop = min(start + block, count)
+        parts = []
+
+        for level, value, is_opened, is_empty, closing in zip(
+            levels[start:stop].tolist(),
+            flat.values[start:stop].tolist(),
+            opened[start:stop].tolist(),
+            empty[start:stop].tolist(),
+            closings[start:stop].tolist(),
+        ):
+            parts.append(prefixes[level])
+            parts.append('[' if is_opened else '[]' if is_empty else str(value))
+
+            if closing:
+                parts.append(close(level + 1 + is_opened, closing))
+
+            if not is_opened:
+                parts.append(',')
+
+        # После последнего элемента запятая не нужна
+        if stop == count:
+            parts.pop()
+
+        yield ''.join(parts)
+
+
+def json_write_flat(file, flat: FlatTree, indent: str | None = JSON_INDENT, progress: Progress | None = None):
+    '''Потоково записать дерево в плоском виде в открытый в двоичном режиме файл JSON'''
+
+    count = len(flat.levels)
+    done = 0
+
+    for chunk in json_flat_chunks(flat, indent):
+        file.write(chunk.encode('utf-8'))
+
+        done = min(done + JSON_WRITE_BLOCK, count)
+        if progress: progress(done, count)
+
+
 def hdf5_read_recursive(group):
-    '''Извлечь данные из данных в формате hdf5'''
+    '''Извлечь данные из данных в формате hdf5 (устаревший формат: группа на список, набор данных на значение)'''
+
+    import h5py
 
     data = []
 
-    for key in group.keys():
+    # Ключи - номера элементов, упорядочиваются численно ("2" раньше "10")
+    for key in sorted(group.keys(), key=int):
         item = group[key]
 
         if isinstance(item, h5py.Group):
@@ -43,3 +487,460 @@ def hdf5_write_recursive(group, data):
             hdf5_write_recursive(subgroup, item)
         else:
             group.create_dataset(str(n), data=item)
+
+
+def hdf5_is_flat(group) -> bool:
+    '''Проверить, записаны ли данные в поколоночном формате'''
+
+    return 'format_version' in group.attrs
+
+
+def hdf5_read_datasets(group, datasets: tuple[tuple[str, type], ...], progress: Progress | None = None) -> list[numpy.ndarray]:
+    '''Прочитать наборы данных целиком, крупными блоками, а не поэлементно'''
+
+    total = sum(len(group[name]) for name, _ in datasets)
+    done = 0
+
+    arrays = []
+    for name, dtype in datasets:
+        dataset = group[name]
+        array = numpy.empty(len(dataset), dtype=dtype)
+
+        for start in range(0, len(dataset), HDF5_IO_BLOCK):
+            stop = min(start + HDF5_IO_BLOCK, len(dataset))
+            array[start:stop] = dataset[start:stop]
+
+            done += stop - start
+            if progress: progress(done, total)
+
+        arrays.append(array)
+
+    return arrays
+
+
+def hdf5_read_flat(group, progress: Progress | None = None) -> FlatTree:
+    '''Извлечь дерево в плоском виде из данных в поколоночном формате hdf5'''
+
+    version = int(group.attrs['format_version'])
+    if version > HDF5_FORMAT_VERSION:
+        raise ValueError(f'Неподдерживаемая версия формата hdf5: {version}')
+
+    levels, values, nodes = hdf5_read_datasets(group, HDF5_FLAT_DATASETS, progress)
+    return FlatTree(levels, values, nodes.astype(numpy.bool_))
+
+
+def hdf5_write_flat(group, flat: FlatTree, compression: str | None = 'gzip', chunk_size: int = 1 << 16, progress: Progress | None = None):
+    '''Записать дерево в плоском виде в указанный hdf5 контейнер в поколоночном формате'''
+
+    group.attrs['format_version'] = HDF5_FORMAT_VERSION
+
+    total = sum(len(array) for array in flat)
+    done = 0
+
+    for (name, dtype), array in zip(HDF5_FLAT_DATASETS, flat):
+        dataset = group.create_dataset(
+            name,
+            shape=(len(array),),
+            dtype=dtype,
+            chunks=(max(1, min(chunk_size, len(array))),),
+            maxshape=(None,),
+            compression=compression,
+        )
+
+        # Запись массива крупными блоками
+        for start in range(0, len(array), HDF5_IO_BLOCK):
+            stop = min(start + HDF5_IO_BLOCK, len(array))
+            dataset[start:stop] = numpy.asarray(array[start:stop], dtype=dtype)
+
+            done += stop - start
+            if progress: progress(done, total)
+
+
+def hdf5_is_store(group) -> bool:
+    '''Проверить, записаны ли данные в формате хранилища'''
+
+    return int(group.attrs.get('format_version', 0)) >= HDF5_STORE_VERSION
+
+
+def hdf5_read_store(group, progress: Progress | None = None) -> TreeStore:
+    '''Построить хранилище дерева из данных hdf5 в формате хранилища, без пересчета'''
+
+    version = int(group.attrs['format_version'])
+    if version > HDF5_STORE_VERSION:
+        raise ValueError(f'Неподдерживаемая версия формата hdf5: {version}')
+
+    # Признак снимается на время частичной записи и возвращается после нее
+    if not group.attrs.get('complete', False):
+        raise ValueError('Запись файла hdf5 не была завершена, файл поврежден')
+
+    arrays = dict(zip((name for name, _ in HDF5_STORE_DATASETS), hdf5_read_datasets(group, HDF5_STORE_DATASETS, progress)))
+
+    # Блоки потомков записаны без запаса
+    arrays['child_capacity'] = arrays['child_count'].copy()
+
+    store = TreeStore.from_arrays(arrays)
+    store.free_ids = numpy.flatnonzero(store.parent[1:] == -1) + 1
+    store.free_count = len(store.free_ids)
+    store.children_garbage = store.children_size - int(store.child_count.sum())
+
+    return store
+
+
+def hdf5_write_slices(group, slices: list[tuple[str, int, numpy.ndarray]], progress: Progress | None = None):
+    '''Записать части массивов в наборы данных крупными блоками'''
+
+    total = sum(len(data) for _, _, data in slices)
+    done = 0
+
+    for name, start, data in slices:
+        dataset = group[name]
+
+        for offset in range(0, len(data), HDF5_IO_BLOCK):
+            part = data[offset:offset + HDF5_IO_BLOCK]
+            dataset[start + offset:start + offset + len(part)] = part
+
+            done += len(part)
+            if progress: progress(done, total)
+
+
+def hdf5_write_store(group, patch: StorePatch, revision: str, progress: Progress | None = None):
+    '''Записать полный снимок хранилища в указанный hdf5 контейнер в формате хранилища'''
+
+    group.attrs['format_version'] = HDF5_STORE_VERSION
+
+    for name, dtype in HDF5_STORE_DATASETS:
+        group.create_dataset(name, shape=(patch.lengths[name],), dtype=dtype, chunks=(HDF5_STORE_CHUNK,), maxshape=(None,), compression='gzip')
+
+    hdf5_write_slices(group, patch.slices, progress)
+
+    group.attrs.update(patch.attrs)
+    group.attrs['revision'] = revision
+    group.attrs['complete'] = True
+
+
+def hdf5_update_store(group, patch: StorePatch, base_revision: str, revision: str, progress: Progress | None = None):
+    '''
+    Перезаписать на месте измененные части хранилища в контейнере, записанном с меткой base_revision.
+    На время записи снимается признак завершенной записи: прерванная запись не будет прочитана как целый файл.
+    '''
+
+    if not hdf5_is_store(group) or group.attrs.get('revision') != base_revision:
+        raise ValueError('Файл изменен после последнего сохранения')
+
+    group.attrs['complete'] = False
+    group.file.flush()
+
+    for name, length in patch.lengths.items():
+        group[name].resize((length,))
+
+    hdf5_write_slices(group, patch.slices, progress)
+
+    group.attrs.update(patch.attrs)
+    group.attrs['revision'] = revision
+    group.attrs['complete'] = True
+
+
+def hdf5_synced_file(path: str) -> SyncedFile | None:
+    '''Описание файла hdf5 в формате хранилища для последующей частичной записи, None - файл другого формата'''
+
+    import h5py
+
+    with h5py.File(path, 'r') as file:
+        if not hdf5_is_store(file):
+            return None
+        revision = str(file.attrs['revision'])
+
+    stat = file_stat(path)
+    return SyncedFile(path, revision, stat, stat[0])
+
+
+def chunk_ranges(chunks: numpy.ndarray, chunk: int, length: int) -> list[tuple[int, int]]:
+    '''Диапазоны [начало, конец) элементов массива длины length, покрывающие блоки с номерами chunks (по возрастанию)'''
+
+    if len(chunks) == 0:
+        return []
+
+    # Соседние блоки объединяются в один диапазон
+    breaks = numpy.flatnonzero(numpy.diff(chunks) != 1) + 1
+    starts = chunks[numpy.concatenate(([0], breaks))] * chunk
+    stops = numpy.minimum((chunks[numpy.concatenate((breaks - 1, [len(chunks) - 1]))] + 1) * chunk, length)
+
+    return [(start, stop) for start, stop in zip(starts.tolist(), stops.tolist()) if start < stop]
+
+
+def store_patch(store: TreeStore, changes: StoreChanges | None, chunk: int = HDF5_STORE_CHUNK) -> StorePatch:
+    '''
+    Снимок хранилища для записи в файл hdf5 в формате хранилища: полный (changes is None) или только блоки
+    массивов, содержащие изменения changes. Данные копируются, хранилище можно изменять во время записи снимка.
+    Перед полным снимком блоки потомков хранилища уплотняются без запаса, как они записываются в файл.
+    '''
+
+    node_arrays = tuple(name for name, _ in HDF5_STORE_DATASETS if name in TreeStore.NODE_ARRAYS)
+
+    if changes is None:
+        store.compact_children(trim=True)
+        store.reset_changes()
+
+    lengths = {name: store.size for name in node_arrays}
+    lengths.update(
+        children=store.children_size,
+        level_sum=len(store.level_sum),
+        level_count=len(store.level_count),
+    )
+    attrs = {'size': store.size, 'children_size': store.children_size}
+
+    if changes is None:
+        node_ranges = [(0, store.size)]
+        children_ranges = [(0, store.children_size)]
+    else:
+        node_ranges = chunk_ranges(numpy.unique(changes.nodes // chunk), chunk, store.size)
+
+        children_chunks = [numpy.arange(start // chunk, (stop - 1) // chunk + 1) for start, stop in changes.children.tolist()]
+        children_chunks = numpy.unique(numpy.concatenate(children_chunks)) if children_chunks else numpy.zeros(0, dtype=numpy.int64)
+        children_ranges = chunk_ranges(children_chunks, chunk, store.children_size)
+
+    slices = []
+    for name in node_arrays:
+        array = getattr(store, name)
+        slices.extend((name, start, array[start:stop].copy()) for start, stop in node_ranges)
+
+    slices.extend(('children', start, store.children[start:stop].copy()) for start, stop in children_ranges)
+
+    # Накопители уровней - по элементу на уровень, записываются всегда целиком
+    slices.append(('level_sum', 0, store.level_sum.copy()))
+    slices.append(('level_count', 0, store.level_count.copy()))
+
+    return StorePatch(attrs, lengths, slices)
+
+
+def store_needs_compaction(store: TreeStore, synced: SyncedFile) -> bool:
+    '''Проверить, пора ли вместо частичной записи переписать файл целиком'''
+
+    # Неиспользуемые ячейки блоков потомков занимают место в файле, освободившиеся идентификаторы займут новые элементы
+    if store.children_garbage > HDF5_COMPACT_GARBAGE * store.children_size:
+        return True
+
+    # Перезаписанные и перенесенные блоки оставляют в файле hdf5 неиспользуемое место
+    return synced.stat[0] > HDF5_COMPACT_GROWTH * synced.compact_size
+
+
+def hdf5_read(group, progress: Progress | None = None) -> FlatTree:
+    '''Извлечь дерево в плоском виде из данных hdf5, формат определяется автоматически'''
+
+    if hdf5_is_store(group):
+        return hdf5_read_store(group, progress).to_flat()
+
+    if hdf5_is_flat(group):
+        return hdf5_read_flat(group, progress)
+
+    import h5py
+
+    # Устаревший формат читается по элементам первого уровня
+    keys = sorted(group.keys(), key=int)
+    data = []
+
+    for n, key in enumerate(keys):
+        item = group[key]
+        data.append(hdf5_read_recursive(item) if isinstance(item, h5py.Group) else item[()])
+        if progress: progress(n + 1, len(keys))
+
+    return nested_to_flat(data)
+
+
+def native_write(path: str, store: TreeStore, progress: Progress | None = None):
+    '''Записать компактное хранилище дерева в файл собственного двоичного формата'''
+
+    arrays = store.to_arrays()
+
+    # Расположение массивов в файле: сразу за заголовком и таблицей, с выравниванием
+    offset = NATIVE_HEADER.size + NATIVE_ENTRY.size * len(arrays)
+    entries = []
+
+    for name, array in arrays.items():
+        offset = -(-offset // NATIVE_ALIGNMENT) * NATIVE_ALIGNMENT
+        dtype = array.dtype.newbyteorder('<')
+        entries.append((name, dtype, offset, len(array)))
+        offset += dtype.itemsize * len(array)
+
+    total = offset
+    done = 0
+
+    with open(path, 'wb') as file:
+        file.write(NATIVE_HEADER.pack(NATIVE_MAGIC, NATIVE_FORMAT_VERSION, len(entries)))
+
+        for name, dtype, offset, length in entries:
+            file.write(NATIVE_ENTRY.pack(name.encode('ascii'), dtype.str.encode('ascii'), offset, length))
+
+        # Запись массивов крупными блоками
+        for name, dtype, offset, length in entries:
+            file.write(bytes(offset - file.tell()))
+
+            array = arrays[name]
+            for start in range(0, length, HDF5_IO_BLOCK):
+                file.write(array[start:start + HDF5_IO_BLOCK].astype(dtype, copy=False).tobytes())
+
+                done = file.tell()
+                if progress: progress(done, total)
+
+
+def native_read(path: str) -> TreeStore:
+    '''
+    Открыть файл собственного двоичного формата.
+    Массивы хранилища отображаются в память без чтения и разбора: страницы файла подгружаются
+    при обращении к элементам, изменения остаются в памяти процесса и не попадают в файл.
+    '''
+
+    size = os.path.getsize(path)
+
+    with open(path, 'rb') as file:
+        header = file.read(NATIVE_HEADER.size)
+        if len(header) < NATIVE_HEADER.size:
+            raise ValueError('Файл не является файлом дерева')
+
+        magic, version, count = NATIVE_HEADER.unpack(header)
+        if magic != NATIVE_MAGIC:
+            raise ValueError('Файл не является файлом дерева')
+        if version > NATIVE_FORMAT_VERSION:
+            raise ValueError(f'Неподдерживаемая версия формата файла дерева: {version}')
+
+        table = file.read(NATIVE_ENTRY.size * count)
+        if len(table) < NATIVE_ENTRY.size * count:
+            raise ValueError('Файл дерева поврежден')
+
+    # Одно отображение всего файла в режиме копирования при записи
+    memory = numpy.memmap(path, dtype=numpy.uint8, mode='c')
+    arrays = {}
+
+    for entry in NATIVE_ENTRY.iter_unpack(table):
+        name, dtype, offset, length = entry
+        name = name.rstrip(b'\0').decode('ascii')
+        dtype = numpy.dtype(dtype.rstrip(b'\0').decode('ascii'))
+
+        if offset % NATIVE_ALIGNMENT or offset + dtype.itemsize * length > size:
+            raise ValueError('Файл дерева поврежден')
+
+        arrays[name] = numpy.frombuffer(memory, dtype=dtype, count=length, offset=offset)
+
+    missing = set(TreeStore.SAVED_ARRAYS) - set(arrays)
+    if missing:
+        raise ValueError(f'В файле дерева нет массивов: {", ".join(sorted(missing))}')
+
+    store = TreeStore.from_arrays(arrays)
+    store.mapped_path = path
+
+    return store
+
+
+def file_type_of(path: str) -> str:
+    '''Тип файла по расширению, в виде фильтра диалогового окна ('*.json', '*.hdf5' или '*.tree')'''
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FILE_TYPES:
+        raise ValueError(f'Неизвестный тип файла: {path}')
+
+    return FILE_TYPES[extension]
+
+
+def read_tree(path: str, file_type: str, progress: Progress | None = None, jobs: int | None = None) -> TreeStore:
+    '''
+    Прочитать файл дерева указанного типа и построить хранилище.
+    jobs - количество процессов разбора больших файлов (None - по числу ядер, 1 - в текущем процессе).
+    '''
+
+    # Собственный формат открывается отображением в память, без чтения и разбора элементов
+    if file_type == '*.tree':
+        return native_read(path)
+
+    # Большие файлы JSON и hdf5 разбираются по частям в пуле процессов
+    from src.parallel import read_tree_parallel
+
+    store = read_tree_parallel(path, file_type, jobs, progress)
+    if store is not None:
+        return store
+
+    if file_type == '*.json':
+
+        # Потоковый разбор блоками сразу в плоский вид, без промежуточных вложенных списков
+        with open(path, 'rb') as file:
+            flat = json_read_flat(file, os.path.getsize(path), progress)
+    else:
+        # h5py импортируется только при первом обращении к файлу hdf5, а не при запуске приложения
+        import h5py
+
+        with h5py.File(path, 'r') as file:
+
+            # Формат хранилища читается сразу в хранилище, без пересчета
+            if hdf5_is_store(file):
+                return hdf5_read_store(file, progress)
+
+            flat = hdf5_read(file, progress)
+
+    store = TreeStore()
+    store.load_flat(flat)
+
+    return store
+
+
+def write_tree(path: str, file_type: str, flat: FlatTree, compact: bool = False, progress: Progress | None = None):
+    '''
+    Записать дерево в плоском виде в файл указанного типа, compact - JSON без отступов.
+    Запись идет во временный файл, чтобы отмена или ошибка не испортили существующий файл.
+    '''
+
+    temp_path = path + '.part'
+
+    try:
+        if file_type == '*.json':
+
+            # Текст формируется и записывается частями, целиком в памяти не собирается
+            with open(temp_path, 'wb') as file:
+                json_write_flat(file, flat, None if compact else JSON_INDENT, progress)
+
+        elif file_type == '*.tree':
+            store = TreeStore()
+            store.load_flat(flat)
+            native_write(temp_path, store, progress)
+
+        else:
+            import h5py
+
+            with h5py.File(temp_path, 'w') as file:
+                hdf5_write_flat(file, flat, progress=progress)
+
+        os.replace(temp_path, path)
+
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_store(path: str, patch: StorePatch, base: SyncedFile | None = None, progress: Progress | None = None) -> SyncedFile:
+    '''
+    Записать снимок хранилища в файл hdf5: полный снимок - во временный файл с заменой существующего,
+    частичный - на место изменившихся частей файла base. Возвращает описание записанного файла.
+    '''
+
+    import h5py
+
+    revision = uuid.uuid4().hex
+
+    if base is not None:
+        with h5py.File(path, 'r+') as file:
+            hdf5_update_store(file, patch, base.revision, revision, progress)
+
+        return SyncedFile(path, revision, file_stat(path), base.compact_size)
+
+    temp_path = path + '.part'
+
+    try:
+        with h5py.File(temp_path, 'w') as file:
+            hdf5_write_store(file, patch, revision, progress)
+
+        os.replace(temp_path, path)
+
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    stat = file_stat(path)
+    return SyncedFile(path, revision, stat, stat[0])
@@ -0,0 +1,898 @@
+import os
+from typing import NamedTuple
+
+import numpy
+
+
+class FlatTree(NamedTuple):
+    '''
+    Дерево в плоском виде, элементы перечислены в порядке прямого обхода.
+    levels - уровень вложенности элемента (0 - элементы первого уровня),
+    values - значения "Лепестков" (для "Узлов" - 0),
+    nodes - признак того, что элемент является "Узлом" (списком)
+    '''
+
+    levels: numpy.ndarray
+    values: numpy.ndarray
+    nodes: numpy.ndarray
+
+
+class StoreChanges(NamedTuple):
+    '''
+    Изменения хранилища после предыдущего получения изменений.
+    nodes - идентификаторы элементов, данные которых изменились (включая новые и удаленные),
+    children - диапазоны [начало, конец) измененных ячеек массива children
+    '''
+
+    nodes: numpy.ndarray
+    children: numpy.ndarray
+
+
+def empty_flat_tree() -> FlatTree:
+    '''Пустое дерево в плоском виде'''
+
+    return FlatTree(
+        numpy.zeros(0, dtype=numpy.int32),
+        numpy.zeros(0, dtype=numpy.int64),
+        numpy.zeros(0, dtype=numpy.bool_),
+    )
+
+
+def nested_to_flat(data: list) -> FlatTree:
+    '''Преобразовать набор вложенных списков в плоский вид'''
+
+    levels: list[int] = []
+    values: list[int] = []
+    nodes: list[bool] = []
+
+    # Обход без рекурсии: стек итераторов по спискам текущей ветви
+    stack = [iter(data)]
+
+    while stack:
+        level = len(stack) - 1
+
+        for item in stack[-1]:
+            if isinstance(item, list):
+                levels.append(level)
+                values.append(0)
+                nodes.append(True)
+                stack.append(iter(item))
+                break
+
+            levels.append(level)
+            values.append(int(item))
+            nodes.append(False)
+        else:
+            stack.pop()
+
+    return FlatTree(
+        numpy.array(levels, dtype=numpy.int32),
+        numpy.array(values, dtype=numpy.int64),
+        numpy.array(nodes, dtype=numpy.bool_),
+    )
+
+
+def flat_to_nested(flat: FlatTree) -> list:
+    '''Преобразовать дерево из плоского вида в набор вложенных списков'''
+
+    root: list = []
+    stack = [root]
+
+    for level, value, node in zip(flat.levels.tolist(), flat.values.tolist(), flat.nodes.tolist()):
+        del stack[level + 1:]
+
+        if node:
+            item: list = []
+            stack[level].append(item)
+            stack.append(item)
+        else:
+            stack[level].append(value)
+
+    return root
+
+
+def sort_by_level(levels: numpy.ndarray) -> numpy.ndarray:
+    '''Стабильно упорядочить позиции элементов по уровню (для небольших уровней - поразрядной сортировкой)'''
+
+    if len(levels) > 0 and levels.max() <= numpy.iinfo(numpy.int16).max:
+        levels = levels.astype(numpy.int16)
+
+    return numpy.argsort(levels, kind='stable')
+
+
+def flat_parents(levels: numpy.ndarray) -> numpy.ndarray:
+    '''Получить позиции родителей элементов дерева в плоском виде (-1 для элементов первого уровня)'''
+
+    parents = numpy.full(len(levels), -1, dtype=numpy.int64)
+
+    if len(levels) == 0:
+        return parents
+
+    # Позиции элементов, сгруппированные по уровням (внутри уровня - по возрастанию)
+    order = sort_by_level(levels)
+    bounds = numpy.cumsum(numpy.bincount(levels))
+
+    # Родитель элемента - ближайший предшествующий ему элемент предыдущего уровня
+    for level in range(1, len(bounds)):
+        previous = order[bounds[level - 2] if level > 1 else 0:bounds[level - 1]]
+        current = order[bounds[level - 1]:bounds[level]]
+        parents[current] = previous[numpy.searchsorted(previous, current) - 1]
+
+    return parents
+
+
+def segment_sums(values: numpy.ndarray, counts: numpy.ndarray) -> numpy.ndarray:
+    '''Суммы последовательных отрезков массива values с длинами counts'''
+
+    cumsum = numpy.zeros(len(values) + 1, dtype=numpy.int64)
+    numpy.cumsum(values, out=cumsum[1:])
+    ends = numpy.cumsum(counts)
+
+    return cumsum[ends] - cumsum[ends - counts]
+
+
+def preorder_positions(counts: list[numpy.ndarray]) -> list[numpy.ndarray]:
+    '''
+    Получить позиции элементов в прямом обходе дерева, заданного по уровням.
+    counts[level] - количество потомков каждого элемента уровня level, элементы следующего
+    уровня сгруппированы по родителям в порядке элементов предыдущего уровня.
+    '''
+
+    if len(counts) == 0:
+        return []
+
+    # Размеры поддеревьев, снизу вверх
+    sizes = [None] * len(counts)
+    sizes[-1] = numpy.ones(len(counts[-1]), dtype=numpy.int64)
+
+    for level in range(len(counts) - 2, -1, -1):
+        sizes[level] = 1 + segment_sums(sizes[level + 1], counts[level])
+
+    # Позиции элементов, сверху вниз
+    positions = [numpy.cumsum(sizes[0]) - sizes[0]]
+
+    for level in range(1, len(counts)):
+        parent_counts = counts[level - 1]
+
+        # Смещение элемента внутри поддерева родителя - сумма размеров предшествующих братьев
+        cumsum = numpy.cumsum(sizes[level]) - sizes[level]
+        segment_start = numpy.repeat(numpy.cumsum(parent_counts) - parent_counts, parent_counts)
+        offsets = cumsum - cumsum[segment_start]
+
+        positions.append(numpy.repeat(positions[level - 1], parent_counts) + 1 + offsets)
+
+    return positions
+
+
+class TreeStore:
+    '''
+    Компактное хранилище дерева в массивах NumPy.
+    Элемент с идентификатором 0 - невидимый корень дерева.
+    Потомки каждого элемента хранятся непрерывным блоком в массиве children,
+    при переполнении блок переносится в конец массива с запасом по размеру.
+    '''
+
+    # Массивы данных элементов, индексируемые идентификатором элемента
+    NODE_ARRAYS = ('parent', 'row', 'depth', 'value', 'sum', 'child_start', 'child_count', 'child_capacity', 'fetched')
+
+    # Массивы, из которых хранилище восстанавливается без пересчета (fetched относится к представлению)
+    SAVED_ARRAYS = NODE_ARRAYS[:-1] + ('children', 'level_sum', 'level_count')
+
+    def __init__(self, capacity: int = 1024):
+        self.clear(capacity)
+
+
+    def clear(self, capacity: int = 1024):
+        '''Очистить хранилище, оставив только корневой элемент'''
+
+        capacity = max(capacity, 1)
+
+        # Родитель элемента (-1 у корня и у свободных идентификаторов)
+        self.parent = numpy.full(capacity, -1, dtype=numpy.int64)
+        # Номер строки элемента в блоке потомков родителя
+        self.row = numpy.zeros(capacity, dtype=numpy.int64)
+        # Уровень вложенности элемента (0 - элементы первого уровня)
+        self.depth = numpy.zeros(capacity, dtype=numpy.int32)
+        # Значение "Лепестка" и закешированная сумма поддерева
+        self.value = numpy.zeros(capacity, dtype=numpy.int64)
+        self.sum = numpy.zeros(capacity, dtype=numpy.int64)
+        # Расположение блока потомков в массиве children
+        self.child_start = numpy.zeros(capacity, dtype=numpy.int64)
+        self.child_count = numpy.zeros(capacity, dtype=numpy.int64)
+        self.child_capacity = numpy.zeros(capacity, dtype=numpy.int64)
+        # Количество первых потомков, уже переданных представлению (ленивое заполнение модели)
+        self.fetched = numpy.zeros(capacity, dtype=numpy.int64)
+
+        self.depth[0] = -1
+
+        # Количество выданных идентификаторов и стек освободившихся идентификаторов
+        self.size = 1
+        self.free_ids = numpy.zeros(0, dtype=numpy.int64)
+        self.free_count = 0
+
+        # Блоки потомков, занятая часть массива и количество неиспользуемых ячеек в ней
+        self.children = numpy.zeros(capacity, dtype=numpy.int64)
+        self.children_size = 0
+        self.children_garbage = 0
+
+        # Накопители по уровням вложенности: сумма значений элементов уровня и их количество
+        self.level_sum = numpy.zeros(0, dtype=numpy.int64)
+        self.level_count = numpy.zeros(0, dtype=numpy.int64)
+
+        # Файл, массивы которого отображены в память хранилища (None - массивы в памяти процесса)
+        self.mapped_path: str | None = None
+
+        # Отслеживание изменений для частичного сохранения: после очистки изменено все хранилище
+        self.reset_changes(True)
+
+
+    def reset_changes(self, changed_all: bool = False):
+        '''Забыть отмеченные изменения, changed_all - считать измененным все хранилище'''
+
+        self.changed_all = changed_all
+        self.changed_nodes: list[numpy.ndarray] = []
+        self.changed_children: list[tuple[int, int]] = []
+        self.changed_count = 0
+
+
+    def mark_nodes(self, ids):
+        '''Отметить изменение данных элементов'''
+
+        if self.changed_all:
+            return
+
+        ids = numpy.array(ids, dtype=numpy.int64, ndmin=1)
+        self.changed_nodes.append(ids)
+        self.changed_count += len(ids)
+
+        # Изменений больше, чем элементов - дешевле считать измененным все хранилище
+        if self.changed_count > self.size:
+            self.reset_changes(True)
+
+
+    def mark_children(self, start: int, stop: int):
+        '''Отметить изменение ячеек start..stop-1 массива children'''
+
+        if self.changed_all or stop <= start:
+            return
+
+        self.changed_children.append((int(start), int(stop)))
+        self.changed_count += 1
+
+        if self.changed_count > self.size:
+            self.reset_changes(True)
+
+
+    def take_changes(self) -> StoreChanges | None:
+        '''
+        Получить изменения хранилища после предыдущего вызова и начать отслеживание заново.
+        None - изменено все хранилище (после загрузки, уплотнения или слишком большого числа изменений).
+        '''
+
+        changes = None
+
+        if not self.changed_all:
+            nodes = numpy.concatenate(self.changed_nodes) if self.changed_nodes else numpy.zeros(0, dtype=numpy.int64)
+            children = numpy.array(self.changed_children, dtype=numpy.int64).reshape(-1, 2)
+            changes = StoreChanges(numpy.unique(nodes), children)
+
+        self.reset_changes()
+
+        return changes
+
+
+    def __len__(self):
+        '''Количество элементов дерева без учета корня'''
+
+        return self.size - self.free_count - 1
+
+
+    def is_alive(self, node: int) -> bool:
+        '''Проверить, что идентификатор принадлежит элементу дерева'''
+
+        return node == 0 or (0 < node < self.size and self.parent[node] != -1)
+
+
+    def is_leaf(self, node: int) -> bool:
+        '''Является ли элемент "Лепестком"'''
+
+        return self.child_count[node] == 0
+
+
+    def child(self, node: int, row: int) -> int:
+        '''Получить идентификатор потомка элемента по номеру строки'''
+
+        return int(self.children[self.child_start[node] + row])
+
+
+    def children_of(self, node: int) -> numpy.ndarray:
+        '''Получить идентификаторы потомков элемента'''
+
+        start = self.child_start[node]
+        return self.children[start:start + self.child_count[node]]
+
+
+    def ancestors(self, node: int) -> list[int]:
+        '''Получить идентификаторы предков элемента, от ближайшего к дальнему, без корня'''
+
+        result = []
+        node = int(self.parent[node])
+
+        while node > 0:
+            result.append(node)
+            node = int(self.parent[node])
+
+        return result
+
+
+    def gather_children(self, nodes: numpy.ndarray) -> numpy.ndarray:
+        '''Получить потомков указанных элементов одним массивом, сохраняя порядок элементов и строк'''
+
+        counts = self.child_count[nodes]
+        total = int(counts.sum())
+
+        if total == 0:
+            return numpy.zeros(0, dtype=numpy.int64)
+
+        # Для каждого потомка - смещение начала блока его родителя относительно позиции в результате
+        offsets = numpy.cumsum(counts) - counts
+        positions = numpy.repeat(self.child_start[nodes] - offsets, counts) + numpy.arange(total)
+
+        return self.children[positions]
+
+
+    def subtree(self, nodes: numpy.ndarray) -> numpy.ndarray:
+        '''Получить идентификаторы элементов поддеревьев (включая сами элементы) в порядке уровней'''
+
+        levels = [numpy.asarray(nodes, dtype=numpy.int64)]
+
+        while len(levels[-1]) > 0:
+            levels.append(self.gather_children(levels[-1]))
+
+        return numpy.concatenate(levels)
+
+
+    def level_order(self, nodes: numpy.ndarray | None = None) -> list[numpy.ndarray]:
+        '''Получить элементы дерева (или поддеревьев элементов nodes), сгруппированные по уровням вложенности'''
+
+        levels = []
+        current = self.children_of(0).copy() if nodes is None else numpy.asarray(nodes, dtype=numpy.int64)
+
+        while len(current) > 0:
+            levels.append(current)
+            current = self.gather_children(current)
+
+        return levels
+
+
+    def _grow_nodes(self, capacity: int):
+        '''Увеличить размер массивов данных элементов'''
+
+        old_capacity = len(self.parent)
+        if capacity <= old_capacity:
+            return
+
+        capacity = max(capacity, old_capacity * 2)
+
+        for name in self.NODE_ARRAYS:
+            array = getattr(self, name)
+            grown = numpy.zeros(capacity, dtype=array.dtype)
+            grown[:old_capacity] = array
+            setattr(self, name, grown)
+
+        self.parent[old_capacity:] = -1
+
+
+    def _allocate(self, count: int) -> numpy.ndarray:
+        '''Выделить идентификаторы для новых элементов'''
+
+        # В первую очередь используются освободившиеся идентификаторы
+        reused = min(count, self.free_count)
+        ids = self.free_ids[self.free_count - reused:self.free_count].copy()
+        self.free_count -= reused
+
+        if count > reused:
+            new = count - reused
+            self._grow_nodes(self.size + new)
+            ids = numpy.concatenate((ids, numpy.arange(self.size, self.size + new, dtype=numpy.int64)))
+            self.size += new
+
+        return ids
+
+
+    def _release(self, ids: numpy.ndarray):
+        '''Освободить идентификаторы удаленных элементов'''
+
+        # Блоки потомков удаленных элементов больше не используются
+        self.children_garbage += int(self.child_capacity[ids].sum())
+
+        self.parent[ids] = -1
+        self.child_count[ids] = 0
+        self.child_capacity[ids] = 0
+        self.fetched[ids] = 0
+
+        if self.free_count + len(ids) > len(self.free_ids):
+            grown = numpy.zeros(max(self.free_count + len(ids), len(self.free_ids) * 2), dtype=numpy.int64)
+            grown[:self.free_count] = self.free_ids[:self.free_count]
+            self.free_ids = grown
+
+        self.free_ids[self.free_count:self.free_count + len(ids)] = ids
+        self.free_count += len(ids)
+
+        self.mark_nodes(ids)
+
+
+    def _reserve_children(self, node: int, count: int):
+        '''Обеспечить место в блоке потомков элемента для count новых потомков'''
+
+        required = self.child_count[node] + count
+        if required <= self.child_capacity[node]:
+            return
+
+        # Уплотнение массива блоков, если неиспользуемых ячеек больше половины
+        if self.children_garbage > self.children_size // 2:
+            self.compact_children()
+
+        capacity = max(int(required) * 2, 4)
+
+        if self.children_size + capacity > len(self.children):
+            grown = numpy.zeros(max(self.children_size + capacity, len(self.children) * 2), dtype=numpy.int64)
+            grown[:self.children_size] = self.children[:self.children_size]
+            self.children = grown
+
+        # Перенос блока потомков в конец массива
+        start = self.child_start[node]
+        size = self.child_count[node]
+        self.children[self.children_size:self.children_size + size] = self.children[start:start + size]
+
+        self.children_garbage += int(self.child_capacity[node])
+        self.child_start[node] = self.children_size
+        self.child_capacity[node] = capacity
+        self.children_size += capacity
+
+        self.mark_nodes(node)
+        self.mark_children(self.children_size - capacity, self.children_size)
+
+
+    def compact_children(self, trim: bool = False):
+        '''Уплотнить массив блоков потомков, убрав неиспользуемые ячейки, trim - убрать и запас блоков'''
+
+        nodes = numpy.flatnonzero(self.child_capacity[:self.size])
+        nodes = nodes[numpy.argsort(self.child_start[nodes], kind='stable')]
+
+        capacities = self.child_count[nodes] if trim else self.child_capacity[nodes]
+        starts = numpy.cumsum(capacities) - capacities
+        total = int(capacities.sum())
+
+        # Перенос начала каждого блока: вместе с запасом или только потомков
+        offsets = numpy.repeat(self.child_start[nodes] - starts, capacities) + numpy.arange(total)
+        children = numpy.zeros(max(total * 2, 1024), dtype=numpy.int64)
+        children[:total] = self.children[offsets]
+
+        self.children = children
+        self.child_start[nodes] = starts
+        self.child_capacity[nodes] = capacities
+        self.children_size = total
+        self.children_garbage = 0
+
+        # Перенесены все блоки потомков
+        self.reset_changes(True)
+
+
+    def insert_children(self, node: int, row: int, values: numpy.ndarray) -> numpy.ndarray:
+        '''
+        Вставить новые "Лепестки" со значениями values в блок потомков элемента начиная со строки row.
+        Суммы предков не пересчитываются.
+        '''
+
+        values = numpy.asarray(values, dtype=numpy.int64)
+        count = len(values)
+
+        ids = self._allocate(count)
+        self._reserve_children(node, count)
+
+        self.parent[ids] = node
+        self.depth[ids] = self.depth[node] + 1
+        self.value[ids] = values
+        self.sum[ids] = values
+        self.child_count[ids] = 0
+        self.child_capacity[ids] = 0
+        self.fetched[ids] = 0
+
+        # Сдвиг последующих потомков и запись новых
+        start = self.child_start[node]
+        size = self.child_count[node]
+        block = self.children[start:start + size + count]
+        block[row + count:] = block[row:size].copy()
+        block[row:row + count] = ids
+        self.child_count[node] = size + count
+
+        self.row[block[row:]] = numpy.arange(row, size + count)
+
+        # Изменились новые и сдвинутые потомки, элемент и часть его блока потомков
+        self.mark_nodes(block[row:])
+        self.mark_nodes(node)
+        self.mark_children(start + row, start + size + count)
+
+        self._add_level_stats(int(self.depth[node]) + 1, int(count), int(values.sum()))
+
+        return ids
+
+
+    def insert_flat(self, node: int, row: int, flat: FlatTree) -> numpy.ndarray:
+        '''
+        Вставить поддеревья в плоском виде (уровень 0 - новые потомки элемента) в блок потомков элемента
+        начиная со строки row. Возвращает идентификаторы новых элементов в порядке flat.
+        Суммы элемента и его предков не пересчитываются.
+        '''
+
+        count = len(flat.levels)
+        ids = numpy.zeros(count, dtype=numpy.int64)
+        parents = flat_parents(flat.levels)
+
+        # "Узлы" вставляются "Лепестками" с нулевым значением, их суммы рассчитываются после вставки потомков
+        values = numpy.where(flat.nodes, 0, flat.values)
+        top = numpy.flatnonzero(parents == -1)
+        ids[top] = self.insert_children(node, row, values[top])
+
+        # Потомки вставляются блоками по родителям; родитель в прямом обходе предшествует потомкам,
+        # поэтому к вставке блока идентификатор родителя уже известен
+        nested = numpy.flatnonzero(parents != -1)
+        nested = nested[numpy.argsort(parents[nested], kind='stable')]
+        owners, starts = numpy.unique(parents[nested], return_index=True)
+        stops = numpy.append(starts[1:], len(nested))
+
+        for owner, start, stop in zip(owners.tolist(), starts.tolist(), stops.tolist()):
+            positions = nested[start:stop]
+            ids[positions] = self.insert_children(int(ids[owner]), 0, values[positions])
+
+        # Суммы "Узлов" снизу вверх, по одному проходу на уровень
+        sums = values.copy()
+        for level in range(int(flat.levels.max(initial=0)), 0, -1):
+            positions = numpy.flatnonzero(flat.levels == level)
+            numpy.add.at(sums, parents[positions], sums[positions])
+
+        nodes = numpy.flatnonzero(flat.nodes)
+        self.sum[ids[nodes]] = sums[nodes]
+        numpy.add.at(self.level_sum, self.depth[ids[nodes]], sums[nodes])
+
+        return ids
+
+
+    def remove_rows(self, node: int, rows: numpy.ndarray) -> numpy.ndarray:
+        '''
+        Удалить потомков элемента с указанных (возрастающих) строк вместе с их поддеревьями, за один проход по блоку.
+        Возвращает идентификаторы всех удаленных элементов. Суммы предков не пересчитываются.
+        '''
+
+        start = self.child_start[node]
+        size = self.child_count[node]
+        block = self.children[start:start + size]
+
+        keep = numpy.ones(size, dtype=numpy.bool_)
+        keep[rows] = False
+        first = int(rows[0])
+
+        removed = self.subtree(block[rows])
+
+        # Сдвиг оставшихся потомков на место удаленных, начиная с первой удаленной строки
+        remaining = block[first:][keep[first:]]
+        block[first:first + len(remaining)] = remaining
+        self.child_count[node] = first + len(remaining)
+        self.row[remaining] = numpy.arange(first, first + len(remaining))
+
+        self.mark_nodes(remaining)
+        self.mark_nodes(node)
+        self.mark_children(start + first, start + size)
+
+        # Удаленные элементы больше не учитываются в накопителях уровней
+        depths = self.depth[removed]
+        numpy.subtract.at(self.level_count, depths, 1)
+        numpy.subtract.at(self.level_sum, depths, self.sum[removed])
+
+        self._release(removed)
+
+        return removed
+
+
+    def update_sum(self, node: int) -> int:
+        '''Пересчитать сумму элемента по суммам его потомков'''
+
+        if self.child_count[node] > 0:
+            total = self.sum[self.children_of(node)].sum()
+        else:
+            total = self.value[node]
+
+        # Учет изменения суммы в накопителе уровня элемента
+        if node != 0:
+            self.level_sum[self.depth[node]] += total - self.sum[node]
+
+        self.sum[node] = total
+        self.mark_nodes(node)
+
+        return int(total)
+
+
+    def set_value(self, node: int, value: int):
+        '''Установить значение элемента. Суммы не пересчитываются'''
+
+        self.value[node] = value
+        self.mark_nodes(node)
+
+
+    def propagate_many(self, deltas: dict[int, int]) -> dict[int, int]:
+        '''
+        Прибавить изменения deltas ({элемент: изменение}) к суммам элементов и их предков.
+        Изменения поднимаются от нижних уровней к верхним и объединяются, поэтому каждый
+        затронутый элемент обновляется один раз. Возвращает примененные изменения
+        затронутых элементов без учета корня.
+        '''
+
+        pending = {node: delta for node, delta in deltas.items() if delta != 0}
+
+        # Изменение суммы корня применяется отдельно, у корня нет уровня
+        root_delta = pending.pop(0, 0)
+
+        by_depth: dict[int, list[int]] = {}
+        for node in pending:
+            by_depth.setdefault(int(self.depth[node]), []).append(node)
+
+        touched: dict[int, int] = {}
+
+        for depth in range(max(by_depth, default=-1), -1, -1):
+            for node in by_depth.get(depth, ()):
+                delta = pending[node]
+                if delta == 0:
+                    continue
+
+                self.sum[node] += delta
+                self.level_sum[depth] += delta
+                touched[node] = delta
+
+                # Передача изменения родителю, объединяя с уже накопленным
+                parent = int(self.parent[node])
+                if parent == 0:
+                    root_delta += delta
+                elif parent in pending:
+                    pending[parent] += delta
+                else:
+                    pending[parent] = delta
+                    by_depth.setdefault(depth - 1, []).append(parent)
+
+        self.sum[0] += root_delta
+
+        if touched or root_delta:
+            self.mark_nodes(list(touched) + [0])
+
+        return touched
+
+
+    def _add_level_stats(self, level: int, count: int, total: int):
+        '''Учесть в накопителях уровня level count новых элементов с суммой значений total'''
+
+        if level >= len(self.level_count):
+            self.level_count = numpy.concatenate((self.level_count, numpy.zeros(level + 1 - len(self.level_count), dtype=numpy.int64)))
+            self.level_sum = numpy.concatenate((self.level_sum, numpy.zeros(level + 1 - len(self.level_sum), dtype=numpy.int64)))
+
+        self.level_count[level] += count
+        self.level_sum[level] += total
+
+
+    def level_averages(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+        '''Получить уровни вложенности, на которых есть элементы, и средние значения элементов этих уровней'''
+
+        levels = numpy.flatnonzero(self.level_count)
+        return levels, self.level_sum[levels] / self.level_count[levels]
+
+
+    def load_flat(self, flat: FlatTree):
+        '''Заполнить хранилище данными дерева в плоском виде'''
+
+        count = len(flat.levels)
+        self.clear(count + 1)
+
+        # Идентификаторы элементов совпадают с их позицией в прямом обходе, смещенной на 1
+        ids = numpy.arange(1, count + 1, dtype=numpy.int64)
+        parents = flat_parents(flat.levels) + 1
+
+        self.size = count + 1
+        self.parent[1:count + 1] = parents
+        self.depth[1:count + 1] = flat.levels
+        self.value[1:count + 1] = numpy.where(flat.nodes, 0, flat.values)
+
+        # Элементы, сгруппированные по уровням; внутри уровня - в порядке обхода, а значит и по родителям
+        order = sort_by_level(flat.levels)
+        by_depth = ids[order]
+        bounds = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(flat.levels))))
+
+        # Блоки потомков идут в порядке родителей: корень (его потомки - первый уровень), затем элементы по уровням
+        child_count = numpy.bincount(parents, minlength=count + 1)
+        owners = numpy.concatenate(([0], by_depth))
+        self.child_count[:count + 1] = child_count
+        self.child_capacity[:count + 1] = child_count
+        self.child_start[owners] = numpy.cumsum(child_count[owners]) - child_count[owners]
+
+        self.children = numpy.zeros(max(count * 2, 1024), dtype=numpy.int64)
+        self.children[:count] = by_depth
+        self.children_size = count
+        self.row[by_depth] = numpy.arange(count) - self.child_start[parents[order]]
+
+        # Расчет сумм снизу вверх, по одному проходу на уровень
+        self.sum[:count + 1] = self.value[:count + 1]
+        self.level_count = numpy.diff(bounds)
+        self.level_sum = numpy.zeros(len(self.level_count), dtype=numpy.int64)
+
+        for level in range(len(self.level_count) - 1, -1, -1):
+            level_ids = by_depth[bounds[level]:bounds[level + 1]]
+            parent_ids = by_depth[bounds[level - 1]:bounds[level]] if level > 0 else owners[:1]
+
+            self.sum[parent_ids] += segment_sums(self.sum[level_ids], self.child_count[parent_ids])
+            self.level_sum[level] = self.sum[level_ids].sum()
+
+
+    def load_stores(self, parts: list['TreeStore']):
+        '''
+        Заполнить хранилище, объединив компактные хранилища частей дерева (как после load_flat):
+        элементы первого уровня частей по порядку частей становятся элементами первого уровня дерева.
+        Результат совпадает с load_flat для объединенных плоских данных частей, но суммы и накопители
+        уровней не пересчитываются, а массивы частей только сдвигаются на смещения частей.
+        '''
+
+        sizes = [part.size - 1 for part in parts]
+        count = sum(sizes)
+        self.clear(count + 1)
+
+        # Количество элементов частей по уровням, с нулями до общей глубины и еще одного уровня
+        depth = max((len(part.level_count) for part in parts), default=0)
+        counts = numpy.zeros((len(parts), depth + 1), dtype=numpy.int64)
+        sums = numpy.zeros((len(parts), depth + 1), dtype=numpy.int64)
+
+        for n, part in enumerate(parts):
+            counts[n, :len(part.level_count)] = part.level_count
+            sums[n, :len(part.level_sum)] = part.level_sum
+
+        # Массив children - отрезки уровней (потомки корня - первый уровень), в отрезке уровня
+        # элементы частей идут по порядку частей: начала отрезков уровней и смещения частей в них
+        level_start = numpy.concatenate(([0], numpy.cumsum(counts.sum(axis=0))))
+        part_start = numpy.cumsum(counts, axis=0) - counts
+
+        self.children = numpy.zeros(max(count * 2, 1024), dtype=numpy.int64)
+        offset = 0
+
+        for n, (part, size) in enumerate(zip(parts, sizes)):
+            ids = slice(offset + 1, offset + size + 1)
+            local = slice(1, size + 1)
+            part_bounds = numpy.concatenate(([0], numpy.cumsum(counts[n])))
+
+            # Идентификаторы частей сдвигаются на количество элементов предыдущих частей,
+            # строки первого уровня - на количество элементов первого уровня предыдущих частей
+            depths = part.depth[local]
+            parents = part.parent[local]
+            self.parent[ids] = numpy.where(parents == 0, 0, parents + offset)
+            self.row[ids] = part.row[local] + numpy.where(depths == 0, part_start[n, 0], 0)
+            self.depth[ids] = depths
+            self.value[ids] = part.value[local]
+            self.sum[ids] = part.sum[local]
+            self.child_count[ids] = part.child_count[local]
+            self.child_capacity[ids] = part.child_count[local]
+
+            # Блок потомков элемента уровня L лежит в отрезке уровня L + 1
+            levels = depths + 1
+            self.child_start[ids] = part.child_start[local] - part_bounds[levels] + level_start[levels] + part_start[n, levels]
+
+            for level in range(len(part.level_count)):
+                start = level_start[level] + part_start[n, level]
+                self.children[start:start + counts[n, level]] = part.children[part_bounds[level]:part_bounds[level + 1]] + offset
+
+            offset += size
+
+        self.size = count + 1
+        self.children_size = count
+        self.child_count[0] = self.child_capacity[0] = level_start[1]
+
+        self.level_count = counts.sum(axis=0)[:depth]
+        self.level_sum = sums.sum(axis=0)[:depth]
+        self.sum[0] = self.level_sum[0] if depth else 0
+
+
+    def to_arrays(self) -> dict[str, numpy.ndarray]:
+        '''
+        Получить массивы хранилища для сохранения (без копирования).
+        Хранилище должно быть компактным: без освободившихся идентификаторов и неиспользуемых ячеек блоков,
+        как после load_flat.
+        '''
+
+        if self.free_count or self.children_garbage:
+            raise ValueError('Хранилище содержит удаленные элементы, сохраняется только компактное хранилище')
+
+        arrays = {name: getattr(self, name)[:self.size] for name in self.NODE_ARRAYS[:-1]}
+        arrays['children'] = self.children[:self.children_size]
+        arrays['level_sum'] = self.level_sum
+        arrays['level_count'] = self.level_count
+
+        return arrays
+
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, numpy.ndarray]) -> 'TreeStore':
+        '''
+        Создать хранилище поверх готовых массивов компактного хранилища без копирования и пересчета,
+        например, поверх массивов, отображенных в память из файла.
+        '''
+
+        store = cls(capacity=1)
+
+        for name in cls.SAVED_ARRAYS:
+            setattr(store, name, arrays[name])
+
+        store.size = len(store.parent)
+        store.children_size = len(store.children)
+
+        # Ни один элемент еще не передан представлению
+        store.fetched = numpy.zeros(store.size, dtype=numpy.int64)
+
+        return store
+
+
+    def detach(self, path: str | None = None):
+        '''
+        Скопировать в память процесса массивы, отображенные из файла, и освободить отображение.
+        path - только если отображен этот файл: отображенный файл нельзя заменить (Windows).
+        '''
+
+        if self.mapped_path is None:
+            return
+
+        if path is not None and not (os.path.exists(path) and os.path.samefile(path, self.mapped_path)):
+            return
+
+        # Массивы, перевыделенные при изменениях, уже принадлежат процессу
+        for name in self.SAVED_ARRAYS:
+            array = getattr(self, name)
+            if array.base is not None:
+                setattr(self, name, array.copy())
+
+        self.mapped_path = None
+
+
+    def load_nested(self, data: list):
+        '''Заполнить хранилище данными в виде вложенных списков'''
+
+        self.load_flat(nested_to_flat(data))
+
+
+    def to_flat(self, nodes: numpy.ndarray | None = None) -> FlatTree:
+        '''
+        Получить данные дерева в плоском виде.
+        nodes - потомки одного элемента: получить только их поддеревья, уровень 0 - сами элементы nodes.
+        '''
+
+        # Только "Лепестки" (частый случай при удалении) - без обхода по уровням
+        if nodes is not None and not self.child_count[nodes].any():
+            return FlatTree(numpy.zeros(len(nodes), dtype=numpy.int32), self.value[nodes], numpy.zeros(len(nodes), dtype=numpy.bool_))
+
+        levels = self.level_order(nodes)
+
+        if len(levels) == 0:
+            return empty_flat_tree()
+
+        # Позиции элементов в прямом обходе
+        positions = preorder_positions([self.child_count[nodes] for nodes in levels])
+
+        order = numpy.empty(sum(len(nodes) for nodes in levels), dtype=numpy.int64)
+        for nodes, position in zip(levels, positions):
+            order[position] = nodes
+
+        is_node = self.child_count[order] > 0
+
+        return FlatTree(
+            self.depth[order] - self.depth[order[0]],
+            numpy.where(is_node, 0, self.value[order]),
+            is_node,
+        )
+
+
+    def to_nested(self) -> list:
+        '''Получить данные дерева в виде вложенных списков'''
+
+        return flat_to_nested(self.to_flat())
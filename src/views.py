@@ -1,14 +1,14 @@
-import json
-
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QWidget
-import h5py
-import numpy
-import pyqtgraph
 
 from src.ui.main_widget_ui import Ui_mainWidget
-from src.models import TreeViewModel
-from src.tools import gen_random_tree, hdf5_read_recursive, hdf5_write_recursive
+from src.diff import TreeDiff
+from src.instrumentation import PROFILER, instrumented
+from src.journal import Autosave, Edit, encode_edit
+from src.models import DiffTreeModel, TreeViewModel
+from src.search import parse_query
+from src.tree_store import TreeStore
+from src.workers import CompareTask, GenerateTask, LoadTask, SaveTask, StoreSaveTask, Task
 
 
 class CustomDelegate(QtWidgets.QItemDelegate):
@@ -24,89 +24,131 @@ class CustomDelegate(QtWidgets.QItemDelegate):
         editor.setValidator(QtGui.QIntValidator())
         return editor
 
+    @instrumented('delegate.setModelData')
     def setModelData(self, editor: QWidget, model: TreeViewModel, index: QtCore.QModelIndex) -> None:
         '''Метод завершает редактирование элемента и записывает данные в модель'''
+        # Модель сама обновляет суммы предков элемента и выдает сигнал dataUpdated
         super().setModelData(editor, model, index)
-        model.update_item_parents_data(model.itemFromIndex(index))
-        model.dataUpdated.emit()
 
 
 class MainView(Ui_mainWidget, QtWidgets.QWidget):
 
+    # График построен (после первой отрисовки окна)
+    graphReady = QtCore.pyqtSignal()
+
     def __init__(self, tree_view_model: TreeViewModel):
         super().__init__()
 
         # Построение UI элемента
         self.setupUi(self)
-        self.graph_widget = pyqtgraph.PlotWidget()
-        self.graph_plot = self.graph_widget.plot([], [])
-        self.graphLayout.addWidget(self.graph_widget)
+
+        # График строится после первой отрисовки окна, тогда же импортируется pyqtgraph
+        self.graph_widget = None
+        self.graph_plot = None
+        self.graph_pending = False
+
+        # Параметры рандомного заполнения: количество элементов и seed (0 - случайный)
+        self.randomSizeSpinBox = QtWidgets.QSpinBox(self)
+        self.randomSizeSpinBox.setRange(1, 100_000_000)
+        self.randomSizeSpinBox.setValue(100)
+        self.randomSizeSpinBox.setPrefix('Элементов: ')
+        self.sidebarLayout.insertWidget(3, self.randomSizeSpinBox)
+
+        self.randomSeedSpinBox = QtWidgets.QSpinBox(self)
+        self.randomSeedSpinBox.setRange(0, 2_000_000_000)
+        self.randomSeedSpinBox.setPrefix('Seed: ')
+        self.randomSeedSpinBox.setSpecialValueText('Seed: случайный')
+        self.sidebarLayout.insertWidget(4, self.randomSeedSpinBox)
+
+        # Сохранение JSON без отступов: файл меньше и записывается быстрее
+        self.compactJsonCheckBox = QtWidgets.QCheckBox('Компактный JSON', self)
+        self.sidebarLayout.insertWidget(5, self.compactJsonCheckBox)
+
+        # Индикатор хода и кнопка отмены фоновой задачи
+        self.taskProgressBar = QtWidgets.QProgressBar(self)
+        self.taskProgressBar.setRange(0, 100)
+        self.taskProgressBar.hide()
+        self.sidebarLayout.insertWidget(6, self.taskProgressBar)
+
+        self.cancelTaskButton = QtWidgets.QPushButton('Отменить', self)
+        self.cancelTaskButton.hide()
+        self.sidebarLayout.insertWidget(7, self.cancelTaskButton)
+
+        # Сравнение двух файлов деревьев, после кнопки сохранения
+        self.compareButton = QtWidgets.QPushButton('Сравнить файлы', self)
+        self.sidebarLayout.insertWidget(2, self.compareButton)
+
+        # Текущая фоновая задача
+        self.task: Task | None = None
+
+        # Модель различий в режиме сравнения (None - TreeView показывает данные модели)
+        self.diff_model: DiffTreeModel | None = None
+
+        # Строка поиска над TreeView: запрос, тип элементов, переход между найденными элементами
+        self.searchLayout = QtWidgets.QHBoxLayout()
+        self.searchEdit = QtWidgets.QLineEdit(self)
+        self.searchEdit.setPlaceholderText('Поиск: 42, 10..20, >5, <=-3, top 10, bottom 10')
+        self.searchKindComboBox = QtWidgets.QComboBox(self)
+        self.searchKindComboBox.addItem('Все', 'all')
+        self.searchKindComboBox.addItem('Лепестки', 'leaves')
+        self.searchKindComboBox.addItem('Узлы', 'nodes')
+        self.searchPrevButton = QtWidgets.QPushButton('<', self)
+        self.searchNextButton = QtWidgets.QPushButton('>', self)
+        self.searchResultLabel = QtWidgets.QLabel(self)
+
+        for widget in (self.searchEdit, self.searchKindComboBox, self.searchPrevButton, self.searchNextButton, self.searchResultLabel):
+            self.searchLayout.addWidget(widget)
+        self.contentLayout.insertLayout(0, self.searchLayout)
+
+        # Найденные элементы, номер текущего из них и признак устаревших после изменения модели результатов
+        self.search_matches = []
+        self.search_position = -1
+        self.search_stale = False
+
+        # Панель замеров операций, только при включенных замерах
+        if PROFILER.enabled:
+            self.setup_profiler_panel()
 
         # Подключение модели данных к TreeView
         self.model = tree_view_model
         self.treeView.setModel(self.model)
 
+        # Все строки одной высоты: представлению не нужно измерять каждую строку (важно при переходе
+        # к найденному элементу, когда представлению разом передаются тысячи строк)
+        self.treeView.setUniformRowHeights(True)
+
         # Установка делегата для элементов TreeView
         self.treeView.setItemDelegate(CustomDelegate())
         self.addTreeItemEdit.setValidator(QtGui.QIntValidator())
 
-        # Подключения методов к сигналам
-        self.model.dataUpdated.connect(self.update_bg_color_second_lvl_elements)
-
         # Content Layout
-        self.treeView.doubleClicked.connect(self.handle_double_click_on_tree_item)
         self.addTreeItemButton.clicked.connect(self.add_tree_item)
         self.deleteTreeItemButton.clicked.connect(self.delete_tree_item)
 
+        # Search Layout
+        self.searchEdit.textChanged.connect(self.search)
+        self.searchEdit.returnPressed.connect(self.search_next)
+        self.searchKindComboBox.currentIndexChanged.connect(self.search)
+        self.searchPrevButton.clicked.connect(self.search_previous)
+        self.searchNextButton.clicked.connect(self.search_next)
+        self.model.dataUpdated.connect(self.mark_search_stale)
+
         # Sidebar Layout
         self.loadDataButton.clicked.connect(self.load_data)
         self.saveDataButton.clicked.connect(self.save_data)
         self.randomizeDataButton.clicked.connect(self.load_randomize_data)
+        self.cancelTaskButton.clicked.connect(self.cancel_task)
+        self.compareButton.clicked.connect(self.compare_files)
 
         # Graph Layout
         self.model.dataUpdated.connect(self.update_graph)
 
-    
-    def handle_double_click_on_tree_item(self, index: QtCore.QModelIndex):
-        '''
-        Обработчик двойного клика по элементу TreeView, проверяет и указывает
-        можно ли редактировать элемент.
-        Если у элемента есть потомки, то редактирование запрещено, т. к. элемент
-        является узлом.        
-        '''
-
-        if index.model().rowCount(index) > 0:
-            self.model.itemFromIndex(index).setEditable(False)
-        else:
-            self.model.itemFromIndex(index).setEditable(True)
+        # Отмена и повтор изменений дерева
+        self.undoShortcut = QtWidgets.QShortcut(QtGui.QKeySequence.Undo, self, self.model.undo)
+        self.redoShortcut = QtWidgets.QShortcut(QtGui.QKeySequence.Redo, self, self.model.redo)
 
 
     # TREEVIEW
-    def update_bg_color_second_lvl_elements(self):
-        '''Обновить цвета фона элементов второго уровня'''
-
-        # Цикл прохода по элементам первого уровня
-        for i in range(self.model.rowCount()):
-            lvl_1_element = self.model.item(i)
-
-            # Цикл прохода по элементам второго уровня
-            for ii in range(lvl_1_element.rowCount()):
-                lvl_2_element = lvl_1_element.child(ii)
-
-                # Если элемент второго уровня - Узел
-                if lvl_2_element.rowCount() > 0:
-
-                    if int(lvl_2_element.text()) >= 0:
-                        # Установить зеленый цвет фона элемента
-                        lvl_2_element.setBackground(QtGui.QColor('#9CCC65'))
-                    else:
-                        # Установить красный цвет фона элемента
-                        lvl_2_element.setBackground(QtGui.QColor('#EF5350'))
-
-                else:
-                    lvl_2_element.setBackground(QtGui.QBrush())
-
-
     def add_tree_item(self):
         '''Добавить элемент в TreeView'''
 
@@ -129,32 +171,89 @@ class MainView(Ui_mainWidget, QtWidgets.QWidget):
     def delete_tree_item(self):
         '''Удалить выделенные элементы из TreeView'''
 
-        # Получение индексов выделенных элементов
-        indexes = self.treeView.selectedIndexes()
+        # Удаление выделенных элементов одним пакетом, с учетом вложенности выделенных элементов
+        self.model.delete_items(self.treeView.selectedIndexes())
+
+
+    # SEARCH
+    def run_search_query(self) -> bool:
+        '''Выполнить запрос поиска по индексу модели, False - запрос пуст или некорректен'''
+
+        text = self.searchEdit.text()
+        self.search_stale = False
+
+        if not text.strip():
+            self.search_matches = []
+            return False
+
+        try:
+            query = parse_query(text)
+        except ValueError:
+            self.search_matches = []
+            return False
+
+        self.search_matches = query(self.model.search_index, self.searchKindComboBox.currentData())
+        return True
+
+
+    def search(self):
+        '''Найти элементы по введенному запросу и перейти к первому из них'''
+
+        self.search_position = -1
+
+        if not self.run_search_query():
+            self.searchResultLabel.setText('' if not self.searchEdit.text().strip() else 'Некорректный запрос')
+            return
+
+        self.step_search(1)
+
 
-        # Сортировка индексов от большего к меньшему, чтобы избежать проблемы смещения индексов при удалении
-        indexes = sorted(indexes, key=lambda i: i.row(), reverse=True)
+    def search_next(self):
+        '''Перейти к следующему найденному элементу'''
 
-        def get_index_level(index: QtCore.QModelIndex):
-            '''Получения числа основанного на номерах строк индексов родителей'''
+        self.step_search(1)
 
-            levels = []
 
-            parent = index.parent()
-            
-            if parent.row() != -1:
-                levels += get_index_level(parent)
-                levels.append(str(index.row()))
+    def search_previous(self):
+        '''Перейти к предыдущему найденному элементу'''
 
-            if len(levels) != 0: return levels
-            else: return [str(index.row())]
+        self.step_search(-1)
 
-        indexes_with_level = [(index, int(''.join(get_index_level(index)))) for index in indexes]
-        indexes = [element[0] for element in sorted(indexes_with_level, key=lambda i: i[1], reverse=True)]
 
-        # Последовательное удаление элементов
-        for index in indexes:
-            self.model.delete_item(index)
+    def mark_search_stale(self):
+        '''После изменения данных результаты поиска пересчитываются при следующем переходе'''
+
+        self.search_stale = True
+
+
+    def step_search(self, step: int):
+        '''Перейти на step найденных элементов вперед или назад, по кругу'''
+
+        if self.search_stale:
+            self.run_search_query()
+
+        if len(self.search_matches) == 0:
+            self.searchResultLabel.setText('Не найдено' if self.searchEdit.text().strip() else '')
+            return
+
+        self.search_position = (self.search_position + step) % len(self.search_matches)
+        self.searchResultLabel.setText(f'{self.search_position + 1} / {len(self.search_matches)}')
+
+        self.show_node(int(self.search_matches[self.search_position]))
+
+
+    def show_node(self, node: int):
+        '''Раскрыть предков элемента в TreeView, выделить элемент и прокрутить к нему'''
+
+        index = self.model.reveal(node)
+
+        parent = index.parent()
+        while parent.isValid():
+            self.treeView.expand(parent)
+            parent = parent.parent()
+
+        self.treeView.setCurrentIndex(index)
+        self.treeView.scrollTo(index)
 
 
     # SIDEBAR
@@ -162,90 +261,293 @@ class MainView(Ui_mainWidget, QtWidgets.QWidget):
         '''Загрузить данные в TreeView'''
         
         # Вызов диалогового окна для получения пути к файлу и требуемые тип файла из которого будут загружаться данные
-        file_path, file_path_filters = QtWidgets.QFileDialog().getOpenFileName(self, 'Открыть файл', '.', '*.json;;*.hdf5')
+        file_path, file_path_filters = QtWidgets.QFileDialog().getOpenFileName(self, 'Открыть файл', '.', '*.json;;*.hdf5;;*.tree')
         if file_path == '': return
 
-        if file_path_filters == '*.json':
-            file_data = json.load(open(file_path, encoding='utf-8'))
-        else:
-            with h5py.File(file_path) as file:
-                file_data = hdf5_read_recursive(file)
+        # Чтение и разбор файла в фоновом потоке, в GUI потоке - только замена хранилища модели
+        task = LoadTask(file_path, file_path_filters)
+        self.start_task(task, lambda store: self.finish_load(task, store))
+
+
+    def finish_load(self, task: LoadTask, store: TreeStore):
+        '''Заменить данные модели прочитанными и предложить восстановить несохраненные изменения файла'''
+
+        # Журнал автосохранения, оставшийся после сбоя или закрытия без сохранения
+        edits = Autosave.recover(task.file_path)
+
+        self.model.set_store(store, task.synced_file)
+
+        # Журнал файла заменяется новым только после ответа пользователя и успешного восстановления
+        records = []
+
+        if edits:
+            box = QtWidgets.QMessageBox(
+                QtWidgets.QMessageBox.Question, 'Восстановление',
+                f'Найдены несохраненные изменения файла ({len(edits)}). Восстановить их?', parent=self,
+            )
+            restore = box.addButton('Восстановить', QtWidgets.QMessageBox.AcceptRole)
+            discard = box.addButton('Удалить', QtWidgets.QMessageBox.DestructiveRole)
+            box.setDefaultButton(restore)
+
+            # Без кнопки отказа окно закрывается только выбором: отложенный журнал оставил бы
+            # изменения этого сеанса без автосохранения
+            box.exec_()
+
+            if box.clickedButton() != discard:
+                if not self.recover_edits(task, edits):
+                    return
+
+                # Восстановленные изменения остаются в журнале, пока файл не будет сохранен
+                records = [encode_edit(edit) for edit in edits]
+
+        self.model.journal.autosave.start(task.file_path, records)
+
+
+    def recover_edits(self, task: LoadTask, edits: list[Edit]) -> bool:
+        '''
+        Повторить изменения из журнала автосохранения. При ошибке частично восстановленные изменения
+        отбрасываются: журнал откладывается под другим именем, файл читается заново с новым журналом.
+        '''
+
+        try:
+            self.model.recover(edits)
+        except Exception as error:
+            try:
+                kept = f'Журнал изменений сохранен в файле {Autosave.set_aside(task.file_path)}'
+            except OSError as move_error:
+                kept = f'Журнал изменений не удалось отложить: {move_error}'
+
+            QtWidgets.QMessageBox.warning(self, 'Ошибка', f'Не удалось восстановить изменения: {error}\n{kept}')
+
+            reload = LoadTask(task.file_path, task.file_type)
+            self.start_task(reload, lambda store: self.finish_load(reload, store))
+
+            return False
 
-        self.model.load_data(file_data)
+        return True
 
 
     def save_data(self):
         '''Сохранить данные из TreeView'''
 
+        # Снимок данных и отметка журнала делаются только для записи, которая точно будет запущена:
+        # start_task не запускает задачу, пока выполняется другая
+        if self.task is not None:
+            return
+
         # Вызов диалогового окна для получения пути к файлу и требуемые тип файла в котором нужно сохранить данные
-        file_path, file_path_filters = QtWidgets.QFileDialog().getSaveFileName(self, 'Сохранить файл', '.', '*.json;;*.hdf5')
+        file_path, file_path_filters = QtWidgets.QFileDialog().getSaveFileName(self, 'Сохранить файл', '.', '*.json;;*.hdf5;;*.tree')
         if file_path == '': return
 
-        data = self.model.get_data()
+        # Файл дерева, отображенный в память хранилища, освобождается до замены файла записью
+        self.model.store.detach(file_path)
+
+        # Снимок данных делается сразу, запись файла выполняется в фоновом потоке
+        if file_path_filters == '*.hdf5':
 
-        if file_path_filters == '*.json':
-            with open(file_path, 'w', encoding='utf-8') as file:
-                json.dump(data, file, indent='    ')
+            # Повторная запись в тот же файл hdf5 переписывает только изменившиеся части
+            task = StoreSaveTask(file_path, *self.model.store_patch(file_path))
+            on_finished = lambda synced_file: self.model.end_save(file_path, synced_file)
         else:
-            with h5py.File(file_path, 'w') as file:
-                hdf5_write_recursive(file, data)
+            task = SaveTask(file_path, file_path_filters, self.model.get_flat(), self.compactJsonCheckBox.isChecked())
+            on_finished = self.model.end_save
+
+        # Изменения, сделанные во время записи, перейдут в журнал автосохранения записанного файла
+        self.model.begin_save()
+        task.signals.failed.connect(self.model.cancel_save)
+        task.signals.cancelled.connect(self.model.cancel_save)
+        self.start_task(task, on_finished)
+
+
+    def start_task(self, task: Task, on_finished=None):
+        '''Запустить фоновую задачу'''
+
+        # Одновременно выполняется только одна задача
+        if self.task is not None:
+            return
+
+        self.task = task
+
+        task.signals.progress.connect(self.taskProgressBar.setValue)
+        task.signals.finished.connect(self.finish_task)
+        task.signals.failed.connect(self.finish_task)
+        task.signals.cancelled.connect(self.finish_task)
+        task.signals.failed.connect(lambda error: QtWidgets.QMessageBox.warning(self, 'Ошибка', error))
+
+        if on_finished:
+            task.signals.finished.connect(on_finished)
+
+        self.set_task_running(True)
+        QtCore.QThreadPool.globalInstance().start(task)
+
+
+    def finish_task(self):
+        '''Завершение фоновой задачи, в том числе с ошибкой или отмененной'''
+
+        self.task = None
+        self.set_task_running(False)
+
+
+    def cancel_task(self):
+        '''Отменить текущую фоновую задачу'''
+
+        if self.task is not None:
+            self.task.cancel()
+
+
+    def set_task_running(self, running: bool):
+        '''Переключить элементы GUI на время выполнения фоновой задачи'''
+
+        self.taskProgressBar.setValue(0)
+        self.taskProgressBar.setVisible(running)
+        self.cancelTaskButton.setVisible(running)
+
+        self.compareButton.setEnabled(not running)
+        self.update_actions()
+
+
+    def update_actions(self):
+        '''Доступность действий: во время фоновой задачи и в режиме сравнения данные модели не изменяются'''
+
+        running = self.task is not None
+        comparing = self.diff_model is not None
+
+        for widget in (self.loadDataButton, self.saveDataButton, self.randomizeDataButton, self.randomSizeSpinBox, self.randomSeedSpinBox):
+            widget.setEnabled(not running and not comparing)
+
+        for widget in (self.addTreeItemEdit, self.addTreeItemButton, self.deleteTreeItemButton,
+                       self.searchEdit, self.searchKindComboBox, self.searchPrevButton, self.searchNextButton):
+            widget.setEnabled(not comparing)
+
+        self.undoShortcut.setEnabled(not comparing)
+        self.redoShortcut.setEnabled(not comparing)
+
+
+    def closeEvent(self, event: QtGui.QCloseEvent):
+
+        # Отмена и ожидание фоновой задачи перед закрытием окна
+        self.cancel_task()
+        QtCore.QThreadPool.globalInstance().waitForDone()
+
+        # Несохраненные изменения остаются в журнале автосохранения до следующего открытия файла
+        self.model.journal.autosave.close()
+
+        if PROFILER.enabled:
+            PROFILER.dump()
+
+        super().closeEvent(event)
 
 
     def load_randomize_data(self):
         '''Заполнить TreeView рандомными данными'''
 
-        data = gen_random_tree(3, 10, -33, 33, 4)
-        self.model.load_data(data)
+        seed = self.randomSeedSpinBox.value() or None
 
+        # Генерация и построение хранилища в фоновом потоке
+        self.start_task(GenerateTask(self.randomSizeSpinBox.value(), seed), self.model.set_store)
 
-    # GRAPH
-    def update_graph(self):
-        '''Обновить график'''
-        
-        def prepare_arr_for_graph(data: list, level: int = 0):
-            '''
-            Извлечь данные, из указанного иерархического списка,
-            в виде массива: level - уровень вложенности в дереве, value- значение
-            '''
 
-            arr: list[tuple[int | int]] = []
+    # COMPARE
+    def compare_files(self):
+        '''Сравнить два файла деревьев или, в режиме сравнения, вернуться к данным модели'''
+
+        if self.diff_model is not None:
+            self.set_diff(None)
+            return
+
+        files = []
+        for title in ('Первый файл', 'Второй файл'):
+            file_path, file_path_filters = QtWidgets.QFileDialog().getOpenFileName(self, f'Сравнить: {title.lower()}', '.', '*.json;;*.hdf5;;*.tree')
+            if file_path == '': return
+            files.append((file_path, file_path_filters))
+
+        # Чтение файлов и расчет различий в фоновом потоке
+        self.start_task(CompareTask(files), self.set_diff)
+
 
-            for data_item in data:
+    def set_diff(self, diff: TreeDiff | None):
+        '''Показать в TreeView различия деревьев (None - вернуться к данным модели)'''
 
-                if isinstance(data_item, list):
-                    # Рекурсивное извлечение данных из "Узла"
-                    values = prepare_arr_for_graph(data_item, level + 1)
+        self.diff_model = DiffTreeModel(diff) if diff is not None else None
+        self.treeView.setModel(self.diff_model or self.model)
 
-                    # Добавление суммы "Узла" из полученных значений
-                    arr.append((level, sum([value[1] for value in values if value[0] == level + 1])))
+        self.compareButton.setText('Закрыть сравнение' if self.diff_model is not None else 'Сравнить файлы')
+        self.update_actions()
 
-                    arr += values
-                else:
-                    arr.append((level, data_item))
 
-            return arr
+    # PROFILER
+    def setup_profiler_panel(self):
+        '''Добавить в Sidebar сводку замеров операций и кнопки сохранения и сброса замеров'''
 
-        # Получение данных из модели TreeView
-        data = self.model.get_data()
+        self.profilerLabel = QtWidgets.QLabel(self)
+        self.profilerLabel.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.profilerLabel.setToolTip('Операция: вызовы / всего, мс / наибольшее, мс')
+        self.sidebarLayout.insertWidget(9, self.profilerLabel)
 
-        # Очистка данных графика
-        self.graph_widget.plotItem.clear()
+        self.dumpProfileButton = QtWidgets.QPushButton('Сохранить замеры', self)
+        self.dumpProfileButton.clicked.connect(self.dump_profile)
+        self.sidebarLayout.insertWidget(10, self.dumpProfileButton)
 
-        # Если есть данные на основе которых можно построить график
-        if len(data) > 0:
+        self.resetProfileButton = QtWidgets.QPushButton('Сбросить замеры', self)
+        self.resetProfileButton.clicked.connect(PROFILER.reset)
+        self.sidebarLayout.insertWidget(11, self.resetProfileButton)
 
-            # Преобразование данных в двумерный массив
-            data_for_graph = prepare_arr_for_graph(data)
-            data_array = numpy.array(data_for_graph)
+        # Сводка обновляется по таймеру, а не при каждой операции
+        self.profilerTimer = QtCore.QTimer(self)
+        self.profilerTimer.timeout.connect(self.update_profiler_panel)
+        self.profilerTimer.start(500)
 
-            # Извлечение уникальных уровней
-            levels = numpy.unique(data_array[:, 0])
 
-            # Вычисление сумм лепестков для каждого уровня
-            level_sums = [numpy.average(data_array[data_array[:, 0] == level, 1]) for level in levels]
+    def update_profiler_panel(self):
+        '''Обновить сводку замеров операций'''
+
+        self.profilerLabel.setText(PROFILER.summary())
+
+
+    def dump_profile(self):
+        '''Сохранить замеры операций в каталог профилей'''
+
+        path = PROFILER.dump()
+        QtWidgets.QToolTip.showText(self.dumpProfileButton.mapToGlobal(self.dumpProfileButton.rect().bottomLeft()), f'Замеры сохранены: {path}', self.dumpProfileButton)
+
+
+    # GRAPH
+    def paintEvent(self, event: QtGui.QPaintEvent):
+
+        super().paintEvent(event)
+
+        # Построение графика откладывается до первой отрисовки окна, чтобы окно появилось быстрее
+        if self.graph_widget is None and not self.graph_pending:
+            self.graph_pending = True
+            QtCore.QTimer.singleShot(0, self.setup_graph)
+
+
+    def setup_graph(self):
+        '''Создать виджет графика'''
+
+        if self.graph_widget is not None:
+            return
+
+        import pyqtgraph
+
+        self.graph_widget = pyqtgraph.PlotWidget()
+        self.graph_plot = self.graph_widget.plot([], [])
+        self.graphLayout.addWidget(self.graph_widget)
+
+        self.update_graph()
+        self.graphReady.emit()
+
+
+    @instrumented('view.update_graph')
+    def update_graph(self):
+        '''Обновить график'''
+
+        # До построения графика обновлять нечего, данные будут показаны при его построении
+        if self.graph_plot is None:
+            return
 
-            # Создание нового двухмерного массива вида (level, level sum)
-            result_array = numpy.column_stack((levels, level_sums))
+        # Средние значения элементов по уровням из накопителей модели, без обхода дерева
+        levels, level_averages = self.model.level_averages()
 
-            # Построение графика
-            self.graph_widget.plot(result_array[:, 0], result_array[:, 1])
\ No newline at end of file
+        # Обновление данных существующей кривой графика
+        self.graph_plot.setData(levels, level_averages)
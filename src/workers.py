@@ -0,0 +1,206 @@
+import threading
+
+from PyQt5 import QtCore
+
+from src.diff import TreeDiff, diff_trees
+from src.instrumentation import PROFILER
+from src.tools import Progress, StorePatch, SyncedFile, gen_random_flat_tree, hdf5_synced_file, read_tree, write_store, write_tree
+from src.tree_store import FlatTree, TreeStore
+
+
+class TaskCancelled(Exception):
+    '''Исключение, прерывающее выполнение отмененной фоновой задачи'''
+
+
+class TaskSignals(QtCore.QObject):
+    '''Сигналы фоновой задачи (QRunnable не является QObject и не может иметь сигналов)'''
+
+    # Процент выполнения задачи
+    progress = QtCore.pyqtSignal(int)
+
+    # Результат успешно выполненной задачи
+    finished = QtCore.pyqtSignal(object)
+
+    # Текст ошибки, прервавшей выполнение задачи
+    failed = QtCore.pyqtSignal(str)
+
+    cancelled = QtCore.pyqtSignal()
+
+
+class Task(QtCore.QRunnable):
+    '''Базовый класс фоновой задачи, выполняемой в QThreadPool'''
+
+    def __init__(self):
+        super().__init__()
+
+        self.signals = TaskSignals()
+        self.cancel_event = threading.Event()
+        self.percent = -1
+
+
+    def cancel(self):
+        '''Запросить отмену задачи, задача прервется при следующем уведомлении о ходе выполнения'''
+
+        self.cancel_event.set()
+
+
+    def report(self, percent: int):
+        '''Уведомить о ходе выполнения задачи, прервать ее, если запрошена отмена'''
+
+        if self.cancel_event.is_set():
+            raise TaskCancelled()
+
+        if percent != self.percent:
+            self.percent = percent
+            self.signals.progress.emit(percent)
+
+
+    def stage(self, start: int, end: int) -> Progress:
+        '''Получить функцию уведомления о ходе этапа задачи, занимающего проценты от start до end'''
+
+        def progress(done: int, total: int):
+            self.report(start + (end - start) * done // total if total else end)
+
+        return progress
+
+
+    def run(self):
+
+        try:
+            with PROFILER.timed(f'task.{type(self).__name__}'):
+                result = self.work()
+        except TaskCancelled:
+            self.signals.cancelled.emit()
+        except Exception as error:
+            self.signals.failed.emit(str(error))
+        else:
+            self.signals.finished.emit(result)
+
+
+    def work(self):
+        '''Выполнить задачу в фоновом потоке и вернуть результат'''
+
+        raise NotImplementedError
+
+
+class FileTask(Task):
+    '''Базовый класс фоновой задачи работы с файлом'''
+
+    def __init__(self, file_path: str, file_type: str):
+        super().__init__()
+
+        self.file_path = file_path
+
+        # Тип файла в виде фильтра диалогового окна: '*.json', '*.hdf5' или '*.tree'
+        self.file_type = file_type
+
+
+class GenerateTask(Task):
+    '''Генерация рандомного дерева и построение хранилища в фоновом потоке'''
+
+    def __init__(self, size: int, seed: int | None = None):
+        super().__init__()
+
+        self.size = size
+        self.seed = seed
+
+
+    def work(self) -> TreeStore:
+
+        flat = gen_random_flat_tree(self.size, self.seed)
+        self.report(60)
+
+        store = TreeStore()
+        store.load_flat(flat)
+        self.report(100)
+
+        return store
+
+
+class LoadTask(FileTask):
+    '''Чтение файла и построение хранилища дерева в фоновом потоке'''
+
+    def __init__(self, file_path: str, file_type: str):
+        super().__init__(file_path, file_type)
+
+        # Прочитанный файл hdf5 в формате хранилища, в который возможна частичная запись
+        self.synced_file: SyncedFile | None = None
+
+
+    def work(self) -> TreeStore:
+
+        # Хранилище строится здесь же, в GUI потоке остается только замена хранилища модели
+        store = read_tree(self.file_path, self.file_type, self.stage(0, 90))
+
+        if self.file_type == '*.hdf5':
+            self.synced_file = hdf5_synced_file(self.file_path)
+
+        self.report(100)
+
+        return store
+
+
+class SaveTask(FileTask):
+    '''Запись снимка данных дерева в файл в фоновом потоке'''
+
+    def __init__(self, file_path: str, file_type: str, flat: FlatTree, compact: bool = False):
+        super().__init__(file_path, file_type)
+        self.flat = flat
+
+        # Запись JSON без отступов и переносов строк
+        self.compact = compact
+
+
+    def work(self) -> str:
+
+        write_tree(self.file_path, self.file_type, self.flat, self.compact, self.stage(0, 100))
+
+        return self.file_path
+
+
+class StoreSaveTask(FileTask):
+    '''Запись снимка хранилища дерева в файл hdf5 в фоновом потоке, полностью или только изменений'''
+
+    def __init__(self, file_path: str, patch: StorePatch, base: SyncedFile | None = None):
+        super().__init__(file_path, '*.hdf5')
+
+        self.patch = patch
+
+        # Файл, поверх которого записываются изменения, None - полная запись
+        self.base = base
+
+
+    def work(self) -> SyncedFile:
+
+        # Частичная запись не прерывается: отмена на середине оставила бы файл незавершенным
+        progress = self.stage(0, 100) if self.base is None else None
+        synced_file = write_store(self.file_path, self.patch, self.base, progress)
+
+        # Файл уже записан: отмена, запрошенная после записи, не действует, иначе журнал не перейдет на новый файл
+        self.signals.progress.emit(100)
+
+        return synced_file
+
+
+class CompareTask(Task):
+    '''Чтение двух файлов деревьев и расчет их различий в фоновом потоке'''
+
+    def __init__(self, files: list[tuple[str, str]]):
+        super().__init__()
+
+        # Пути и типы (фильтры диалогового окна) первого и второго файлов
+        self.files = files
+
+
+    def work(self) -> TreeDiff:
+
+        (first_path, first_type), (second_path, second_type) = self.files
+
+        first = read_tree(first_path, first_type, self.stage(0, 40))
+        second = read_tree(second_path, second_type, self.stage(40, 80))
+        self.report(80)
+
+        diff = diff_trees(first, second)
+        self.report(100)
+
+        return diff
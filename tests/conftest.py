@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+# Тесты моделей и представлений выполняются без дисплея
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+
+@pytest.fixture(scope='session')
+def qapp():
+    from PyQt5 import QtWidgets
+
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def store_problems(store) -> list[str]:
+    '''Расхождения хранилища дерева с пересчетом по его структуре: родители, строки, уровни, суммы, накопители уровней'''
+
+    import numpy
+
+    problems = []
+    sums = numpy.zeros(store.size, dtype=numpy.int64)
+    levels: dict[int, list[int]] = {}
+
+    # Обход в прямом порядке, суммы - на обратном пути
+    order = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+
+        children = store.children_of(node)
+        for row, child in enumerate(children.tolist()):
+            if store.parent[child] != node or store.row[child] != row or store.depth[child] != store.depth[node] + 1:
+                problems.append(f'структура элемента {child}')
+        stack.extend(children.tolist())
+
+    for node in reversed(order):
+        children = store.children_of(node)
+        sums[node] = sums[children].sum() if len(children) else store.value[node]
+        if store.sum[node] != sums[node]:
+            problems.append(f'сумма элемента {node}')
+        if node:
+            levels.setdefault(int(store.depth[node]), []).append(node)
+
+    if len(order) - 1 != len(store):
+        problems.append('количество элементов')
+
+    for depth in range(len(store.level_count)):
+        nodes = levels.get(depth, [])
+        if store.level_count[depth] != len(nodes) or store.level_sum[depth] != sums[nodes].sum():
+            problems.append(f'накопители уровня {depth}')
+
+    return problems
+
+
+@pytest.fixture
+def check_store():
+    '''Проверка согласованности хранилища дерева'''
+
+    def check(store):
+        assert store_problems(store) == []
+
+    return check
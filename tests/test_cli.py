@@ -0,0 +1,53 @@
+import json
+
+from src.cli import main, parse_fanout
+
+
+def run(capsys, *argv: str) -> tuple[int, object]:
+    '''Выполнить команду с выводом в формате JSON: код завершения и результаты'''
+
+    code = main([*argv, '--json'])
+    return code, json.loads(capsys.readouterr().out)
+
+
+def test_generate_convert_stats(capsys, tmp_path):
+    paths = [str(tmp_path / name) for name in ('first.json', 'second.hdf5', 'third.tree')]
+
+    # Один seed для всех форматов - одно и то же дерево
+    for path in paths:
+        code, results = run(capsys, 'generate', path, '--size', '3000', '--seed', '5', '--depth', '3', '--fanout', '2-6', '-j', '1')
+        assert code == 0 and results[0]['nodes'] == 3000
+
+    code, stats = run(capsys, 'stats', *paths, '-j', '1')
+    assert code == 0
+    assert all({**item, 'file': None} == {**stats[0], 'file': None} for item in stats)
+    assert stats[0]['nodes'] == 3000 and stats[0]['levels'] == [0, 1, 2, 3]
+
+    # Конвертация каталога с выбором типа результата
+    code, results = run(capsys, 'convert', str(tmp_path), '-o', str(tmp_path / 'out'), '--to', 'tree', '-j', '2')
+    assert code == 0 and sorted(item['target'].rsplit('/', 1)[1] for item in results) == ['first.tree', 'second.tree', 'third.tree']
+
+    code, results = run(capsys, 'convert', paths[2], '-o', str(tmp_path / 'copy.json'), '--compact', '-j', '1')
+    assert code == 0 and results[0]['nodes'] == 3000
+
+    code, changes = run(capsys, 'diff', paths[0], str(tmp_path / 'copy.json'))
+    assert code == 0 and changes[0]['changes'] == []
+
+
+def test_diff_and_errors(capsys, tmp_path):
+    first, second, broken = tmp_path / 'first.json', tmp_path / 'second.json', tmp_path / 'broken.json'
+    first.write_text('[[1, 2], 3, [4]]')
+    second.write_text('[[1, 5], 3, [4], 6]')
+    broken.write_text('[[1, 2], 3')
+
+    code, results = run(capsys, 'diff', str(first), str(second))
+    assert code == 0
+    assert [(change['status'], change['path'], change['delta']) for change in results[0]['changes']] == [
+        ('changed', [0], 3), ('changed', [0, 1], 3), ('added', [3], 6),
+    ]
+
+    # Ошибка одного файла не прерывает обработку остальных, код завершения - 1
+    code, results = run(capsys, 'stats', str(first), str(broken), '-j', '1')
+    assert code == 1 and results[0]['sum'] == 10 and 'error' in results[1]
+
+    assert parse_fanout('3-10') == (3, 10) and parse_fanout('5') == (5, 5)
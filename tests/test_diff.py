@@ -0,0 +1,75 @@
+import numpy
+
+from src.diff import DIFF_ADDED, DIFF_CHANGED, DIFF_REMOVED, diff_summary, diff_trees, subtree_hashes
+from src.tools import gen_random_flat_tree
+from src.tree_store import TreeStore
+
+
+def store_of(data: list) -> TreeStore:
+
+    store = TreeStore()
+    store.load_nested(data)
+    return store
+
+
+def entries(first: list, second: list) -> list[tuple]:
+    '''Записи различий: уровень, состояние, строка, суммы в деревьях'''
+
+    diff = diff_trees(store_of(first), store_of(second))
+    return list(zip(*(column.tolist() for column in (diff.levels, diff.status, diff.rows, diff.first_sum, diff.second_sum))))
+
+
+def test_equal_trees():
+    flat = gen_random_flat_tree(3000, 2)
+    first, second = TreeStore(), TreeStore()
+    first.load_flat(flat)
+    second.load_flat(flat)
+
+    # Хеши не зависят от идентификаторов элементов: после удаления и вставки дерево совпадает
+    removed = second.to_flat(second.children_of(0)[[3]])
+    second.remove_rows(0, numpy.array([3]))
+    second.insert_flat(0, 3, removed)
+
+    assert subtree_hashes(first)[0] == subtree_hashes(second)[0]
+    assert len(diff_trees(first, second).levels) == 0
+    assert diff_summary(diff_trees(first, second)) == {'changed': 0, 'added': 0, 'removed': 0}
+
+
+def test_changed_added_removed():
+    first = [[1, 2], 3, 7, [4, [5, 6]]]
+    second = [[1, 2], 7, [4, [5, 9]], 10]
+
+    # Совпадающие поддеревья пропускаются, строки - во втором дереве (удаленных - в первом)
+    assert entries(first, second) == [
+        (0, DIFF_REMOVED, 1, 3, 0),
+        (0, DIFF_CHANGED, 2, 15, 18),
+        (1, DIFF_CHANGED, 1, 11, 14),
+        (2, DIFF_CHANGED, 1, 6, 9),
+        (0, DIFF_ADDED, 3, 0, 10),
+    ]
+
+    # Замененные строки сопоставляются по порядку
+    assert entries([3, [4, 5]], [[4, 6], 8]) == [
+        (0, DIFF_CHANGED, 0, 3, 10), (1, DIFF_ADDED, 0, 0, 4), (1, DIFF_ADDED, 1, 0, 6),
+        (0, DIFF_CHANGED, 1, 9, 8), (1, DIFF_REMOVED, 0, 4, 0), (1, DIFF_REMOVED, 1, 5, 0),
+    ]
+
+    # "Лепесток" и "Узел" с той же суммой различаются, перестановка потомков - добавление и удаление
+    assert entries([3], [[3]]) == [(0, DIFF_CHANGED, 0, 3, 3), (1, DIFF_ADDED, 0, 0, 3)]
+    assert entries([[1, 2]], [[2, 1]]) == [(0, DIFF_CHANGED, 0, 3, 3), (1, DIFF_ADDED, 0, 0, 2), (1, DIFF_REMOVED, 1, 2, 0)]
+
+
+def test_large_diff_summary():
+    first = TreeStore()
+    first.load_flat(gen_random_flat_tree(20000, 4))
+    second = TreeStore.from_arrays({name: array.copy() for name, array in first.to_arrays().items()})
+
+    # Изменение одного "Лепестка" затрагивает только его и предков
+    leaf = int(numpy.flatnonzero(second.child_count[1:second.size] == 0)[100]) + 1
+    second.set_value(leaf, int(second.value[leaf]) + 1)
+    second.propagate_many({leaf: 1})
+
+    diff = diff_trees(first, second)
+    assert diff.second.tolist() == (second.ancestors(leaf)[::-1] + [leaf])
+    assert (diff.second_sum - diff.first_sum).tolist() == [1] * len(diff.levels)
+    assert diff_summary(diff) == {'changed': len(diff.levels), 'added': 0, 'removed': 0}
@@ -0,0 +1,79 @@
+import json
+import pstats
+
+import pytest
+
+from src.instrumentation import PROFILER, Profiler, instrumented
+from src.models import TreeViewModel
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    '''Общий сборщик замеров, включенный на время теста'''
+
+    PROFILER.configure(enabled=True, profile_dir=str(tmp_path))
+    PROFILER.reset()
+    yield PROFILER
+    PROFILER.configure(enabled=False)
+    PROFILER.capture = None
+    PROFILER.reset()
+
+
+def test_timed_and_dump(tmp_path):
+    profiler = Profiler(enabled=True, profile_dir=str(tmp_path), capture='second')
+
+    with profiler.timed('first', 3):
+        pass
+    with profiler.timed('first', 4):
+        pass
+    with profiler.timed('second'):
+        sum(range(1000))
+
+    # Ошибка внутри блока тоже учитывается как вызов
+    with pytest.raises(ZeroDivisionError), profiler.timed('second'):
+        1 / 0
+
+    stats = profiler.snapshot()
+    assert stats['first']['calls'] == 2 and stats['first']['nodes'] == 7
+    assert stats['second']['calls'] == 2 and stats['second']['max'] >= 0
+    assert profiler.summary(1).count('\n') == 0
+
+    # Через cProfile записывается только первый вызов выбранной операции
+    captures = list(tmp_path.glob('second-*.prof'))
+    assert len(captures) == 1 and profiler.capture is None
+    pstats.Stats(str(captures[0]))
+
+    with open(profiler.dump()) as file:
+        assert json.load(file)['operations'] == stats
+
+
+def test_disabled_profiler_records_nothing(tmp_path):
+    profiler = Profiler(profile_dir=str(tmp_path), capture='first')
+
+    with profiler.timed('first'):
+        pass
+
+    assert profiler.snapshot() == {} and profiler.capture == 'first'
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_instrumented_model(qapp, profiler):
+    calls = []
+
+    @instrumented('test.operation', lambda value: value)
+    def operation(value):
+        calls.append(value)
+        return value * 2
+
+    assert operation(5) == 10 and calls == [5]
+
+    model = TreeViewModel()
+    model.load_data([[1, 2], 3])
+    model.setData(model.index(1, 0), 10)
+    model.delete_items([model.index(0, 0, model.index(0, 0))])
+
+    stats = profiler.snapshot()
+    assert stats['test.operation'] == {**stats['test.operation'], 'calls': 1, 'nodes': 5}
+    assert stats['model.load_flat']['nodes'] == 4
+    assert stats['model.setData']['calls'] == 1
+    assert stats['model.end_batch']['calls'] >= 2
@@ -0,0 +1,173 @@
+import os
+
+import numpy
+
+from src.journal import JOURNAL_HEADER, JOURNAL_RECORD, Autosave, Edit, EditJournal, decode_edit, encode_edit
+from src.models import TreeViewModel
+from src.tree_store import nested_to_flat
+
+
+EDITS = [
+    Edit('set', (0, 1), -5, 7),
+    Edit('insert', (2,), 3, 0, numpy.array([0, 1, 4]), nested_to_flat([[1, [2]], 3, 4])),
+    Edit('remove', (), 0, 0, numpy.array([1, 2]), nested_to_flat([5, [6]])),
+]
+
+
+def same_edit(first: Edit, second: Edit) -> bool:
+    '''Совпадение изменений с учетом массивов'''
+
+    if first[:4] != second[:4] or (first.rows is None) != (second.rows is None):
+        return False
+    if first.rows is not None and not numpy.array_equal(first.rows, second.rows):
+        return False
+    if (first.flat is None) != (second.flat is None):
+        return False
+
+    return first.flat is None or all(numpy.array_equal(a, b) for a, b in zip(first.flat, second.flat))
+
+
+def test_encode_decode():
+    for edit in EDITS:
+        record = encode_edit(edit)
+        decoded = decode_edit(record[JOURNAL_RECORD.size:])
+
+        # Удаленные поддеревья не записываются: при повторе они берутся из дерева
+        assert same_edit(decoded, edit if edit.kind != 'remove' else edit._replace(flat=None))
+
+    assert EDITS[0].inverse() == Edit('set', (0, 1), 7, -5)
+    assert EDITS[1].inverse().kind == 'remove' and EDITS[1].inverse().inverse().kind == 'insert'
+
+
+def test_autosave_recover(tmp_path):
+    base = tmp_path / 'tree.json'
+    base.write_text('[1]')
+
+    autosave = Autosave()
+    autosave.start(str(base))
+    for edit in EDITS:
+        autosave.write(edit)
+    autosave.file.close()
+
+    path = Autosave.journal_path(str(base))
+    assert [edit.kind for edit in Autosave.recover(str(base))] == ['set', 'insert', 'remove']
+
+    # Оборванная последняя запись отбрасывается, предыдущие восстанавливаются
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) - 3)
+    assert [edit.kind for edit in Autosave.recover(str(base))] == ['set', 'insert']
+
+    # Поврежденная запись и все следующие за ней отбрасываются
+    with open(path, 'r+b') as file:
+        file.seek(JOURNAL_HEADER.size + len(Autosave.describe(str(base))) + JOURNAL_RECORD.size)
+        file.write(b'\xff')
+    assert Autosave.recover(str(base)) == []
+
+    # Журнал другого состояния файла дерева не применяется
+    autosave.start(str(base), [encode_edit(EDITS[0])])
+    autosave.close()
+    assert len(Autosave.recover(str(base))) == 1
+    base.write_text('[1, 2]')
+    assert Autosave.recover(str(base)) == []
+
+    # Журнал без изменений удаляется при закрытии
+    autosave.start(str(base))
+    autosave.close()
+    assert not os.path.exists(path)
+
+
+def test_autosave_rebase(tmp_path):
+    first, second = tmp_path / 'first.json', tmp_path / 'second.json'
+    first.write_text('[1]')
+
+    autosave = Autosave()
+    autosave.start(str(first))
+    autosave.write(EDITS[0])
+
+    # Изменения после снимка для сохранения переходят в журнал сохраненного файла
+    autosave.mark()
+    autosave.write(EDITS[1])
+    second.write_text('[2]')
+    autosave.rebase(str(second))
+    autosave.write(EDITS[2])
+    autosave.close()
+
+    assert not os.path.exists(Autosave.journal_path(str(first)))
+    assert [edit.kind for edit in Autosave.recover(str(second))] == ['insert', 'remove']
+
+
+def test_edit_journal_history():
+    journal = EditJournal(limit=3)
+
+    for value in range(5):
+        journal.record(Edit('set', (0,), value, value - 1))
+
+    # Хранятся только последние действия
+    assert [edit.value for edit in journal.undo()] == [3]
+    assert [edit.value for edit in journal.undo()] == [2]
+    assert [edit.value for edit in journal.undo()] == [1]
+    assert journal.undo() == [] and journal.can_redo()
+
+    # Группа отменяется одним действием в обратном порядке, новое действие отменяет повтор
+    with journal.group():
+        journal.record(Edit('set', (0,), 10, 0))
+        with journal.group():
+            journal.record(Edit('set', (1,), 11, 0))
+
+    assert not journal.can_redo()
+    assert [edit.path for edit in journal.undo()] == [(1,), (0,)]
+    assert [edit.path for edit in journal.redo()] == [(0,), (1,)]
+
+
+def test_model_undo_redo_recover(qapp, tmp_path, check_store):
+    base = tmp_path / 'tree.json'
+    base.write_text('[]')
+
+    rng = numpy.random.default_rng(7)
+    data = [[n, [n, n + 1], n + 2] for n in range(60)]
+
+    model = TreeViewModel()
+    model.load_data(data)
+    model.journal.autosave.start(str(base))
+
+    states = [model.get_data()]
+
+    for step in range(40):
+        parent = model.index(int(rng.integers(model.rowCount())), 0)
+        children = model.rowCount(parent)
+        child = model.index(int(rng.integers(children)), 0, parent) if children else parent
+
+        if step % 4 == 0 and not model.setData(child, 100 + step):
+            model.add_item(str(step), child)
+        elif step % 4 == 1:
+            model.add_item(str(step), parent if step % 3 else None)
+        elif step % 4 == 2:
+            rows = sorted({int(row) for row in rng.integers(model.rowCount(), size=3)})
+            model.delete_items([model.index(row, 0) for row in rows] + [child])
+        elif step % 4 == 3:
+            model.delete_item(child)
+
+        # Каждый шаг - одно действие пользователя
+        assert model.journal.position == len(states)
+        states.append(model.get_data())
+
+    # Отмена действий по одному возвращает все промежуточные состояния
+    for state in states[-2::-1]:
+        assert model.undo()
+        assert model.get_data() == state
+    assert not model.undo()
+    check_store(model.store)
+
+    while model.redo():
+        pass
+    assert model.get_data() == states[-1]
+    check_store(model.store)
+
+    # Журнал автосохранения (с отменами и повторами) восстанавливает итоговые данные поверх исходных
+    model.journal.autosave.close()
+    recovered = TreeViewModel()
+    recovered.load_data(data)
+    recovered.recover(Autosave.recover(str(base)))
+
+    assert recovered.get_data() == states[-1]
+    check_store(recovered.store)
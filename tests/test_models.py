@@ -0,0 +1,304 @@
+import h5py
+import numpy
+import pytest
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtTest import QAbstractItemModelTester
+
+from src.models import TreeViewModel
+from src.tree_store import TreeStore
+from src.tools import HDF5_STORE_CHUNK, gen_random_flat_tree, read_tree
+from src.workers import LoadTask, StoreSaveTask
+
+
+def expanded_view(qapp, model: TreeViewModel) -> QtWidgets.QTreeView:
+    '''Представление модели со всеми раскрытыми элементами'''
+
+    view = QtWidgets.QTreeView()
+    view.setModel(model)
+    view.expandAll()
+    view.show()
+    qapp.processEvents()
+
+    return view
+
+
+def model_nested(model: TreeViewModel, parent: QtCore.QModelIndex = QtCore.QModelIndex()) -> list:
+    '''Дерево, видимое через индексы модели: суммы "Лепестков" и вложенные списки "Узлов"'''
+
+    result = []
+    for row in range(model.rowCount(parent)):
+        index = model.index(row, 0, parent)
+        assert model.parent(index) == parent
+        result.append(model_nested(model, index) if model.hasChildren(index) else model.data(index, TreeViewModel.SumRole))
+
+    return result
+
+
+def test_model_structure(qapp, check_store):
+    model = TreeViewModel()
+    QAbstractItemModelTester(model, QAbstractItemModelTester.FailureReportingMode.Fatal)
+    model.load_data([[1, [2, 3]], 4, [[-5, -6]]])
+
+    assert model_nested(model) == [[1, [2, 3]], 4, [[-5, -6]]]
+
+    first = model.index(0, 0)
+    assert model.data(first) == '6' and model.data(model.index(2, 0), TreeViewModel.SumRole) == -11
+    assert model.data(first, QtCore.Qt.BackgroundRole) is None
+    assert model.data(model.index(0, 0, model.index(2, 0)), QtCore.Qt.BackgroundRole) == TreeViewModel.NEGATIVE_BACKGROUND
+
+    # Редактируются только "Лепестки"
+    assert not model.flags(first) & QtCore.Qt.ItemIsEditable
+    assert not model.setData(first, 10)
+    assert not model.setData(model.index(1, 0), 'x')
+
+    # "Лепесток" при добавлении потомка становится "Узлом" со своим значением первым потомком
+    model.add_item('7', model.index(1, 0))
+    model.add_item('8')
+    model.delete_item(model.index(0, 0, first))
+
+    assert model_nested(model) == [[[2, 3]], [4, 7], [[-5, -6]], 8]
+    assert model.get_data() == model_nested(model)
+    check_store(model.store)
+
+
+def test_sums_follow_edits(qapp, check_store):
+    model = TreeViewModel()
+    model.load_data([[[[1, 2], 3], [4]], [5]])
+
+    # Вложенный "Лепесток" четвертого уровня
+    leaf_index = model.index(0, 0, model.index(0, 0, model.index(0, 0, model.index(0, 0))))
+    leaf = model.node_from_index(leaf_index)
+
+    changed = []
+    model.dataChanged.connect(lambda first, last, roles: changed.append((model.node_from_index(first), QtCore.Qt.BackgroundRole in roles)))
+
+    # Сумма "Лепестка" и всех его предков меняется на разницу значений, каждый элемент - одним сигналом
+    assert model.setData(leaf_index, '-20')
+    path = [leaf] + model.store.ancestors(leaf)
+    assert sorted(node for node, _ in changed) == sorted(path)
+    assert model.data(model.index(0, 0), TreeViewModel.SumRole) == -11
+    assert int(model.store.sum[0]) == -6
+    check_store(model.store)
+
+    # Цвет фона сообщается только у "Узла" второго уровня, сменившего знак суммы
+    flipped = [node for node, background in changed if background]
+    assert flipped == [model.node_from_index(model.index(0, 0, model.index(0, 0)))]
+    assert model.data(model.index(0, 0, model.index(0, 0)), QtCore.Qt.BackgroundRole) == TreeViewModel.NEGATIVE_BACKGROUND
+
+    changed.clear()
+    assert model.setData(leaf_index, 1)
+    assert [node for node, background in changed if background] == flipped
+    assert model.store.to_nested() == [[[[1, 2], 3], [4]], [5]]
+    check_store(model.store)
+
+
+def test_propagate_many(check_store):
+    store = TreeStore()
+    store.load_nested([[[1, 2], [3]], [4, [5]]])
+
+    # Изменения нескольких элементов с общими предками: каждый предок обновляется один раз
+    first, second = store.child(store.child(store.child(0, 0), 0), 1), store.child(store.child(0, 1), 0)
+    store.set_value(first, 12)
+    store.set_value(second, 14)
+    touched = store.propagate_many({first: 10, second: 10})
+
+    assert touched == {node: 10 for node in [first, second, store.child(0, 1)] + store.ancestors(first)}
+    assert int(store.sum[0]) == 35
+    check_store(store)
+
+
+def test_lazy_fetch(qapp):
+    model = TreeViewModel(lazy=True, fetch_batch_size=10)
+    QAbstractItemModelTester(model, QAbstractItemModelTester.FailureReportingMode.Fatal)
+    model.load_data([[[n, n + 1] for n in range(25)] for _ in range(25)])
+
+    # Сразу доступна первая порция первого уровня, суммы нераскрытых поддеревьев уже рассчитаны
+    assert model.rowCount() == 10 and model.canFetchMore(QtCore.QModelIndex())
+    first = model.index(0, 0)
+    assert model.hasChildren(first) and model.rowCount(first) == 0
+    assert model.data(first, TreeViewModel.SumRole) == 625
+
+    # Порции передаются по запросу представления до исчерпания потомков
+    model.fetchMore(first)
+    model.fetchMore(first)
+    model.fetchMore(first)
+    assert model.rowCount(first) == 25 and not model.canFetchMore(first)
+    model.fetchMore(first)
+    assert model.rowCount(first) == 25
+
+    # Переход к элементу передает строки до него и до его предков
+    node = model.store.child(model.store.child(model.store.child(0, 17), 23), 1)
+    index = model.reveal(node)
+    assert index.row() == 1 and model.data(index, TreeViewModel.SumRole) == 24
+    assert model.rowCount() == 18 and model.rowCount(index.parent()) == 2
+
+    # Строки, добавленные за пределами полученной порции, появляются при ее получении
+    parent = model.index(17, 0)
+    model.add_item('1000', parent)
+    assert model.rowCount(parent) == 24 and model.store.child_count[model.node_from_index(parent)] == 26
+    assert model.data(parent, TreeViewModel.SumRole) == 1625
+
+    model.fetchMore(parent)
+    assert model.data(model.index(25, 0, parent), TreeViewModel.SumRole) == 1000
+
+
+def test_batch_coalesces_updates(qapp, check_store):
+    model = TreeViewModel()
+    model.load_data([[1, 2, 3], [4, [5, 6]], 7])
+
+    updates = []
+    model.dataUpdated.connect(lambda: updates.append('updated'))
+    model.subtreesUpdated.connect(lambda nodes: updates.append(nodes))
+
+    sums = []
+    model.dataChanged.connect(lambda first, last, roles: sums.append(model.node_from_index(first)))
+
+    first, second = model.index(0, 0), model.index(1, 0)
+    leaf = model.index(0, 0, model.index(1, 0, second))
+    nodes = [model.node_from_index(index) for index in (first, second, leaf)]
+
+    # Изменения внутри пакета: один сигнал dataUpdated, каждая сумма обновляется один раз
+    with model.batch():
+        model.add_item('10', first)
+        model.setData(leaf, 50)
+        model.removeRows(0, 2, first)
+        model.delete_item(model.index(0, 0, second))
+        assert updates == [] and model.data(second, TreeViewModel.SumRole) == 15
+
+    assert updates == ['updated', set(nodes)]
+    assert sorted(sums) == sorted(set(sums)) and set(nodes) <= set(sums)
+    assert model.get_data() == [[3, 10], [[50, 6]], 7]
+    assert model.data(second, TreeViewModel.SumRole) == 56
+    check_store(model.store)
+
+
+def test_delayed_update(qapp):
+    model = TreeViewModel(update_delay=20)
+    model.load_data([1, 2])
+
+    updates = []
+    model.dataUpdated.connect(lambda: updates.append('updated'))
+
+    # Несколько пакетов подряд объединяются в один сигнал после задержки
+    for row in range(2):
+        model.setData(model.index(row, 0), 10)
+    assert updates == []
+
+    timer = QtCore.QElapsedTimer()
+    timer.start()
+    while not updates and timer.elapsed() < 2000:
+        qapp.processEvents()
+
+    assert updates == ['updated']
+
+
+def test_delete_nested_selection(qapp, check_store):
+    model = TreeViewModel()
+    model.load_data([[n, [n, n]] for n in range(30)])
+
+    removed = []
+    model.rowsAboutToBeRemoved.connect(lambda parent, first, last: removed.append((model.node_from_index(parent), first, last)))
+
+    # Выделены "Узлы" со строками из нескольких цифр, их потомки и соседние строки
+    indexes = []
+    for row in (2, 3, 4, 11, 12, 25):
+        index = model.index(row, 0)
+        indexes += [index, model.index(1, 0, index), model.index(0, 0, model.index(1, 0, index))]
+    indexes.append(model.index(1, 0, model.index(20, 0)))
+    top = model.node_from_index(model.index(20, 0))
+
+    model.delete_items(indexes[::-1])
+
+    # Потомки удаляются вместе с выделенными предками, соседние строки - одним диапазоном от последних к первым
+    assert removed == [(0, 25, 25), (0, 11, 12), (0, 2, 4), (top, 1, 1)]
+    assert model.get_data() == [[n, [n, n]] if n != 20 else [20] for n in range(30) if n not in (2, 3, 4, 11, 12, 25)]
+    check_store(model.store)
+
+    # Удаление отменяется одним действием
+    model.undo()
+    assert model.get_data() == [[n, [n, n]] for n in range(30)]
+    check_store(model.store)
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_bulk_delete_with_view(qapp, lazy):
+    model = TreeViewModel(lazy=lazy)
+    model.load_data([[[1, 2], 5, 6] for _ in range(200)])
+    view = expanded_view(qapp, model)
+
+    # Сигналы о цвете фона должны идти только после завершения изменения структуры
+    events = []
+    model.layoutChanged.connect(lambda: events.append('layout'))
+    model.dataChanged.connect(lambda first, last, roles: events.append('background') if QtCore.Qt.BackgroundRole in roles else None)
+
+    # Оба "Лепестка" "Узла" второго уровня в каждом втором элементе: диапазонов больше BULK_DELETE_RANGES
+    indexes = []
+    for row in range(0, 200, 2):
+        node = model.index(0, 0, model.index(row, 0))
+        indexes += [model.index(0, 0, node), model.index(1, 0, node)]
+
+    model.delete_items(indexes)
+    qapp.processEvents()
+
+    assert events.index('background') > events.index('layout')
+    assert model.store.to_nested()[:2] == [[0, 5, 6], [[1, 2], 5, 6]]
+    assert model.data(model.index(0, 0), TreeViewModel.SumRole) == 11
+
+    # Отмена и повтор удаления разрозненных строк тоже идут одним изменением структуры
+    model.undo()
+    qapp.processEvents()
+    assert model.store.to_nested()[:2] == [[[1, 2], 5, 6], [[1, 2], 5, 6]]
+
+    model.redo()
+    qapp.processEvents()
+    assert model.store.to_nested()[:2] == [[0, 5, 6], [[1, 2], 5, 6]]
+
+    view.close()
+
+
+def hdf5_arrays(path: str) -> dict[str, numpy.ndarray]:
+    '''Все наборы данных файла hdf5'''
+
+    with h5py.File(path, 'r') as file:
+        return {name: file[name][()] for name in file}
+
+
+def test_hdf5_incremental_save(qapp, tmp_path):
+    path = str(tmp_path / 'tree.hdf5')
+    model = TreeViewModel()
+    model.load_flat(gen_random_flat_tree(50000, 1))
+
+    # Первая запись - полная, в формате хранилища
+    patch, base = model.store_patch(path)
+    assert base is None
+    model.end_save(path, StoreSaveTask(path, patch, base).work())
+    before = hdf5_arrays(path)
+
+    leaf = int(numpy.flatnonzero(model.store.child_count[1:model.store.size] == 0)[-1]) + 1
+    model.setData(model.index_from_node(leaf), 12345)
+
+    # Повторная запись - только блоков с измененными элементами
+    patch, base = model.store_patch(path)
+    assert base is not None
+    model.end_save(path, StoreSaveTask(path, patch, base).work())
+    after = hdf5_arrays(path)
+
+    # Изменились значение "Лепестка" и суммы его предков, включая корень
+    touched = {node // HDF5_STORE_CHUNK for node in [0, leaf] + model.store.ancestors(leaf)}
+    for name in ('parent', 'row', 'depth', 'value', 'sum', 'child_start', 'child_count', 'children'):
+        changed = numpy.flatnonzero(before[name] != after[name]) // HDF5_STORE_CHUNK
+        assert set(changed.tolist()) <= touched, name
+
+    # Записаны только эти блоки, блоки потомков не записывались
+    written = [(name, len(data)) for name, _, data in patch.slices if name not in ('level_sum', 'level_count')]
+    assert all(name != 'children' and length <= len(touched) * HDF5_STORE_CHUNK for name, length in written)
+    assert after['value'][leaf] == 12345
+
+    saved = read_tree(path, '*.hdf5').to_flat()
+    assert all(numpy.array_equal(a, b) for a, b in zip(model.get_flat(), saved))
+
+    # Прочитанный файл снова записывается частично
+    task = LoadTask(path, '*.hdf5')
+    model.set_store(task.work(), task.synced_file)
+    model.setData(model.index_from_node(leaf), 7)
+    assert model.store_patch(path)[1] is not None
@@ -0,0 +1,73 @@
+import numpy
+import pytest
+
+from src.parallel import build_part, hdf5_split, json_read_part, json_split, merge_parts, run_parts
+from src.tools import gen_random_flat_tree, read_tree, write_tree
+from src.tree_store import TreeStore, nested_to_flat
+
+
+def same_tree(first: TreeStore, second: TreeStore, check_store) -> bool:
+    '''Совпадение деревьев, накопителей уровней и согласованность хранилищ'''
+
+    check_store(first)
+    check_store(second)
+
+    return (
+        all(numpy.array_equal(a, b) for a, b in zip(first.to_flat(), second.to_flat()))
+        and numpy.array_equal(first.level_sum, second.level_sum)
+        and numpy.array_equal(first.level_count, second.level_count)
+    )
+
+
+def test_json_split(tmp_path):
+    path = tmp_path / 'tree.json'
+    path.write_bytes(b' \n[ [1, [2, 3]], 4 ,[[5],6],\n7, [] ]\n ')
+
+    # Отрезки - целые элементы внешнего списка без разделяющих запятых
+    bounds = json_split(str(path), 16)
+    pieces = [path.read_bytes()[start:end].strip() for start, end in bounds]
+    assert pieces == [b'[1, [2, 3]]', b'4', b'[[5],6]', b'7', b'[]']
+
+    assert json_split(str(path), 1) == [(bounds[0][0], bounds[-1][1])]
+
+    path.write_bytes(b'{"a": 1}')
+    with pytest.raises(ValueError):
+        json_split(str(path), 2)
+
+
+def test_merge_parts(check_store):
+    data = [[1, [2, 3]], 4, [[5], 6], 7, [8, [9, [10]]]]
+
+    expected = TreeStore()
+    expected.load_nested(data)
+
+    # Части, собранные в текущем процессе, объединяются в то же хранилище, что и при чтении целиком
+    merged = merge_parts([build_part(nested_to_flat(part)) for part in (data[:2], data[2:3], data[3:])])
+    assert same_tree(merged, expected, check_store)
+    assert merged.to_nested() == data
+
+
+def test_run_parts(tmp_path, check_store):
+    flat = gen_random_flat_tree(20000, 9)
+
+    json_path, hdf5_path = str(tmp_path / 'tree.json'), str(tmp_path / 'tree.hdf5')
+    write_tree(json_path, '*.json', flat, compact=True)
+    write_tree(hdf5_path, '*.hdf5', flat)
+
+    expected = read_tree(json_path, '*.json', jobs=1)
+
+    # Части внешнего списка JSON и отрезки поколоночного формата hdf5 в пуле процессов
+    tasks = [(json_path, start, end) for start, end in json_split(json_path, 6)]
+    assert same_tree(run_parts(json_read_part, tasks, 2), expected, check_store)
+
+    function, tasks = hdf5_split(hdf5_path, 6)
+    assert same_tree(run_parts(function, tasks, 2), expected, check_store)
+
+
+def test_run_parts_error(tmp_path):
+    path = tmp_path / 'tree.json'
+    path.write_bytes(b'[[1, 2], 3,, [4]]')
+
+    # Ошибка разбора одной части прерывает чтение
+    with pytest.raises(ValueError):
+        run_parts(json_read_part, [(str(path), start, end) for start, end in json_split(str(path), 4)], 2)
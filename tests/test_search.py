@@ -0,0 +1,103 @@
+import numpy
+import pytest
+
+from src.search import SearchIndex, parse_query
+from src.tools import gen_random_flat_tree
+from src.tree_store import FlatTree, TreeStore
+
+
+def expected(store: TreeStore, keep) -> list[tuple[int, int]]:
+    '''Суммы и элементы, отобранные перебором всех элементов, по возрастанию суммы'''
+
+    nodes = numpy.flatnonzero(store.parent[1:store.size] != -1) + 1
+    return sorted((int(store.sum[node]), int(node)) for node in nodes if keep(int(store.sum[node])))
+
+
+def found(store: TreeStore, nodes: numpy.ndarray) -> list[tuple[int, int]]:
+
+    return sorted((int(store.sum[node]), int(node)) for node in nodes)
+
+
+def edit(store: TreeStore, index: SearchIndex, rng: numpy.random.Generator):
+    '''Случайное изменение хранилища: значение "Лепестка", вставка или удаление строк'''
+
+    nodes = numpy.flatnonzero(store.parent[1:store.size] != -1) + 1
+    node = int(rng.choice(nodes))
+    parent = int(store.parent[node])
+    action = rng.integers(3)
+
+    if action == 0 and store.is_leaf(node):
+        delta = int(rng.integers(-50, 50))
+        store.set_value(node, int(store.value[node]) + delta)
+        changed = store.propagate_many({node: delta})
+        index.invalidate(changed)
+
+    elif action == 1:
+        values = rng.integers(-50, 50, 3)
+        index.invalidate(store.insert_flat(parent, 0, FlatTree(numpy.zeros(3, dtype=numpy.int32), values, numpy.zeros(3, dtype=numpy.bool_))))
+        index.invalidate(store.propagate_many({parent: int(values.sum())}))
+
+    elif store.child_count[parent] > 1:
+        removed_sum = int(store.sum[node])
+        index.invalidate(store.remove_rows(parent, numpy.array([store.row[node]])))
+        index.invalidate(store.propagate_many({parent: -removed_sum}))
+
+
+@pytest.mark.parametrize('overlay_limit', [8, 4096])
+def test_search_after_edits(monkeypatch, overlay_limit):
+    monkeypatch.setattr(SearchIndex, 'OVERLAY_LIMIT', overlay_limit)
+    rng = numpy.random.default_rng(1)
+
+    store = TreeStore()
+    store.load_flat(gen_random_flat_tree(3000, 1))
+    index = SearchIndex(store)
+    index.refresh()
+
+    for step in range(200):
+        edit(store, index, rng)
+
+        low, high = sorted(rng.integers(-200, 200, 2).tolist())
+        assert found(store, index.range(low, high)) == expected(store, lambda value: low <= value <= high)
+        assert found(store, index.exact(low)) == expected(store, lambda value: value == low)
+
+        everything = expected(store, lambda value: True)
+        assert [int(store.sum[node]) for node in index.top(10)] == [value for value, _ in everything[::-1][:10]]
+        assert [int(store.sum[node]) for node in index.top(10, largest=False)] == [value for value, _ in everything[:10]]
+
+        leaves = index.top(5, kind='leaves')
+        assert len(leaves) == 5 and all(store.is_leaf(node) for node in leaves)
+
+    # Результаты отсортированы по сумме
+    sums = store.sum[index.range()]
+    assert (numpy.diff(sums) >= 0).all()
+
+
+def test_small_edit_keeps_main_arrays():
+    store = TreeStore()
+    store.load_flat(gen_random_flat_tree(10000, 2))
+    index = SearchIndex(store)
+    index.refresh()
+    keys = index.keys
+
+    leaf = int(numpy.flatnonzero(store.child_count[1:store.size] == 0)[0]) + 1
+    delta = 10 ** 12 - int(store.value[leaf])
+    store.set_value(leaf, 10 ** 12)
+    index.invalidate(store.propagate_many({leaf: delta}))
+
+    # Правка одного "Лепестка" не переписывает основные массивы
+    assert index.top(1)[0] in [leaf] + store.ancestors(leaf)
+    assert index.keys is keys
+
+
+def test_parse_query():
+    store = TreeStore()
+    store.load_nested([[1, 2], 3, -4])
+    index = SearchIndex(store)
+
+    assert found(store, parse_query('3')(index, 'all')) == expected(store, lambda value: value == 3)
+    assert found(store, parse_query('..0')(index, 'all')) == expected(store, lambda value: value <= 0)
+    assert found(store, parse_query('> 2')(index, 'leaves')) == [(3, int(store.child(0, 1)))]
+    assert len(parse_query('top 2')(index, 'all')) == 2
+
+    with pytest.raises(ValueError):
+        parse_query('abc')
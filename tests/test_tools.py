@@ -0,0 +1,80 @@
+import gc
+import io
+import json
+import os
+
+import numpy
+import pytest
+
+import src.tools
+from src.tools import gen_random_flat_tree, json_flat_chunks, json_read_flat, native_read, write_tree
+from src.tree_store import flat_to_nested, nested_to_flat
+
+
+def is_mapped(path: str) -> bool:
+    '''Отображен ли файл в память процесса (по /proc/self/maps, только Linux)'''
+
+    with open('/proc/self/maps') as maps:
+        return any(line.rstrip().endswith(os.path.realpath(path)) for line in maps)
+
+
+def test_native_save_to_same_path(tmp_path):
+    path = str(tmp_path / 'tree.tree')
+    write_tree(path, '*.tree', gen_random_flat_tree(1000, 1))
+
+    store = native_read(path)
+    assert store.mapped_path == path
+
+    # Запись в другой файл отображение не освобождает
+    store.detach(str(tmp_path / 'other.tree'))
+    assert store.mapped_path == path
+
+    store.detach(path)
+    gc.collect()
+    assert store.mapped_path is None
+    if os.path.exists('/proc/self/maps'):
+        assert not is_mapped(path)
+
+    # Измененные данные записываются поверх прочитанного файла
+    leaf = int(numpy.flatnonzero((store.child_count[:store.size] == 0) & (store.parent[:store.size] == 0))[0])
+    store.set_value(leaf, 12345)
+    store.update_sum(leaf)
+    flat = store.to_flat()
+    write_tree(path, '*.tree', flat)
+
+    saved = native_read(path).to_flat()
+    assert all(numpy.array_equal(a, b) for a, b in zip(flat, saved))
+
+
+def read_json(text: str, block: int, monkeypatch) -> list:
+    '''Прочитать текст JSON потоковым чтением блоками по block байт'''
+
+    monkeypatch.setattr(src.tools, 'JSON_IO_BLOCK', block)
+    return flat_to_nested(json_read_flat(io.BytesIO(text.encode())))
+
+
+@pytest.mark.parametrize('block', [1, 3, 1 << 20])
+def test_json_read(monkeypatch, block):
+    data = [[1, [-2, []], 30], [], 9223372036854775807, -9223372036854775808, 0, [[-0]]]
+
+    for text in (json.dumps(data), json.dumps(data, indent='    '), json.dumps(data, separators=(',', ':'))):
+        assert read_json(text, block, monkeypatch) == data
+
+
+@pytest.mark.parametrize('text', [
+    '[1 2]', '[,1]', '[1,,2]', '[[1]2]', '[1,]', '[1],', '[]1', '[1]]', '[[1]', '{}', '[1.5]', '[-]', '[1-2]',
+    '[01]', '[-01]', '[9223372036854775808]', '[-9223372036854775809]', '[12345678901234567890]',
+])
+@pytest.mark.parametrize('block', [1, 1 << 20])
+def test_json_read_rejects(monkeypatch, text, block):
+    with pytest.raises(ValueError):
+        read_json(text, block, monkeypatch)
+
+
+def test_json_write():
+    data = [[1, [-2, []], 30], [], [[5]], 7]
+    flat = nested_to_flat(data)
+
+    assert ''.join(json_flat_chunks(flat, block=2)) == json.dumps(data, indent='    ')
+    assert ''.join(json_flat_chunks(flat, None, block=2)) == json.dumps(data, separators=(',', ':'))
+    assert ''.join(json_flat_chunks(nested_to_flat([]))) == '[]'
@@ -0,0 +1,91 @@
+import numpy
+import pytest
+
+from src.tools import gen_random_flat_tree
+from src.tree_store import FlatTree, TreeStore, flat_parents, flat_to_nested, nested_to_flat
+
+
+DATA = [[1, [2, 3], []], 4, [[-5]], []]
+
+
+def test_nested_flat_roundtrip():
+    flat = nested_to_flat(DATA)
+
+    assert flat.levels.tolist() == [0, 1, 1, 2, 2, 1, 0, 0, 1, 2, 0]
+    assert flat_to_nested(flat) == DATA
+    assert flat_parents(flat.levels).tolist() == [-1, 0, 0, 2, 2, 0, -1, -1, 7, 8, -1]
+
+
+def test_load_and_export(check_store):
+    store = TreeStore()
+    store.load_nested(DATA)
+    check_store(store)
+
+    # "Узел" без потомков хранится как "Лепесток" со значением 0
+    assert len(store) == 11
+    assert store.to_nested() == [[1, [2, 3], 0], 4, [[-5]], 0]
+    assert int(store.sum[0]) == 5
+
+    # Сумма "Узла" - сумма его поддерева, пустой "Узел" - ноль
+    first = store.child(0, 0)
+    assert int(store.sum[first]) == 6
+    assert store.is_leaf(store.child(0, 1)) and not store.is_leaf(first)
+
+    levels, averages = store.level_averages()
+    assert levels.tolist() == [0, 1, 2]
+    assert averages[0] == pytest.approx((6 + 4 - 5 + 0) / 4)
+
+
+def test_arrays_roundtrip(check_store):
+    store = TreeStore()
+    store.load_flat(gen_random_flat_tree(5000, 3))
+
+    copy = TreeStore.from_arrays({name: array.copy() for name, array in store.to_arrays().items()})
+    check_store(copy)
+    assert all(numpy.array_equal(a, b) for a, b in zip(store.to_flat(), copy.to_flat()))
+
+
+def test_edits_keep_store_consistent(check_store):
+    rng = numpy.random.default_rng(3)
+    store = TreeStore()
+    store.load_flat(gen_random_flat_tree(2000, 4))
+
+    for step in range(300):
+        alive = numpy.flatnonzero(store.parent[1:store.size] != -1) + 1
+        node = int(rng.choice(alive))
+        action = rng.integers(3)
+
+        if action == 0:
+            flat = nested_to_flat([int(rng.integers(-9, 9)), [int(rng.integers(-9, 9)), []]])
+            row = int(rng.integers(store.child_count[node] + 1)) if not store.is_leaf(node) else 0
+            if store.is_leaf(node):
+                store.set_value(node, 0)
+            store.insert_flat(node, row, flat)
+            store.propagate_many({node: int(store.sum[store.children_of(node)].sum()) - int(store.sum[node])})
+
+        elif action == 1 and store.is_leaf(node):
+            value = int(rng.integers(-100, 100))
+            delta = value - int(store.value[node])
+            store.set_value(node, value)
+            store.propagate_many({node: delta})
+
+        elif store.child_count[node] > 0:
+            rows = numpy.flatnonzero(rng.random(int(store.child_count[node])) < 0.5)
+            if len(rows) == 0:
+                continue
+            removed_sum = int(store.sum[store.children_of(node)[rows]].sum())
+            store.remove_rows(node, rows)
+            if store.is_leaf(node):
+                store.set_value(node, 0)
+            store.propagate_many({node: -removed_sum})
+
+        if step % 50 == 0:
+            check_store(store)
+
+    check_store(store)
+
+    # После уплотнения блоков потомков дерево не меняется
+    before = store.to_nested()
+    store.compact_children(trim=True)
+    check_store(store)
+    assert store.to_nested() == before
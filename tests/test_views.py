@@ -0,0 +1,126 @@
+import os
+
+import pytest
+from PyQt5 import QtWidgets
+
+from src.journal import Autosave
+from src.models import TreeViewModel
+from src.views import MainView
+
+
+@pytest.fixture
+def dialogs(monkeypatch, tmp_path):
+    '''Ответы диалоговых окон: путь к файлу дерева и текст кнопки окна восстановления'''
+
+    answers = {'path': str(tmp_path / 'tree.json'), 'button': None, 'warnings': []}
+
+    def exec_(box):
+        assert {button.text() for button in box.buttons()} == {'Восстановить', 'Удалить'}
+        next(button for button in box.buttons() if button.text() == answers['button']).click()
+        return 0
+
+    monkeypatch.setattr(QtWidgets.QFileDialog, 'getOpenFileName', lambda *args: (answers['path'], '*.json'))
+    monkeypatch.setattr(QtWidgets.QFileDialog, 'getSaveFileName', lambda *args: (answers['path'], '*.json'))
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'exec_', exec_)
+    monkeypatch.setattr(QtWidgets.QMessageBox, 'warning', lambda parent, title, text: answers['warnings'].append(text))
+
+    return answers
+
+
+def wait(qapp, view: MainView):
+    '''Дождаться завершения фоновой задачи'''
+
+    while view.task is not None:
+        qapp.processEvents()
+
+
+def crashed_session(qapp, dialogs) -> list:
+    '''Сохранить файл, изменить данные и оставить журнал, как после сбоя; вернуть данные с изменениями'''
+
+    view = MainView(TreeViewModel())
+    view.model.load_data([[1, 2], 3, 4])
+    view.save_data()
+    wait(qapp, view)
+
+    view.model.add_item('5')
+    view.model.delete_item(view.model.index(1, 0))
+    data = view.model.get_data()
+
+    # Журнал остается открытым, как при аварийном завершении
+    view.model.journal.autosave.file.close()
+    view.model.journal.autosave.file = None
+    assert len(Autosave.recover(dialogs['path'])) == 2
+
+    return data
+
+
+def load(qapp, dialogs, button: str) -> MainView:
+    dialogs['button'] = button
+    view = MainView(TreeViewModel())
+    view.load_data()
+    wait(qapp, view)
+
+    # Повторное чтение файла после неудачного восстановления
+    wait(qapp, view)
+
+    return view
+
+
+def test_recover_journal(qapp, dialogs):
+    data = crashed_session(qapp, dialogs)
+
+    view = load(qapp, dialogs, 'Восстановить')
+    assert view.model.get_data() == data
+
+    # Восстановленные изменения остаются в новом журнале вместе с изменениями этого сеанса
+    view.model.add_item('6')
+    assert len(Autosave.recover(dialogs['path'])) == 3
+
+
+def test_discard_journal(qapp, dialogs):
+    crashed_session(qapp, dialogs)
+
+    view = load(qapp, dialogs, 'Удалить')
+    assert view.model.get_data() == [[1, 2], 3, 4]
+    assert Autosave.recover(dialogs['path']) == []
+
+    # Изменения нового сеанса защищены журналом
+    view.model.add_item('6')
+    assert len(Autosave.recover(dialogs['path'])) == 1
+
+
+def test_failed_recovery(qapp, dialogs, monkeypatch):
+    crashed_session(qapp, dialogs)
+
+    # Ошибка после части изменений
+    def recover(model, edits):
+        model.apply_edits(edits[:1])
+        raise ValueError('ошибка')
+
+    monkeypatch.setattr(TreeViewModel, 'recover', recover)
+
+    view = load(qapp, dialogs, 'Восстановить')
+    assert dialogs['warnings']
+
+    # Частично восстановленные изменения отброшены, журнал отложен, новый сеанс ведет свой журнал
+    assert view.model.get_data() == [[1, 2], 3, 4]
+    assert os.path.exists(Autosave.journal_path(dialogs['path']) + '.failed')
+    view.model.add_item('6')
+    assert len(Autosave.recover(dialogs['path'])) == 1
+
+
+def test_save_while_task_running(qapp, dialogs):
+    view = MainView(TreeViewModel())
+    view.model.load_data([[1, 2], 3])
+
+    # Пока выполняется другая задача, сохранение не начинается и журнал не отмечается
+    view.task = object()
+    view.save_data()
+    assert view.model.journal.autosave.pending is None
+    assert not os.path.exists(dialogs['path'])
+
+    view.task = None
+    view.save_data()
+    wait(qapp, view)
+    assert view.model.journal.autosave.pending is None
+    assert os.path.exists(dialogs['path'])
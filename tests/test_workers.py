@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+from src.tools import read_tree, store_patch
+from src.tree_store import TreeStore
+from src.workers import StoreSaveTask, TaskCancelled
+
+
+def test_store_save_cancel(tmp_path):
+    path = str(tmp_path / 'tree.hdf5')
+    store = TreeStore()
+    store.load_nested([[1, 2], 3])
+
+    # Отмена до записи: файл не создается
+    task = StoreSaveTask(path, store_patch(store, None))
+    task.cancel()
+    with pytest.raises(TaskCancelled):
+        task.work()
+    assert not os.path.exists(path)
+
+    base = StoreSaveTask(path, store_patch(store, None)).work()
+
+    # Частичная запись не прерывается, запрошенная отмена не отменяет уже записанный файл
+    store.set_value(store.child(0, 1), 10)
+    task = StoreSaveTask(path, store_patch(store, store.take_changes()), base)
+    task.cancel()
+    synced_file = task.work()
+
+    assert synced_file.matches(path)
+    assert read_tree(path, '*.hdf5').to_nested() == [[1, 2], 10]